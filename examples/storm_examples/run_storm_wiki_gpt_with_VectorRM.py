@@ -37,6 +37,7 @@ from knowledge_storm import (
 from knowledge_storm.rm import VectorRM
 from knowledge_storm.lm import OpenAIModel, AzureOpenAIModel
 from knowledge_storm.utils import load_api_key, QdrantVectorStoreManager
+from knowledge_storm.vector_index import LocalVectorIndex
 
 
 def main(args):
@@ -97,7 +98,19 @@ def main(args):
     )
 
     # Create / update the vector store with the documents in the csv file
-    if args.csv_file_path:
+    if args.csv_file_path and args.vector_db_mode == "local":
+        LocalVectorIndex.create_from_csv(
+            index_dir=args.offline_vector_db_dir,
+            file_path=args.csv_file_path,
+            content_column="content",
+            title_column="title",
+            url_column="url",
+            desc_column="description",
+            batch_size=args.embed_batch_size,
+            embedding_model=args.embedding_model,
+            device=args.device,
+        )
+    elif args.csv_file_path:
         kwargs = {
             "file_path": args.csv_file_path,
             "content_column": "content",
@@ -129,8 +142,11 @@ def main(args):
         k=engine_args.search_top_k,
     )
 
-    # initialize the vector store, either online (store the db on Qdrant server) or offline (store the db locally):
-    if args.vector_db_mode == "offline":
+    # initialize the vector store, either online (store the db on Qdrant server), offline (store the db locally) or
+    # local (memory-mapped index without Qdrant):
+    if args.vector_db_mode == "local":
+        rm.init_local_vector_index(index_dir=args.offline_vector_db_dir)
+    elif args.vector_db_mode == "offline":
         rm.init_offline_vector_db(vector_store_path=args.offline_vector_db_dir)
     elif args.vector_db_mode == "online":
         rm.init_online_vector_db(
@@ -192,14 +208,14 @@ if __name__ == "__main__":
     parser.add_argument(
         "--vector-db-mode",
         type=str,
-        choices=["offline", "online"],
-        help="The mode of the Qdrant vector store (offline or online).",
+        choices=["offline", "online", "local"],
+        help="The mode of the vector store (offline or online Qdrant, or a local memory-mapped index).",
     )
     parser.add_argument(
         "--offline-vector-db-dir",
         type=str,
         default="./vector_store",
-        help="If use offline mode, please provide the directory to store the vector store.",
+        help="If use offline or local mode, please provide the directory to store the vector store.",
     )
     parser.add_argument(
         "--online-vector-db-url",
@@ -126,5 +126,6 @@ def create_costorm_runner_from_dict(data, callback_handler: CoStormBaseCallbackH
         knowledge_base_lm=runner.lm_config.knowledge_base_lm,
         node_expansion_trigger_count=runner.runner_argument.node_expansion_trigger_count,
         encoder=runner.encoder,
+        max_thread=runner.runner_argument.max_thread_num,
     )
     return runner
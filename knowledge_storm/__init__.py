@@ -1,10 +1,182 @@
-from .storm_wiki import *
-from .collaborative_storm import *
-from .encoder import *
-from .interface import *
-from .lm import *
-from .rm import *
-from .utils import *
-from .dataclass import *
+from .lazy_loader import attach_lazy_loader
+
+# Submodules are imported on first attribute access to keep `import knowledge_storm` fast.
+_LAZY_SUBMODULE_ATTRS = {
+    ".storm_wiki.artifact_store": [
+        "ArtifactStore",
+        "InMemoryArtifactStore",
+        "LocalFileSystemArtifactStore",
+        "SQLiteArtifactStore",
+        "LocalObjectStoreArtifactStore",
+    ],
+    ".storm_wiki.engine": [
+        "STORMWikiLMConfigs",
+        "STORMWikiRunnerArguments",
+        "STORMWikiRunner",
+    ],
+    ".storm_wiki.modules.knowledge_curation": [
+        "script_dir",
+        "ConvSimulator",
+        "WikiWriter",
+        "AskQuestion",
+        "AskQuestionWithPersona",
+        "QuestionToQuery",
+        "AnswerQuestion",
+        "TopicExpert",
+        "StormKnowledgeCurationModule",
+    ],
+    ".storm_wiki.modules.persona_generator": [
+        "get_wiki_page_title_and_toc",
+        "FindRelatedTopic",
+        "GenPersona",
+        "CreateWriterWithPersona",
+        "StormPersonaGenerator",
+    ],
+    ".storm_wiki.modules.retriever": [
+        "GENERALLY_UNRELIABLE",
+        "DEPRECATED",
+        "BLACKLISTED",
+        "WIKIPEDIA_SOURCE_FILTER",
+        "is_valid_wikipedia_source",
+    ],
+    ".storm_wiki.modules.storm_dataclass": [
+        "DialogueTurn",
+        "StormInformationTable",
+        "StormArticle",
+    ],
+    ".collaborative_storm.modules.article_generation": [
+        "ArticleGenerationModule",
+        "WriteSection",
+    ],
+    ".collaborative_storm.modules.grounded_question_answering": [
+        "QuestionToQuery",
+        "AnswerQuestion",
+        "AnswerQuestionModule",
+    ],
+    ".collaborative_storm.modules.grounded_question_generation": [
+        "KnowledgeBaseSummmary",
+        "ConvertUtteranceStyle",
+        "GroundedQuestionGeneration",
+        "GroundedQuestionGenerationModule",
+    ],
+    ".collaborative_storm.modules.information_insertion_module": [
+        "InsertInformation",
+        "InsertInformationCandidateChoice",
+        "InsertInformationModule",
+        "ExpandSection",
+        "ExpandNodeModule",
+    ],
+    ".collaborative_storm.modules.simulate_user": [
+        "GenSimulatedUserUtterance",
+    ],
+    ".collaborative_storm.modules.warmstart_hierarchical_chat": [
+        "WarmStartModerator",
+        "SectionToConvTranscript",
+        "ReportToConversation",
+        "WarmStartConversation",
+        "GenerateWarmStartOutline",
+        "GenerateWarmStartOutlineModule",
+        "WarmStartModule",
+    ],
+    ".collaborative_storm.modules.knowledge_base_summary": [
+        "KnowledgeBaseSummmary",
+        "KnowledgeBaseSummaryModule",
+    ],
+    ".collaborative_storm.modules.costorm_expert_utterance_generator": [
+        "GenExpertActionPlanning",
+        "CoStormExpertUtteranceGenerationModule",
+    ],
+    ".collaborative_storm.engine": [
+        "CollaborativeStormLMConfigs",
+        "RunnerArgument",
+        "TurnPolicySpec",
+        "DiscourseManager",
+        "CoStormRunner",
+    ],
+    ".collaborative_storm.session_store": [
+        "CoStormSessionStore",
+        "CoStormSessionManager",
+    ],
+    ".encoder": [
+        "Encoder",
+    ],
+    ".interface": [
+        "logger",
+        "InformationTable",
+        "Information",
+        "InformationStore",
+        "ArticleSectionNode",
+        "Article",
+        "Deadline",
+        "Retriever",
+        "KnowledgeCurationModule",
+        "OutlineGenerationModule",
+        "ArticleGenerationModule",
+        "ArticlePolishingModule",
+        "log_execution_time",
+        "LMConfigs",
+        "Engine",
+        "Agent",
+    ],
+    ".lm": [
+        "disk_cache_dir",
+        "LM_LRU_CACHE_MAX_SIZE",
+        "LMHistorySink",
+        "LMHistorySinkSlice",
+        "LMHistory",
+        "LM",
+        "cached_litellm_completion",
+        "litellm_completion",
+        "cached_litellm_text_completion",
+        "litellm_text_completion",
+        "LitellmModel",
+        "OpenAIModel",
+        "DeepSeekModel",
+        "AzureOpenAIModel",
+        "GroqModel",
+        "ClaudeModel",
+        "VLLMClient",
+        "OllamaClient",
+        "TGIClient",
+        "TogetherClient",
+        "GoogleModel",
+    ],
+    ".rm": [
+        "YouRM",
+        "BingSearch",
+        "VectorRM",
+        "StanfordOvalArxivRM",
+        "SerperRM",
+        "BraveRM",
+        "SearXNG",
+        "DuckDuckGoSearchRM",
+        "TavilySearchRM",
+        "GoogleSearch",
+        "AzureAISearch",
+        "CompositeRM",
+    ],
+    ".utils": [
+        "truncate_filename",
+        "load_api_key",
+        "makeStringRed",
+        "QdrantVectorStoreManager",
+        "ArticleTextProcessing",
+        "BM25Index",
+        "SourceFilter",
+        "FileIOHelper",
+        "WebPageHelper",
+        "user_input_appropriateness_check",
+        "purpose_appropriateness_check",
+    ],
+    ".vector_index": ["LocalVectorIndex"],
+    ".query_cache": ["SemanticQueryCache"],
+    ".dataclass": [
+        "ConversationTurn",
+        "KnowledgeNode",
+        "KnowledgeBase",
+    ],
+}
+
+__getattr__, __dir__, __all__ = attach_lazy_loader(__name__, _LAZY_SUBMODULE_ATTRS)
 
 __version__ = "1.1.0"
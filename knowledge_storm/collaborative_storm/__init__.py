@@ -1,2 +1,59 @@
-from .modules import *
-from .engine import *
+from ..lazy_loader import attach_lazy_loader
+
+_LAZY_SUBMODULE_ATTRS = {
+    ".modules.article_generation": [
+        "ArticleGenerationModule",
+        "WriteSection",
+    ],
+    ".modules.grounded_question_answering": [
+        "QuestionToQuery",
+        "AnswerQuestion",
+        "AnswerQuestionModule",
+    ],
+    ".modules.grounded_question_generation": [
+        "KnowledgeBaseSummmary",
+        "ConvertUtteranceStyle",
+        "GroundedQuestionGeneration",
+        "GroundedQuestionGenerationModule",
+    ],
+    ".modules.information_insertion_module": [
+        "InsertInformation",
+        "InsertInformationCandidateChoice",
+        "InsertInformationModule",
+        "ExpandSection",
+        "ExpandNodeModule",
+    ],
+    ".modules.simulate_user": [
+        "GenSimulatedUserUtterance",
+    ],
+    ".modules.warmstart_hierarchical_chat": [
+        "WarmStartModerator",
+        "SectionToConvTranscript",
+        "ReportToConversation",
+        "WarmStartConversation",
+        "GenerateWarmStartOutline",
+        "GenerateWarmStartOutlineModule",
+        "WarmStartModule",
+    ],
+    ".modules.knowledge_base_summary": [
+        "KnowledgeBaseSummmary",
+        "KnowledgeBaseSummaryModule",
+    ],
+    ".modules.costorm_expert_utterance_generator": [
+        "GenExpertActionPlanning",
+        "CoStormExpertUtteranceGenerationModule",
+    ],
+    ".engine": [
+        "CollaborativeStormLMConfigs",
+        "RunnerArgument",
+        "TurnPolicySpec",
+        "DiscourseManager",
+        "CoStormRunner",
+    ],
+    ".session_store": [
+        "CoStormSessionStore",
+        "CoStormSessionManager",
+    ],
+}
+
+__getattr__, __dir__, __all__ = attach_lazy_loader(__name__, _LAZY_SUBMODULE_ATTRS)
@@ -1,10 +1,13 @@
 import dspy
 import os
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field, asdict
-from typing import List, Union, Literal, Optional, Dict
+from typing import List, Union, Literal, Optional, Dict, Tuple
 
 from .modules import collaborative_storm_utils as collaborative_storm_utils
-from .modules.callback import BaseCallbackHandler
+from .modules.callback import BaseCallbackHandler, RecordingCallbackHandler
 from .modules.co_storm_agents import (
     SimulatedUser,
     PureRAGAgent,
@@ -266,6 +269,32 @@ class RunnerArgument:
         default=False,
         metadata={"help": "If True, switch to rag online baseline mode"},
     )
+    background_knowledge_base_update: bool = field(
+        default=False,
+        metadata={
+            "help": "If True, update experts list and knowledge base in a background worker after each turn "
+            "so that step() returns as soon as the utterance is generated."
+        },
+    )
+    speculative_next_turn: bool = field(
+        default=False,
+        metadata={
+            "help": "If True, start generating the next system utterance in the background after each turn. "
+            "It is used if the user continues without injecting an utterance and discarded otherwise."
+        },
+    )
+    max_snippets_per_source: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "If set, keep only the N snippets of each search result most relevant to the query."
+        },
+    )
+    min_snippet_relevance: float = field(
+        default=0.0,
+        metadata={
+            "help": "Minimum BM25 score of a snippet to the query for it to be kept when max_snippets_per_source is set."
+        },
+    )
 
     def to_dict(self):
         """
@@ -510,16 +539,20 @@ class CoStormRunner:
         logging_wrapper: LoggingWrapper,
         rm: Optional[dspy.Retrieve] = None,
         callback_handler: BaseCallbackHandler = None,
+        encoder: Optional[Encoder] = None,
     ):
         self.runner_argument = runner_argument
         self.lm_config = lm_config
         self.logging_wrapper = logging_wrapper
+        if callback_handler is not None and runner_argument.speculative_next_turn:
+            # callbacks of a speculative turn only reach the handler once the turn is used
+            callback_handler = RecordingCallbackHandler(callback_handler)
         self.callback_handler = callback_handler
         if rm is None:
             self.rm = BingSearch(k=runner_argument.retrieve_top_k)
         else:
             self.rm = rm
-        self.encoder = Encoder()
+        self.encoder = Encoder() if encoder is None else encoder
         self.conversation_history = []
         self.warmstart_conv_archive = []
         self.knowledge_base = KnowledgeBase(
@@ -527,6 +560,7 @@ class CoStormRunner:
             knowledge_base_lm=self.lm_config.knowledge_base_lm,
             node_expansion_trigger_count=self.runner_argument.node_expansion_trigger_count,
             encoder=self.encoder,
+            max_thread=self.runner_argument.max_thread_num,
         )
         self.discourse_manager = DiscourseManager(
             lm_config=self.lm_config,
@@ -536,8 +570,129 @@ class CoStormRunner:
             encoder=self.encoder,
             callback_handler=callback_handler,
         )
+        # single worker so that background knowledge base updates of one session are serialized
+        self._background_executor: Optional[ThreadPoolExecutor] = None
+        self._background_task: Optional[Future] = None
+        # (last conversation turn the speculation is based on, future of (agent, conversation turn, callbacks,
+        # counts collected while detached))
+        self._speculation_executor: Optional[ThreadPoolExecutor] = None
+        self._speculative_turn: Optional[Tuple[ConversationTurn, Future]] = None
+        # discarded speculations that were already running; they read the knowledge base until they finish
+        self._stale_speculations: List[Future] = []
+
+    def wait_for_background_tasks(self):
+        """
+        Blocks until the pending background update of experts list and knowledge base (if any) finishes.
+        If the update failed, its exception is raised here once, as `step` would have raised it without the
+        background worker.
+        """
+        background_task = self._background_task
+        if background_task is None:
+            return
+        try:
+            background_task.result()
+        finally:
+            if self._background_task is background_task:
+                self._background_task = None
+
+    def _submit_background_task(self, fn, *args, **kwargs):
+        if self._background_executor is None:
+            self._background_executor = ThreadPoolExecutor(max_workers=1)
+
+        def _run_detached():
+            with self.logging_wrapper.detach():
+                return fn(*args, **kwargs)
+
+        self._background_task = self._background_executor.submit(_run_detached)
+
+    def _start_speculative_turn(self):
+        """
+        Starts generating the next system utterance in the background while the user reads the current turn.
+        The speculation only reads the state: the turn policy is computed in dry run mode and the result is
+        committed by the next `step` call if its turn policy selects the same agent. Its callbacks, query count
+        and snippet pruning stats are recorded and only passed on to the callback handler and logging wrapper if it is committed.
+        """
+        if self.runner_argument.rag_only_baseline_mode or not self.conversation_history:
+            return
+        if self._speculation_executor is None:
+            self._speculation_executor = ThreadPoolExecutor(max_workers=1)
+        conversation_history = list(self.conversation_history)
+        background_task = self._background_task
+
+        def _speculate():
+            # the next turn depends on the experts list and knowledge base updated by the current turn
+            if background_task is not None:
+                try:
+                    background_task.result()
+                except Exception:
+                    pass
+            with self.logging_wrapper.detach() as counts, self._record_callbacks() as calls:
+                turn_policy = self.discourse_manager.get_next_turn_policy(
+                    conversation_history=conversation_history, dry_run=True
+                )
+                conv_turn = turn_policy.agent.generate_utterance(
+                    knowledge_base=self.knowledge_base,
+                    conversation_history=conversation_history,
+                )
+            return turn_policy.agent, conv_turn, calls, counts
+
+        self._speculative_turn = (
+            conversation_history[-1],
+            self._speculation_executor.submit(_speculate),
+        )
+
+    @contextmanager
+    def _record_callbacks(self):
+        if isinstance(self.callback_handler, RecordingCallbackHandler):
+            with self.callback_handler.record() as calls:
+                yield calls
+        else:
+            yield []
+
+    def _discard_speculation(self, future: Future):
+        if not future.cancel():
+            self._stale_speculations.append(future)
+
+    def _discard_speculative_turn(self):
+        if self._speculative_turn is not None:
+            self._discard_speculation(self._speculative_turn[1])
+            self._speculative_turn = None
+
+    def _take_stale_speculations(self) -> List[Future]:
+        stale_speculations = self._stale_speculations
+        self._stale_speculations = []
+        return stale_speculations
+
+    def _take_speculative_turn(self, agent: Agent) -> Optional[ConversationTurn]:
+        """
+        Returns the speculatively generated utterance if it was based on the current last turn and generated
+        by the given agent. Otherwise, returns None and the utterance needs to be generated.
+        """
+        speculative_turn = self._speculative_turn
+        self._speculative_turn = None
+        if speculative_turn is None:
+            return None
+        last_conv_turn, future = speculative_turn
+        if last_conv_turn is not self.conversation_history[-1]:
+            self._discard_speculation(future)
+            return None
+        try:
+            speculated_agent, conv_turn, calls, counts = future.result()
+        except Exception:
+            print(traceback.format_exc())
+            return None
+        if speculated_agent is not agent:
+            return None
+        if calls:
+            self.callback_handler.replay(calls)
+        if counts["query_count"]:
+            self.logging_wrapper.add_query_count(count=counts["query_count"])
+        if any(counts["snippet_pruning"].values()):
+            self.logging_wrapper.add_snippet_pruning_stats(counts["snippet_pruning"])
+        return conv_turn
 
     def to_dict(self):
+        self.wait_for_background_tasks()
         return {
             "runner_argument": self.runner_argument.to_dict(),
             "lm_config": self.lm_config.to_dict(),
@@ -552,17 +707,30 @@ class CoStormRunner:
         }
 
     @classmethod
-    def from_dict(cls, data, callback_handler: BaseCallbackHandler = None):
-        # FIXME: does not use the lm_config data but naively use default setting
-        lm_config = CollaborativeStormLMConfigs()
-        lm_config.init(lm_type=os.getenv("OPENAI_API_TYPE"))
+    def from_dict(
+        cls,
+        data,
+        callback_handler: BaseCallbackHandler = None,
+        lm_config: Optional[CollaborativeStormLMConfigs] = None,
+        rm: Optional[dspy.Retrieve] = None,
+        encoder: Optional[Encoder] = None,
+    ):
+        """
+        Constructs a CoStormRunner from its dictionary representation.
+        `lm_config`, `rm` and `encoder` can be passed to share existing clients instead of constructing new ones.
+        """
+        if lm_config is None:
+            # FIXME: does not use the lm_config data but naively use default setting
+            lm_config = CollaborativeStormLMConfigs()
+            lm_config.init(lm_type=os.getenv("OPENAI_API_TYPE"))
         costorm_runner = cls(
             lm_config=lm_config,
             runner_argument=RunnerArgument.from_dict(data["runner_argument"]),
             logging_wrapper=LoggingWrapper(lm_config),
+            rm=rm,
             callback_handler=callback_handler,
+            encoder=encoder,
         )
-        costorm_runner.encoder = Encoder()
         costorm_runner.conversation_history = [
             ConversationTurn.from_dict(turn) for turn in data["conversation_history"]
         ]
@@ -576,7 +744,12 @@ class CoStormRunner:
             knowledge_base_lm=costorm_runner.lm_config.knowledge_base_lm,
             node_expansion_trigger_count=costorm_runner.runner_argument.node_expansion_trigger_count,
             encoder=costorm_runner.encoder,
+            max_thread=costorm_runner.runner_argument.max_thread_num,
         )
+        for conv_turn in (
+            costorm_runner.conversation_history + costorm_runner.warmstart_conv_archive
+        ):
+            costorm_runner.knowledge_base.intern_conv_turn_information(conv_turn)
         return costorm_runner
 
     def warm_start(self):
@@ -626,6 +799,7 @@ class CoStormRunner:
                         knowledge_base_lm=self.lm_config.knowledge_base_lm,
                         node_expansion_trigger_count=self.runner_argument.node_expansion_trigger_count,
                         encoder=self.encoder,
+                        max_thread=self.runner_argument.max_thread_num,
                     )
                 if self.conversation_history is None:
                     self.conversation_history = []
@@ -653,11 +827,60 @@ class CoStormRunner:
             with self.logging_wrapper.log_event(
                 "report generation stage: generate report"
             ):
+                self.wait_for_background_tasks()
                 return self.knowledge_base.to_report()
 
     def dump_logging_and_reset(self):
+        self.wait_for_background_tasks()
         return self.logging_wrapper.dump_logging_and_reset()
 
+    def _update_state_after_turn(
+        self,
+        cur_turn_name: str,
+        turn_policy: TurnPolicySpec,
+        last_conv_turn: ConversationTurn,
+        conv_turn: Optional[ConversationTurn],
+        stale_speculations: Optional[List[Future]] = None,
+    ):
+        """
+        Updates experts list and knowledge base after a system utterance is generated.
+        It first waits for `stale_speculations`, discarded speculative turns that may still be reading them.
+        """
+        for future in stale_speculations or []:
+            try:
+                future.result()
+            except Exception:
+                pass
+        if turn_policy.should_update_experts_list:
+            with self.logging_wrapper.log_event(
+                f"{cur_turn_name}: update experts list"
+            ):
+                self.discourse_manager._update_expert_list_from_utterance(
+                    focus=last_conv_turn.raw_utterance,
+                    background_info=conv_turn.raw_utterance,
+                )
+
+        if conv_turn is not None:
+            with self.logging_wrapper.log_event(
+                f"{cur_turn_name}: insert into knowledge base"
+            ):
+                if self.callback_handler is not None:
+                    self.callback_handler.on_mindmap_insert_start()
+                self.knowledge_base.update_from_conv_turn(
+                    conv_turn=conv_turn,
+                    allow_create_new_node=True,
+                    insert_under_root=self.runner_argument.rag_only_baseline_mode,
+                )
+                if self.callback_handler is not None:
+                    self.callback_handler.on_mindmap_insert_end()
+        if turn_policy.should_reorganize_knowledge_base:
+            with self.logging_wrapper.log_event(
+                f"{cur_turn_name}: reorganize knowledge base"
+            ):
+                if self.callback_handler is not None:
+                    self.callback_handler.on_mindmap_reorg_start()
+                self.knowledge_base.reogranize()
+
     def step(
         self,
         user_utterance: str = "",
@@ -692,6 +915,12 @@ class CoStormRunner:
             4. Knowledge Base Update
                 - Inserts the new turn into the `knowledge_base`, optionally allowing the creation of new nodes or inserting under the root based on the `rag_only_baseline_mode` flag.
                 - If the turn policy specifies, it reorganizes the `knowledge_base` to maintain optimal structure and relevance.
+                - If `background_knowledge_base_update` is set in the runner argument, the experts list update and this step
+                  run in a background worker, and the next system turn waits for them before planning.
+
+            5. Speculative Next Turn
+                - If `speculative_next_turn` is set in the runner argument, the next system utterance starts generating in
+                  the background. It is committed by the next call without `user_utterance` and discarded otherwise.
         """
         last_conv_turn = self.conversation_history[-1]
         cur_turn_name = f"conv turn: {len(self.conversation_history) + 1}"
@@ -700,6 +929,7 @@ class CoStormRunner:
         ):
             conv_turn = None
             if user_utterance:
+                self._discard_speculative_turn()
                 self.discourse_manager.next_turn_moderator_override = False
                 conv_turn = ConversationTurn(
                     role="Guest",
@@ -708,6 +938,8 @@ class CoStormRunner:
                 )
                 self.conversation_history.append(conv_turn)
             else:
+                # turn policy and agents read the experts list and knowledge base updated by the previous turn
+                self.wait_for_background_tasks()
                 with self.logging_wrapper.log_event(
                     f"{cur_turn_name}: get turn policy"
                 ):
@@ -723,39 +955,39 @@ class CoStormRunner:
                 with self.logging_wrapper.log_event(
                     f"{cur_turn_name}: generate utterance"
                 ):
-                    conv_turn = turn_policy.agent.generate_utterance(
-                        knowledge_base=self.knowledge_base,
-                        conversation_history=self.conversation_history,
-                    )
-
-                if turn_policy.should_update_experts_list:
-                    with self.logging_wrapper.log_event(
-                        f"{cur_turn_name}: update experts list"
-                    ):
-                        self.discourse_manager._update_expert_list_from_utterance(
-                            focus=last_conv_turn.raw_utterance,
-                            background_info=conv_turn.raw_utterance,
+                    if simulate_user:
+                        self._discard_speculative_turn()
+                    else:
+                        conv_turn = self._take_speculative_turn(turn_policy.agent)
+                    if conv_turn is None:
+                        conv_turn = turn_policy.agent.generate_utterance(
+                            knowledge_base=self.knowledge_base,
+                            conversation_history=self.conversation_history,
                         )
 
                 if conv_turn is not None:
                     self.conversation_history.append(conv_turn)
-                    with self.logging_wrapper.log_event(
-                        f"{cur_turn_name}: insert into knowledge base"
-                    ):
-                        if self.callback_handler is not None:
-                            self.callback_handler.on_mindmap_insert_start()
-                        self.knowledge_base.update_from_conv_turn(
-                            conv_turn=conv_turn,
-                            allow_create_new_node=True,
-                            insert_under_root=self.runner_argument.rag_only_baseline_mode,
-                        )
-                        if self.callback_handler is not None:
-                            self.callback_handler.on_mindmap_insert_end()
-                if turn_policy.should_reorganize_knowledge_base:
-                    with self.logging_wrapper.log_event(
-                        f"{cur_turn_name}: reorganize knowledge base"
-                    ):
-                        if self.callback_handler is not None:
-                            self.callback_handler.on_mindmap_reorg_start()
-                        self.knowledge_base.reogranize()
+
+                # taken here rather than in the background task: a speculation started after this turn waits for
+                # that task, so the task must only wait for speculations discarded before it was submitted
+                stale_speculations = self._take_stale_speculations()
+                if self.runner_argument.background_knowledge_base_update:
+                    self._submit_background_task(
+                        self._update_state_after_turn,
+                        cur_turn_name=cur_turn_name,
+                        turn_policy=turn_policy,
+                        last_conv_turn=last_conv_turn,
+                        conv_turn=conv_turn,
+                        stale_speculations=stale_speculations,
+                    )
+                else:
+                    self._update_state_after_turn(
+                        cur_turn_name=cur_turn_name,
+                        turn_policy=turn_policy,
+                        last_conv_turn=last_conv_turn,
+                        conv_turn=conv_turn,
+                        stale_speculations=stale_speculations,
+                    )
+            if self.runner_argument.speculative_next_turn and not simulate_user:
+                self._start_speculative_turn()
         return conv_turn
@@ -1,8 +1,48 @@
-from .article_generation import *
-from .grounded_question_answering import *
-from .grounded_question_generation import *
-from .information_insertion_module import *
-from .simulate_user import *
-from .warmstart_hierarchical_chat import *
-from .knowledge_base_summary import *
-from .costorm_expert_utterance_generator import *
+from ...lazy_loader import attach_lazy_loader
+
+_LAZY_SUBMODULE_ATTRS = {
+    ".article_generation": [
+        "ArticleGenerationModule",
+        "WriteSection",
+    ],
+    ".grounded_question_answering": [
+        "QuestionToQuery",
+        "AnswerQuestion",
+        "AnswerQuestionModule",
+    ],
+    ".grounded_question_generation": [
+        "KnowledgeBaseSummmary",
+        "ConvertUtteranceStyle",
+        "GroundedQuestionGeneration",
+        "GroundedQuestionGenerationModule",
+    ],
+    ".information_insertion_module": [
+        "InsertInformation",
+        "InsertInformationCandidateChoice",
+        "InsertInformationModule",
+        "ExpandSection",
+        "ExpandNodeModule",
+    ],
+    ".simulate_user": [
+        "GenSimulatedUserUtterance",
+    ],
+    ".warmstart_hierarchical_chat": [
+        "WarmStartModerator",
+        "SectionToConvTranscript",
+        "ReportToConversation",
+        "WarmStartConversation",
+        "GenerateWarmStartOutline",
+        "GenerateWarmStartOutlineModule",
+        "WarmStartModule",
+    ],
+    ".knowledge_base_summary": [
+        "KnowledgeBaseSummmary",
+        "KnowledgeBaseSummaryModule",
+    ],
+    ".costorm_expert_utterance_generator": [
+        "GenExpertActionPlanning",
+        "CoStormExpertUtteranceGenerationModule",
+    ],
+}
+
+__getattr__, __dir__, __all__ = attach_lazy_loader(__name__, _LAZY_SUBMODULE_ATTRS)
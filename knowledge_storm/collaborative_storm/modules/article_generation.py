@@ -1,6 +1,7 @@
+import contextvars
 import dspy
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Set, Union
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from typing import Callable, Optional, Set, Union
 
 from .collaborative_storm_utils import clean_up_section
 from ...dataclass import KnowledgeBase, KnowledgeNode
@@ -12,10 +13,12 @@ class ArticleGenerationModule(dspy.Module):
     def __init__(
         self,
         engine: Union[dspy.dsp.LM, dspy.dsp.HFModel],
+        max_thread: int = 5,
     ):
         super().__init__()
         self.write_section = dspy.Predict(WriteSection)
         self.engine = engine
+        self.max_thread = max_thread
 
     def _get_cited_information_string(
         self,
@@ -41,27 +44,50 @@ class ArticleGenerationModule(dspy.Module):
     ):
         if node is None or len(node.content) == 0:
             return ""
-        if (
-            node.synthesize_output is not None
-            and node.synthesize_output
-            and not node.need_regenerate_synthesize_output
-        ):
+        if not self._need_regenerate(node):
             return node.synthesize_output
-        all_citation_index = node.collect_all_content()
-        information = self._get_cited_information_string(
-            all_citation_index=all_citation_index, knowledge_base=knowledge_base
-        )
-        with dspy.settings.context(lm=self.engine):
-            synthesize_output = clean_up_section(
-                self.write_section(
-                    topic=topic, info=information, section=node.name
-                ).output
+        # reset the flag before reading content so that insertions during generation mark the node stale again
+        node.need_regenerate_synthesize_output = False
+        node.mark_dirty()
+        try:
+            all_citation_index = node.collect_all_content()
+            information = self._get_cited_information_string(
+                all_citation_index=all_citation_index, knowledge_base=knowledge_base
             )
+            with dspy.settings.context(lm=self.engine):
+                synthesize_output = clean_up_section(
+                    self.write_section(
+                        topic=topic, info=information, section=node.name
+                    ).output
+                )
+        except Exception:
+            node.need_regenerate_synthesize_output = True
+            raise
         node.synthesize_output = synthesize_output
-        node.need_regenerate_synthesize_output = False
         return node.synthesize_output
 
-    def forward(self, knowledge_base: KnowledgeBase):
+    def _need_regenerate(self, node: KnowledgeNode):
+        return (
+            node.synthesize_output is None
+            or not node.synthesize_output
+            or node.need_regenerate_synthesize_output
+        )
+
+    def forward(
+        self,
+        knowledge_base: KnowledgeBase,
+        executor: Optional[Executor] = None,
+        on_section_generated: Optional[Callable[[KnowledgeNode], None]] = None,
+    ):
+        """
+        Args:
+            knowledge_base: The knowledge base to write the report for.
+            executor: Optional executor to run section generation in, e.g., a pool shared with other LM calls.
+                If None, a pool with `max_thread` workers is created for this call.
+            on_section_generated: Optional callback invoked in the calling thread with each node as soon as its
+                `synthesize_output` is up to date, so that consumers can start working on it before the whole
+                report is done.
+        """
         all_nodes = knowledge_base.collect_all_nodes()
         node_to_paragraph = {}
 
@@ -77,17 +103,38 @@ class ArticleGenerationModule(dspy.Module):
             path = " -> ".join(node.get_path_from_root())
             return path, node_gen_paragraph
 
-        with ThreadPoolExecutor(max_workers=5) as executor:
+        # only stale nodes call the LM; the rest return their cached paragraph
+        nodes_to_regenerate = []
+        for node in all_nodes:
+            if len(node.content) > 0 and self._need_regenerate(node):
+                nodes_to_regenerate.append(node)
+            else:
+                path, node_gen_paragraph = _node_generate_paragraph(node)
+                node_to_paragraph[path] = node_gen_paragraph
+                if on_section_generated is not None:
+                    on_section_generated(node)
+
+        owns_executor = executor is None
+        if owns_executor:
+            executor = ThreadPoolExecutor(max_workers=self.max_thread)
+        try:
             # Submit all tasks
             future_to_node = {
-                executor.submit(_node_generate_paragraph, node): node
-                for node in all_nodes
+                executor.submit(
+                    contextvars.copy_context().run, _node_generate_paragraph, node
+                ): node
+                for node in nodes_to_regenerate
             }
 
             # Collect the results as they complete
             for future in as_completed(future_to_node):
                 path, node_gen_paragraph = future.result()
                 node_to_paragraph[path] = node_gen_paragraph
+                if on_section_generated is not None:
+                    on_section_generated(future_to_node[future])
+        finally:
+            if owns_executor:
+                executor.shutdown()
 
         def helper(cur_root, level):
             to_return = []
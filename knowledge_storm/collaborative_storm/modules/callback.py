@@ -1,3 +1,5 @@
+import contextvars
+from contextlib import contextmanager
 from typing import List
 from ...interface import Information
 
@@ -108,3 +110,42 @@ class LocalConsolePrintCallBackHandler(BaseCallbackHandler):
     def on_warmstart_update(self, message, **kwargs):
         """Run when the warm start process has update."""
         print(f"Warm start update: {message}")
+
+
+class RecordingCallbackHandler:
+    """
+    Wraps a callback handler and forwards every callback to it, except inside `record()`, where the callbacks of the
+    current thread are recorded instead. Used for work whose result may be discarded, e.g., a speculative turn:
+    the recorded callbacks are replayed with `replay` if the result is used and dropped otherwise.
+    """
+
+    def __init__(self, handler: BaseCallbackHandler):
+        self.handler = handler
+        self._recorded_calls = contextvars.ContextVar("recorded_calls", default=None)
+
+    @contextmanager
+    def record(self):
+        """Records the callbacks made in this context into the yielded list instead of forwarding them."""
+        calls = []
+        token = self._recorded_calls.set(calls)
+        try:
+            yield calls
+        finally:
+            self._recorded_calls.reset(token)
+
+    def replay(self, calls):
+        for name, args, kwargs in calls:
+            getattr(self.handler, name)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self.handler, name)
+        if not name.startswith("on_") or not callable(attr):
+            return attr
+
+        def dispatch(*args, **kwargs):
+            calls = self._recorded_calls.get()
+            if calls is None:
+                return attr(*args, **kwargs)
+            calls.append((name, args, kwargs))
+
+        return dispatch
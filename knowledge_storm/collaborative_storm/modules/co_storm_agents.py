@@ -2,6 +2,7 @@ import dspy
 from itertools import zip_longest
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 from typing import List, Optional, TYPE_CHECKING
 
 from .callback import BaseCallbackHandler
@@ -198,15 +199,11 @@ class Moderator(Agent):
                 raw_retrieved_single_snippet_info.append(
                     extract_storm_info_snippet(info, snippet_index=snippet_idx)
                 )
-        # get all cited information
-        cited_info = list(knowledge_base.info_uuid_to_info_dict.values())
-        cited_info_hash_set = set([hash(info) for info in cited_info])
-        cited_snippets = [info.snippets[0] for info in cited_info]
         # get list of unused information
         unused_information: List[Information] = [
             info
             for info in raw_retrieved_single_snippet_info
-            if hash(info) not in cited_info_hash_set
+            if not knowledge_base.is_cited_information(info)
         ]
         if not unused_information:
             return []
@@ -218,16 +215,20 @@ class Moderator(Agent):
         )
         claim_embedding = self.encoder.encode(conv_turn.claim_to_make)
         query_embedding = self.encoder.encode(conv_turn.queries)
-        cited_snippets_embedding = self.encoder.encode(cited_snippets)
+        # cited snippet embeddings are maintained incrementally and already normalized by the knowledge base
+        cited_snippets_embedding = knowledge_base.get_cited_snippet_embeddings()
         # calculate similarity
         query_similarities = cosine_similarity(
             unused_snippets_embeddings, query_embedding
         )
         max_query_similarity = np.max(query_similarities, axis=1)
-        cited_snippets_similarity = np.max(
-            cosine_similarity(unused_snippets_embeddings, cited_snippets_embedding),
-            axis=1,
-        )
+        if cited_snippets_embedding.size > 0:
+            cited_snippets_similarity = np.max(
+                normalize(unused_snippets_embeddings) @ cited_snippets_embedding.T,
+                axis=1,
+            )
+        else:
+            cited_snippets_similarity = np.zeros(len(unused_information))
         cited_snippets_similarity = np.clip(cited_snippets_similarity, 0, 1)
         # use claim similarity to filter out "real" not useful data
         claim_similarity = cosine_similarity(
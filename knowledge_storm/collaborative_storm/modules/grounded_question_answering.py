@@ -82,7 +82,11 @@ class AnswerQuestionModule(dspy.Module):
         ):
             # retrieve information using retriever
             searched_results: List[Information] = self.retriever.retrieve(
-                list(set(queries)), exclude_urls=[]
+                list(set(queries)), exclude_urls=[], topic=topic
+            )
+        if self.retriever.max_snippets_per_source is not None:
+            self.logging_wrapper.add_snippet_pruning_stats(
+                self.retriever.collect_and_reset_snippet_pruning_stats()
             )
         # update storm information meta to include the question
         for storm_info in searched_results:
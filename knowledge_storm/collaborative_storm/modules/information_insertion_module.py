@@ -1,11 +1,12 @@
+import contextvars
 import dspy
 import numpy as np
 import re
 import traceback
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Union, Dict, Optional
+from typing import List, Union, Dict, Optional, Set
 
 from .collaborative_storm_utils import trim_output_after_hint
 from ...dataclass import KnowledgeNode, KnowledgeBase
@@ -226,6 +227,7 @@ class InsertInformationModule(dspy.Module):
         max_thread: int = 5,
         insert_root: Optional[KnowledgeNode] = None,
         skip_candidate_from_embedding: bool = False,
+        executor: Optional[Executor] = None,
     ):
         if not isinstance(information, List):
             information = [information]
@@ -277,15 +279,24 @@ class InsertInformationModule(dspy.Module):
         to_return = []
         if not allow_create_new_node:
             # use multi thread as knowledge base structure does not change
-            with ThreadPoolExecutor(max_workers=max_thread) as executor:
+            owns_executor = executor is None
+            if owns_executor:
+                executor = ThreadPoolExecutor(max_workers=max_thread)
+            try:
+                # copy the context so that logged events keep their parent span
                 futures = {
-                    executor.submit(process_intent, question, query): (question, query)
+                    executor.submit(
+                        contextvars.copy_context().run, process_intent, question, query
+                    ): (question, query)
                     for (question, query) in intent_to_placement_dict
                 }
 
                 for future in as_completed(futures):
                     (question, query), candidate_placement = future.result()
                     intent_to_placement_dict[(question, query)] = candidate_placement
+            finally:
+                if owns_executor:
+                    executor.shutdown()
             # back mapping placement to each information
             for info in information:
                 intent = (info.meta.get("question", ""), info.meta.get("query", ""))
@@ -337,11 +348,13 @@ class ExpandNodeModule(dspy.Module):
         engine: Union[dspy.dsp.LM, dspy.dsp.HFModel],
         information_insert_module: dspy.Module,
         node_expansion_trigger_count: int,
+        max_thread: int = 5,
     ):
         self.engine = engine
         self.expand_section = dspy.Predict(ExpandSection)
         self.information_insert_module = information_insert_module
         self.node_expansion_trigger_count = node_expansion_trigger_count
+        self.max_thread = max_thread
 
     def _get_cited_info_meta_string(self, node, knowledge_base):
         meta_string = set()
@@ -370,23 +383,26 @@ class ExpandNodeModule(dspy.Module):
             ]
         return subsections
 
-    def _find_first_node_to_expand(
-        self, root: KnowledgeNode, expanded_nodes: List[KnowledgeNode]
-    ):
+    def _find_nodes_to_expand(
+        self, root: KnowledgeNode, expanded_nodes: Set[KnowledgeNode]
+    ) -> List[KnowledgeNode]:
+        """
+        Collects the top-most nodes that need expansion. The search does not descend into a node selected
+        for expansion, so the returned nodes root disjoint subtrees and can be expanded independently.
+        """
         if root is None:
-            return None
+            return []
         if (
             root not in expanded_nodes
             and len(root.content) >= self.node_expansion_trigger_count
         ):
-            return root
+            return [root]
+        nodes_to_expand = []
         for child in root.children:
-            to_return = self._find_first_node_to_expand(
-                root=child, expanded_nodes=expanded_nodes
+            nodes_to_expand.extend(
+                self._find_nodes_to_expand(root=child, expanded_nodes=expanded_nodes)
             )
-            if to_return is not None:
-                return to_return
-        return None
+        return nodes_to_expand
 
     def _expand_node(self, node: KnowledgeNode, knowledge_base: KnowledgeBase):
         subsection_names = self._get_expand_subnode_names(node, knowledge_base)
@@ -404,6 +420,7 @@ class ExpandNodeModule(dspy.Module):
             for index in original_cited_index
         ]
         node.content = set()
+        node.mark_need_regenerate_synthesize_output()
         # re-insert under expanded section
         self.information_insert_module(
             knowledge_base=knowledge_base,
@@ -413,12 +430,25 @@ class ExpandNodeModule(dspy.Module):
         )
 
     def forward(self, knowledge_base: KnowledgeBase):
-        expanded_nodes = []
+        expanded_nodes = set()
         while True:
-            node_to_expand = self._find_first_node_to_expand(
+            nodes_to_expand = self._find_nodes_to_expand(
                 root=knowledge_base.root, expanded_nodes=expanded_nodes
             )
-            if node_to_expand is None:
+            if not nodes_to_expand:
                 break
-            self._expand_node(node=node_to_expand, knowledge_base=knowledge_base)
-            expanded_nodes.append(node_to_expand)
+            # expansion only touches the subtree under the expanded node, so disjoint subtrees can run in parallel
+            with ThreadPoolExecutor(max_workers=self.max_thread) as executor:
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        self._expand_node,
+                        node=node,
+                        knowledge_base=knowledge_base,
+                    )
+                    for node in nodes_to_expand
+                ]
+                # like the sequential expansion, a failed expansion is raised; leaving the executor waits for the rest
+                for future in as_completed(futures):
+                    future.result()
+            expanded_nodes.update(nodes_to_expand)
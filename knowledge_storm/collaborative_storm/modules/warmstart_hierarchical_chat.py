@@ -10,14 +10,15 @@ The synthesized conversation is presented to the user to help them quickly catch
 
 import dspy
 import concurrent.futures
-from threading import Lock
+import contextvars
+from threading import BoundedSemaphore, Lock
 from typing import List, Optional, Union, TYPE_CHECKING
 
 from .callback import BaseCallbackHandler
 from .collaborative_storm_utils import _get_answer_question_module_instance
 from .expert_generation import GenerateExpertModule
 from .grounded_question_answering import AnswerQuestionModule
-from ...dataclass import ConversationTurn, KnowledgeBase
+from ...dataclass import ConversationTurn, KnowledgeBase, KnowledgeNode
 from ...interface import LMConfigs
 from ...logging_wrapper import LoggingWrapper
 from ...storm_wiki.modules.outline_generation import WritePageOutline
@@ -72,29 +73,51 @@ class ReportToConversation(dspy.Module):
         self.engine = engine
         self.section_to_conv_transcript = dspy.Predict(SectionToConvTranscript)
 
-    def forward(self, knowledge_base: KnowledgeBase):
-        def process_node(node, topic):
-            with dspy.settings.context(lm=self.engine, show_guidelines=False):
-                output = self.section_to_conv_transcript(
-                    topic=topic,
-                    section_name=node.get_path_from_root(),
-                    section_content=node.synthesize_output,
-                )
-                question = output.question.replace("Question:", "").strip()
-                answer = output.answer.replace("Answer:", "").strip()
-                return question, answer
+    @staticmethod
+    def is_section_to_convert(node: KnowledgeNode):
+        return node.name != "root" and node.content
+
+    def process_node(self, node: KnowledgeNode, topic: str):
+        with dspy.settings.context(lm=self.engine, show_guidelines=False):
+            output = self.section_to_conv_transcript(
+                topic=topic,
+                section_name=node.get_path_from_root(),
+                section_content=node.synthesize_output,
+            )
+            question = output.question.replace("Question:", "").strip()
+            answer = output.answer.replace("Answer:", "").strip()
+            return question, answer
 
+    def forward(
+        self,
+        knowledge_base: KnowledgeBase,
+        node_to_future: Optional[dict] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ):
+        """
+        Args:
+            knowledge_base: Knowledge base whose report sections are turned into conversation turns.
+            node_to_future: Optional futures of `process_node` already submitted for some nodes, e.g., while the
+                report was still being synthesized. Remaining nodes are processed here.
+            executor: Optional executor to process the remaining nodes in.
+        """
         conversations = []
         nodes = knowledge_base.collect_all_nodes()
-        nodes = [node for node in nodes if node.name != "root" and node.content]
+        nodes = [node for node in nodes if self.is_section_to_convert(node)]
         topic = knowledge_base.topic
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_node = {
-                executor.submit(process_node, node, topic): node for node in nodes
-            }
+        node_to_future = dict(node_to_future) if node_to_future else {}
+
+        owns_executor = executor is None
+        if owns_executor:
+            executor = concurrent.futures.ThreadPoolExecutor()
+        try:
+            for node in nodes:
+                if node not in node_to_future:
+                    node_to_future[node] = executor.submit(
+                        contextvars.copy_context().run, self.process_node, node, topic
+                    )
+            future_to_node = {node_to_future[node]: node for node in nodes}
             for future in concurrent.futures.as_completed(future_to_node):
-                node = future_to_node[future]
                 question, answer = future.result()
                 conversations.append(
                     ConversationTurn(
@@ -120,6 +143,9 @@ class ReportToConversation(dspy.Module):
                         ],
                     )
                 )
+        finally:
+            if owns_executor:
+                executor.shutdown()
         return conversations
 
 
@@ -180,7 +206,15 @@ class WarmStartConversation(dspy.Module):
             cited_info=answer.cited_info,
         )
 
-    def forward(self, topic: str):
+    def forward(
+        self, topic: str, executor: Optional[concurrent.futures.Executor] = None
+    ):
+        """
+        Args:
+            topic: The topic to discuss.
+            executor: Optional executor shared with other warm start steps. At most `max_thread` experts run in it
+                at the same time. If None, a pool with `max_thread` workers is created for this call.
+        """
         with self.logging_wrapper.log_event(
             "warm start, perspective guided QA: identify experts"
         ):
@@ -191,9 +225,14 @@ class WarmStartConversation(dspy.Module):
         # init list to store the dialogue history
         conversation_history: List[ConversationTurn] = []
         lock = Lock()
+        expert_slots = BoundedSemaphore(self.max_thread)
 
         # hierarchical chat: chat with one expert. Generate question, get answer
         def process_expert(expert):
+            with expert_slots:
+                _process_expert(expert)
+
+        def _process_expert(expert):
             expert_name, expert_descriptoin = expert.split(":")
             for idx in range(self.max_turn_per_experts):
                 with self.logging_wrapper.log_event(
@@ -240,14 +279,21 @@ class WarmStartConversation(dspy.Module):
                         print(f"Error processing expert {expert}: {e}")
 
         # multi-thread conversation
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_thread
-        ) as executor:
+        owns_executor = executor is None
+        if owns_executor:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_thread
+            )
+        try:
+            # copy the context so that logged events keep their parent span
             futures = [
-                executor.submit(process_expert, expert)
+                executor.submit(contextvars.copy_context().run, process_expert, expert)
                 for expert in experts[: min(len(experts), self.max_num_experts)]
             ]
             concurrent.futures.wait(futures)
+        finally:
+            if owns_executor:
+                executor.shutdown()
 
         conversation_history = [background_seeking_dialogue] + conversation_history
 
@@ -298,9 +344,15 @@ class GenerateWarmStartOutlineModule(dspy.Module):
         with dspy.settings.context(lm=self.engine):
             return self.draft_outline(topic=topic).outline
 
-    def forward(self, topic: str, conv: List[ConversationTurn]):
+    def forward(
+        self,
+        topic: str,
+        conv: List[ConversationTurn],
+        draft_outline: Optional[str] = None,
+    ):
         discussion_history = self.extract_questions_and_queries(conv)
-        draft_outline = self.get_draft_outline(topic=topic)
+        if draft_outline is None:
+            draft_outline = self.get_draft_outline(topic=topic)
         with dspy.settings.context(lm=self.engine):
             outline = self.gen_outline(
                 topic=topic, draft=draft_outline, conv=discussion_history
@@ -342,12 +394,18 @@ class WarmStartModule:
         self.report_to_conversation = ReportToConversation(lm_config.knowledge_base_lm)
         self.logging_wrapper = logging_wrapper
         self.callback_handler = callback_handler
+        self.max_thread = runner_argument.max_thread_num
 
     def initiate_warm_start(self, topic: str, knowledge_base: KnowledgeBase):
         """
         Initiates a warm start process for the given topic by generating a warm start conversation and inserting the
         resulting information into a knowledge base.
 
+        The steps are scheduled by their dependencies and share one pool of `max_thread_num` workers:
+            draft outline (topic only)  ------------------------------------+
+            background QA -> experts -> perspective guided QA per expert --+-> outline -> knowledge base insertion
+            -> per-section report synthesis -> per-section conversation (starts as soon as its section is written)
+
         Args:
             topic (str): The topic for which to initiate the warm start process.
 
@@ -359,48 +417,79 @@ class WarmStartModule:
         """
         warm_start_conversation_history: List[ConversationTurn] = []
         warm_start_experts = None
-        # get warm start conversations
-        with self.logging_wrapper.log_event("warm start: perspective guided QA"):
-            if self.callback_handler is not None:
-                self.callback_handler.on_warmstart_update(
-                    message="Start getting familiar with the topic by chatting with multiple LLM experts (Step 1 / 4)"
-                )
-            warm_start_result = self.warmstart_conv(topic=topic)
-            warm_start_conversation_history = warm_start_result.conversation_history
-            warm_start_experts = warm_start_result.experts
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_thread
+        ) as executor:
+            # the draft outline only depends on the topic
+            draft_outline_future = executor.submit(
+                contextvars.copy_context().run,
+                self.warmstart_outline_gen_module.get_draft_outline,
+                topic=topic,
+            )
 
-        # get warm start conv outline
-        with self.logging_wrapper.log_event("warm start: outline generation"):
-            if self.callback_handler is not None:
-                self.callback_handler.on_warmstart_update(
-                    "Organizing collected information (Step 2 / 4)"
+            # get warm start conversations
+            with self.logging_wrapper.log_event("warm start: perspective guided QA"):
+                if self.callback_handler is not None:
+                    self.callback_handler.on_warmstart_update(
+                        message="Start getting familiar with the topic by chatting with multiple LLM experts (Step 1 / 4)"
+                    )
+                warm_start_result = self.warmstart_conv(topic=topic, executor=executor)
+                warm_start_conversation_history = warm_start_result.conversation_history
+                warm_start_experts = warm_start_result.experts
+
+            # get warm start conv outline
+            with self.logging_wrapper.log_event("warm start: outline generation"):
+                if self.callback_handler is not None:
+                    self.callback_handler.on_warmstart_update(
+                        "Organizing collected information (Step 2 / 4)"
+                    )
+                warm_start_outline_output = self.warmstart_outline_gen_module(
+                    topic=topic,
+                    conv=warm_start_conversation_history,
+                    draft_outline=draft_outline_future.result(),
                 )
-            warm_start_outline_output = self.warmstart_outline_gen_module(
-                topic=topic, conv=warm_start_conversation_history
-            )
-        # init knowledge base
-        with self.logging_wrapper.log_event("warm start: insert into knowledge base"):
+            # init knowledge base
+            with self.logging_wrapper.log_event(
+                "warm start: insert into knowledge base"
+            ):
+                if self.callback_handler is not None:
+                    self.callback_handler.on_warmstart_update(
+                        "Inserting collected information into knowledge base (Step 3 / 4)"
+                    )
+                knowledge_base.insert_from_outline_string(
+                    outline_string=warm_start_outline_output.outline
+                )
+                # insert information of all turns at once, the structure does not change
+                knowledge_base.update_from_conv_turns(
+                    conv_turns=warm_start_conversation_history, executor=executor
+                )
+            # knowledge base to report
             if self.callback_handler is not None:
                 self.callback_handler.on_warmstart_update(
-                    "Inserting collected information into knowledge base (Step 3 / 4)"
+                    "Synthesizing background information discussion utterances (Step 4 / 4)"
                 )
-            knowledge_base.insert_from_outline_string(
-                outline_string=warm_start_outline_output.outline
-            )
-            # insert information to knowledge base
-            for turn in warm_start_conversation_history:
-                knowledge_base.update_from_conv_turn(
-                    conv_turn=turn, allow_create_new_node=False
-                )
-        # knowledge base to report
-        if self.callback_handler is not None:
-            self.callback_handler.on_warmstart_update(
-                "Synthesizing background information discussion utterances (Step 4 / 4)"
+            # turn each section into engaging conversations as soon as it is written
+            node_to_conversation_future = {}
+
+            def on_section_generated(node: KnowledgeNode):
+                if self.report_to_conversation.is_section_to_convert(node):
+                    node_to_conversation_future[node] = executor.submit(
+                        contextvars.copy_context().run,
+                        self.report_to_conversation.process_node,
+                        node,
+                        topic,
+                    )
+
+            knowledge_base.to_report(
+                executor=executor, on_section_generated=on_section_generated
             )
-        knowledge_base.to_report()
 
-        # generate engaging conversations
-        engaging_conversations = self.report_to_conversation(knowledge_base)
+            # generate engaging conversations
+            engaging_conversations = self.report_to_conversation(
+                knowledge_base,
+                node_to_future=node_to_conversation_future,
+                executor=executor,
+            )
         return (
             warm_start_conversation_history,
             engaging_conversations,
@@ -0,0 +1,591 @@
+import dspy
+import json
+import logging
+import os
+import re
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .engine import CollaborativeStormLMConfigs, CoStormRunner, RunnerArgument
+from .modules.callback import BaseCallbackHandler
+from ..encoder import Encoder
+from ..logging_wrapper import LoggingWrapper
+
+
+class CoStormSessionStore:
+    """
+    Persists a Co-STORM session as a compressed snapshot plus an append-only journal of per-turn deltas.
+
+    `CoStormRunner.to_dict` serializes the whole session, which grows with every turn. Instead of rewriting it after
+    each step, `save` only appends what changed since the last save: new conversation turns, newly inserted
+    information, the mind map nodes that changed (see `KnowledgeBase.collect_and_reset_dirty_nodes`), and the
+    experts list if it changed. `load` replays the journal onto the last snapshot. The journal is folded into a fresh
+    snapshot every `compaction_interval` saves.
+
+    Mind map nodes are journaled as flat records keyed by a node id: name, content, synthesized output and the ids of
+    the children. Ids are assigned in pre-order when a snapshot is written, so the snapshot itself stays in
+    `CoStormRunner.to_dict` format, and new nodes get the next free id.
+
+    Files in `session_dir`:
+        snapshot.bin: zlib compressed JSON of `CoStormRunner.to_dict()`.
+        journal.jsonl: One JSON delta per line, applied in order on top of the snapshot.
+    """
+
+    SNAPSHOT_FILE_NAME = "snapshot.bin"
+    JOURNAL_FILE_NAME = "journal.jsonl"
+
+    def __init__(self, session_dir: str, compaction_interval: int = 20):
+        """
+        Args:
+            session_dir (str): Directory holding the snapshot and journal of a single session.
+            compaction_interval (int): Number of journal entries after which `save` writes a new snapshot.
+        """
+        self.session_dir = session_dir
+        self.compaction_interval = compaction_interval
+        self.snapshot_path = os.path.join(session_dir, self.SNAPSHOT_FILE_NAME)
+        self.journal_path = os.path.join(session_dir, self.JOURNAL_FILE_NAME)
+        os.makedirs(session_dir, exist_ok=True)
+        # state of the runner as persisted on disk, used to compute the next delta. The runner is only weakly
+        # referenced so that the store does not keep an evicted session in memory.
+        self._tracked_runner: Optional["weakref.ref[CoStormRunner]"] = None
+        self._num_saved_turns = 0
+        self._num_saved_warmstart_turns = 0
+        self._num_saved_info = 0
+        self._saved_experts: List[Dict] = []
+        self._num_journal_entries = 0
+        # mind map node -> id used in the journal
+        self._node_ids: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._next_node_id = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_path)
+
+    def save(self, runner: CoStormRunner):
+        """
+        Persists the changes of the runner since the last `save`, `compact` or `load` call.
+        Falls back to writing a full snapshot if the store is not tracking this runner yet or the journal is long.
+        """
+        runner.wait_for_background_tasks()
+        knowledge_base = runner.knowledge_base
+        if (
+            self._tracked_runner is None
+            or self._tracked_runner() is not runner
+            or self._node_ids.get(knowledge_base.root) != 0
+            or not self.exists()
+            or self._num_journal_entries >= self.compaction_interval
+        ):
+            self.compact(runner)
+            return
+
+        delta = {}
+        if len(runner.conversation_history) > self._num_saved_turns:
+            delta["conversation_history"] = [
+                turn.to_dict()
+                for turn in runner.conversation_history[self._num_saved_turns :]
+            ]
+        if len(runner.warmstart_conv_archive) > self._num_saved_warmstart_turns:
+            delta["warmstart_conv_archive"] = [
+                turn.to_dict()
+                for turn in runner.warmstart_conv_archive[
+                    self._num_saved_warmstart_turns :
+                ]
+            ]
+        # citation uuids are assigned incrementally, so new information always has larger uuids
+        num_info = len(knowledge_base.info_uuid_to_info_dict)
+        if num_info > self._num_saved_info:
+            new_info = [
+                knowledge_base.info_uuid_to_info_dict[uuid]
+                for uuid in range(self._num_saved_info + 1, num_info + 1)
+            ]
+            delta["info_uuid_to_info_dict"] = {
+                info.citation_uuid: info.to_dict() for info in new_info
+            }
+            delta["info_hash_to_uuid_dict"] = {
+                hash(info): info.citation_uuid for info in new_info
+            }
+        nodes = self._serialize_dirty_nodes(knowledge_base)
+        if nodes:
+            delta["nodes"] = nodes
+        experts = runner.discourse_manager.serialize_experts()
+        if experts != self._saved_experts:
+            delta["experts"] = experts
+        if not delta:
+            return
+
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(delta, ensure_ascii=False) + "\n")
+        self._num_journal_entries += 1
+        self._track(runner, experts=experts)
+
+    def compact(self, runner: CoStormRunner):
+        """
+        Writes a full snapshot of the runner and truncates the journal.
+        """
+        runner.wait_for_background_tasks()
+        knowledge_base = runner.knowledge_base
+        knowledge_base.collect_and_reset_dirty_nodes()
+        data = runner.to_dict()
+        # serialize the tree in the same pass that numbers its nodes, so that the ids in the snapshot match the ids
+        # in memory even if the tree changes meanwhile (e.g., `save_all` during a turn)
+        self._node_ids = weakref.WeakKeyDictionary()
+        self._next_node_id = 0
+        nodes = self._serialize_nodes([knowledge_base.root])
+        data["knowledge_base"]["tree"] = self._build_tree(
+            {int(node_id): record for node_id, record in nodes.items()}
+        )
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8")))
+        os.replace(tmp_path, self.snapshot_path)
+        # the journal is only valid on top of the snapshot it was written against
+        open(self.journal_path, "w").close()
+        self._num_journal_entries = 0
+        self._track(runner, experts=data["experts"])
+
+    def load_dict(self) -> Dict:
+        """
+        Returns the session in `CoStormRunner.to_dict` format by replaying the journal onto the snapshot.
+        """
+        with open(self.snapshot_path, "rb") as f:
+            data = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+        journal, _ = self._read_journal()
+        nodes = self._flatten_tree(data["knowledge_base"]["tree"])
+        for delta in journal:
+            data["conversation_history"].extend(delta.get("conversation_history", []))
+            data.setdefault("warmstart_conv_archive", []).extend(
+                delta.get("warmstart_conv_archive", [])
+            )
+            knowledge_base = data["knowledge_base"]
+            knowledge_base["info_uuid_to_info_dict"].update(
+                delta.get("info_uuid_to_info_dict", {})
+            )
+            knowledge_base["info_hash_to_uuid_dict"].update(
+                delta.get("info_hash_to_uuid_dict", {})
+            )
+            for node_id, record in delta.get("nodes", {}).items():
+                nodes[int(node_id)] = record
+            if "experts" in delta:
+                data["experts"] = delta["experts"]
+        data["knowledge_base"]["tree"] = self._build_tree(nodes)
+        return data
+
+    def load(
+        self,
+        runner_factory: Optional[Callable[..., CoStormRunner]] = None,
+        callback_handler: BaseCallbackHandler = None,
+    ) -> CoStormRunner:
+        """
+        Restores the runner from the snapshot and journal.
+
+        Args:
+            runner_factory: Builds a runner from the session dict and callback handler. Defaults to `CoStormRunner.from_dict`.
+            callback_handler (BaseCallbackHandler, optional): Passed to the runner factory.
+        """
+        if runner_factory is None:
+            runner_factory = CoStormRunner.from_dict
+        data = self.load_dict()
+        runner = runner_factory(data, callback_handler=callback_handler)
+        # placements of information inserted before a reorganization are only recorded through the tree
+        runner.knowledge_base.update_all_info_path()
+        journal, is_torn = self._read_journal()
+        if is_torn:
+            # entries appended after a torn line would be unreachable, so start over from a fresh snapshot
+            self.compact(runner)
+        else:
+            self._num_journal_entries = len(journal)
+            runner.knowledge_base.collect_and_reset_dirty_nodes()
+            self._node_ids = weakref.WeakKeyDictionary()
+            for node, node_dict in zip(
+                self._preorder(runner.knowledge_base.root, lambda n: n.children),
+                self._preorder(data["knowledge_base"]["tree"], lambda n: n["children"]),
+            ):
+                self._node_ids[node] = node_dict["node_id"]
+            self._next_node_id = max(self._node_ids.values(), default=-1) + 1
+            self._track(runner, experts=data["experts"])
+        return runner
+
+    def _track(self, runner: CoStormRunner, experts: List[Dict]):
+        self._tracked_runner = weakref.ref(runner)
+        self._num_saved_turns = len(runner.conversation_history)
+        self._num_saved_warmstart_turns = len(runner.warmstart_conv_archive)
+        self._num_saved_info = len(runner.knowledge_base.info_uuid_to_info_dict)
+        self._saved_experts = experts
+
+    def _get_node_id(self, node) -> int:
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            node_id = self._next_node_id
+            self._next_node_id += 1
+            self._node_ids[node] = node_id
+        return node_id
+
+    def _serialize_dirty_nodes(self, knowledge_base) -> Dict[str, Dict]:
+        """
+        Returns the journal records of the nodes changed since the last save, keyed by node id.
+        Nodes no longer in the tree are skipped; new nodes are recorded with their whole subtree.
+        """
+        return self._serialize_nodes(
+            [
+                node
+                for node in knowledge_base.collect_and_reset_dirty_nodes()
+                if self._is_in_tree(node, knowledge_base.root)
+            ]
+        )
+
+    def _serialize_nodes(self, nodes) -> Dict[str, Dict]:
+        """Returns the journal records of the nodes and of the whole subtrees of their children without an id yet."""
+        records = {}
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            node_id = str(self._get_node_id(node))
+            if node_id in records:
+                continue
+            # read the children once, so that the record and the recorded subtrees agree
+            children = list(node.children)
+            stack.extend(
+                child for child in reversed(children) if child not in self._node_ids
+            )
+            records[node_id] = {
+                "name": node.name,
+                "content": sorted(node.content),
+                "children": [self._get_node_id(child) for child in children],
+                "synthesize_output": node.synthesize_output,
+                "need_regenerate_synthesize_output": node.need_regenerate_synthesize_output,
+            }
+        return records
+
+    @staticmethod
+    def _is_in_tree(node, root) -> bool:
+        # removed nodes keep their parent pointer, so check that each ancestor still lists the node as a child
+        while node is not root:
+            parent = node.parent
+            if parent is None or not any(child is node for child in parent.children):
+                return False
+            node = parent
+        return True
+
+    @staticmethod
+    def _preorder(root, get_children):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(get_children(node)))
+
+    @classmethod
+    def _flatten_tree(cls, tree: Dict) -> Dict[int, Dict]:
+        """
+        Converts a snapshot tree, whose nodes carry the ids assigned by `compact`, to journal records keyed by node id.
+        """
+        return {
+            node_dict["node_id"]: {
+                "name": node_dict["name"],
+                "content": node_dict["content"],
+                "children": [child["node_id"] for child in node_dict["children"]],
+                "synthesize_output": node_dict.get("synthesize_output"),
+                "need_regenerate_synthesize_output": node_dict.get(
+                    "need_regenerate_synthesize_output", True
+                ),
+            }
+            for node_dict in cls._preorder(tree, lambda n: n["children"])
+        }
+
+    @classmethod
+    def _build_tree(cls, nodes: Dict[int, Dict], node_id: int = 0, parent_name=None):
+        """Inverse of `_flatten_tree`. Each node dict also carries its `node_id`, which `KnowledgeNode.from_dict` ignores."""
+        record = nodes[node_id]
+        return {
+            "name": record["name"],
+            "content": record["content"],
+            "children": [
+                cls._build_tree(nodes, child_id, parent_name=record["name"])
+                for child_id in record["children"]
+            ],
+            "parent": parent_name,
+            "synthesize_output": record["synthesize_output"],
+            "need_regenerate_synthesize_output": record[
+                "need_regenerate_synthesize_output"
+            ],
+            "node_id": node_id,
+        }
+
+    def _read_journal(self) -> Tuple[List[Dict], bool]:
+        """
+        Returns the journal entries and whether the journal ends with a torn write, e.g. the process was killed mid-save.
+        """
+        journal = []
+        if not os.path.exists(self.journal_path):
+            return journal, False
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    journal.append(json.loads(line))
+                except json.JSONDecodeError:
+                    return journal, True
+        return journal, False
+
+
+class CoStormSessionManager:
+    """
+    Hosts many Co-STORM sessions in one process with a bounded number of live runners.
+
+    Runners are kept in memory in least-recently-used order. When more than `max_resident_sessions` are live, the least
+    recently used session that is not in use is saved through its `CoStormSessionStore` and dropped from memory. It is
+    rehydrated from disk on the next access. All runners share the same LM clients, retriever and encoder, so
+    rehydration does not construct new clients.
+
+    Disk I/O never runs under the manager-wide lock: loading, saving and evicting a session are serialized by a lock of
+    that session only, so a slow save does not block other sessions.
+
+    Note that the LM usage and history collected by each runner's `LoggingWrapper` come from the shared LM clients,
+    so they are not attributed to a single session.
+    """
+
+    def __init__(
+        self,
+        storage_dir: str,
+        lm_config: CollaborativeStormLMConfigs,
+        rm: Optional[dspy.Retrieve] = None,
+        encoder: Optional[Encoder] = None,
+        max_resident_sessions: int = 32,
+        compaction_interval: int = 20,
+    ):
+        """
+        Args:
+            storage_dir (str): Directory under which each session is persisted in its own sub-directory, named after
+                the session id. Session ids may only contain letters, digits, "_", "-" and "." (but not only dots).
+            lm_config (CollaborativeStormLMConfigs): LM configurations shared by all sessions.
+            rm (dspy.Retrieve, optional): Retriever shared by all sessions. Defaults to each runner's default retriever.
+            encoder (Encoder, optional): Encoder shared by all sessions. Defaults to a new `Encoder`.
+            max_resident_sessions (int): Maximum number of runners kept in memory.
+            compaction_interval (int): Passed to the `CoStormSessionStore` of each session.
+        """
+        self.storage_dir = storage_dir
+        self.lm_config = lm_config
+        self.rm = rm
+        self.encoder = Encoder() if encoder is None else encoder
+        self.max_resident_sessions = max_resident_sessions
+        self.compaction_interval = compaction_interval
+        self._resident_runners: "OrderedDict[str, CoStormRunner]" = OrderedDict()
+        # stores of resident sessions and of sessions being evicted
+        self._stores: Dict[str, CoStormSessionStore] = {}
+        # serialize loading and saving of each session, so that disk I/O never runs under the manager-wide lock
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._evicting_sessions = set()
+        self._num_active_users: Dict[str, int] = {}
+        # guards the dicts above
+        self._lock = threading.Lock()
+        os.makedirs(storage_dir, exist_ok=True)
+
+    SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,128}")
+
+    def _get_session_dir(self, session_id: str) -> str:
+        """Returns the directory of a session, rejecting ids that would resolve outside `storage_dir`."""
+        if (
+            not isinstance(session_id, str)
+            or not self.SESSION_ID_PATTERN.fullmatch(session_id)
+            or set(session_id) == {"."}
+        ):
+            raise ValueError(f"Invalid session id {session_id!r}.")
+        storage_dir = os.path.realpath(self.storage_dir)
+        session_dir = os.path.realpath(os.path.join(storage_dir, session_id))
+        if os.path.dirname(session_dir) != storage_dir:
+            raise ValueError(f"Invalid session id {session_id!r}.")
+        return session_dir
+
+    def _get_store(self, session_id: str) -> CoStormSessionStore:
+        """Must be called with the lock held."""
+        if session_id not in self._stores:
+            self._stores[session_id] = CoStormSessionStore(
+                session_dir=self._get_session_dir(session_id),
+                compaction_interval=self.compaction_interval,
+            )
+        return self._stores[session_id]
+
+    def _get_session_lock(self, session_id: str) -> threading.Lock:
+        """Must be called with the lock held."""
+        if session_id not in self._session_locks:
+            self._session_locks[session_id] = threading.Lock()
+        return self._session_locks[session_id]
+
+    def _build_runner_from_dict(
+        self, data: Dict, callback_handler: BaseCallbackHandler = None
+    ) -> CoStormRunner:
+        return CoStormRunner.from_dict(
+            data,
+            callback_handler=callback_handler,
+            lm_config=self.lm_config,
+            rm=self.rm,
+            encoder=self.encoder,
+        )
+
+    def _pop_sessions_to_evict(
+        self,
+    ) -> List[Tuple[str, CoStormRunner, CoStormSessionStore, threading.Lock]]:
+        """
+        Removes least recently used sessions from memory until the number of live runners is within bound, and
+        returns them to be saved by `_save_evicted_sessions` once the lock is released. Sessions in use or being
+        loaded or saved are skipped. The session lock of each returned session is held until it is saved, so the
+        session is not rehydrated from disk before its last changes are written. Must be called with the lock held.
+        """
+        evicted = []
+        for session_id in list(self._resident_runners):
+            if len(self._resident_runners) <= self.max_resident_sessions:
+                break
+            if self._num_active_users.get(session_id, 0) > 0:
+                continue
+            session_lock = self._get_session_lock(session_id)
+            if not session_lock.acquire(blocking=False):
+                continue
+            runner = self._resident_runners.pop(session_id)
+            self._evicting_sessions.add(session_id)
+            evicted.append(
+                (session_id, runner, self._get_store(session_id), session_lock)
+            )
+        return evicted
+
+    def _save_evicted_sessions(self, evicted):
+        for session_id, runner, store, session_lock in evicted:
+            try:
+                store.save(runner)
+            except Exception:
+                # evictions happen on behalf of another session, so a failure must not reach that caller
+                logging.exception(f"Failed to save evicted session {session_id}.")
+            finally:
+                with self._lock:
+                    self._evicting_sessions.discard(session_id)
+                    if session_id not in self._resident_runners:
+                        # drop every reference to the evicted runner
+                        self._stores.pop(session_id, None)
+                        if self._num_active_users.get(session_id, 0) == 0:
+                            self._session_locks.pop(session_id, None)
+                session_lock.release()
+
+    def has_session(self, session_id: str) -> bool:
+        with self._lock:
+            if (
+                session_id in self._resident_runners
+                or session_id in self._evicting_sessions
+            ):
+                return True
+        return os.path.exists(
+            os.path.join(
+                self._get_session_dir(session_id),
+                CoStormSessionStore.SNAPSHOT_FILE_NAME,
+            )
+        )
+
+    def create_session(
+        self,
+        session_id: str,
+        runner_argument: RunnerArgument,
+        callback_handler: BaseCallbackHandler = None,
+    ) -> CoStormRunner:
+        """
+        Creates a new session sharing the LM clients, retriever and encoder of the manager.
+        """
+        self._get_session_dir(session_id)
+        runner = CoStormRunner(
+            lm_config=self.lm_config,
+            runner_argument=runner_argument,
+            logging_wrapper=LoggingWrapper(self.lm_config),
+            rm=self.rm,
+            callback_handler=callback_handler,
+            encoder=self.encoder,
+        )
+        with self._lock:
+            session_lock = self._get_session_lock(session_id)
+        with session_lock:
+            if self.has_session(session_id):
+                raise ValueError(f"Session {session_id} already exists.")
+            with self._lock:
+                self._resident_runners[session_id] = runner
+                evicted = self._pop_sessions_to_evict()
+        self._save_evicted_sessions(evicted)
+        return runner
+
+    def get_session(
+        self, session_id: str, callback_handler: BaseCallbackHandler = None
+    ) -> CoStormRunner:
+        """
+        Returns the runner of the session, rehydrating it from disk if it is not in memory.
+        The callback handler is only used when the session needs to be rehydrated.
+        """
+        with self._lock:
+            runner = self._resident_runners.get(session_id)
+            if runner is not None:
+                self._resident_runners.move_to_end(session_id)
+                evicted = self._pop_sessions_to_evict()
+            else:
+                session_lock = self._get_session_lock(session_id)
+        if runner is None:
+            # waits for a running save of this session, e.g. its eviction
+            with session_lock:
+                with self._lock:
+                    runner = self._resident_runners.get(session_id)
+                    store = self._get_store(session_id)
+                if runner is None:
+                    if not store.exists():
+                        raise KeyError(f"Session {session_id} does not exist.")
+                    runner = store.load(
+                        runner_factory=self._build_runner_from_dict,
+                        callback_handler=callback_handler,
+                    )
+                with self._lock:
+                    self._resident_runners[session_id] = runner
+                    self._resident_runners.move_to_end(session_id)
+                    evicted = self._pop_sessions_to_evict()
+        self._save_evicted_sessions(evicted)
+        return runner
+
+    @contextmanager
+    def session(self, session_id: str, callback_handler: BaseCallbackHandler = None):
+        """
+        Context manager yielding the runner of the session. The session is not evicted while inside the context
+        and its changes are saved on exit.
+        """
+        with self._lock:
+            self._num_active_users[session_id] = (
+                self._num_active_users.get(session_id, 0) + 1
+            )
+        try:
+            runner = self.get_session(session_id, callback_handler=callback_handler)
+            yield runner
+            self.save_session(session_id)
+        finally:
+            with self._lock:
+                self._num_active_users[session_id] -= 1
+                if self._num_active_users[session_id] == 0:
+                    del self._num_active_users[session_id]
+                evicted = self._pop_sessions_to_evict()
+            self._save_evicted_sessions(evicted)
+
+    def save_session(self, session_id: str):
+        """
+        Persists the changes of a live session. Does nothing if the session is not in memory.
+        """
+        with self._lock:
+            if session_id not in self._resident_runners:
+                return
+            session_lock = self._get_session_lock(session_id)
+        with session_lock:
+            with self._lock:
+                # the session may have been evicted, and thereby saved, while waiting for the lock
+                runner = self._resident_runners.get(session_id)
+                store = self._get_store(session_id) if runner is not None else None
+            if runner is not None:
+                store.save(runner)
+
+    def save_all(self):
+        """
+        Persists all live sessions, e.g. before shutting down the process.
+        """
+        with self._lock:
+            session_ids = list(self._resident_runners)
+        for session_id in session_ids:
+            self.save_session(session_id)
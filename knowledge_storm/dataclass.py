@@ -2,10 +2,11 @@ import dspy
 import numpy as np
 import re
 import threading
-from typing import Set, Dict, List, Optional, Union, Tuple
+from concurrent.futures import Executor
+from typing import Callable, Set, Dict, List, Optional, Union, Tuple
 
 from .encoder import Encoder
-from .interface import Information
+from .interface import Information, InformationStore
 
 
 class ConversationTurn:
@@ -117,6 +118,18 @@ class KnowledgeNode:
         self.parent = parent
         self.synthesize_output = synthesize_output
         self.need_regenerate_synthesize_output = need_regenerate_synthesize_output
+        # nodes of this tree changed since the last `KnowledgeBase.collect_and_reset_dirty_nodes` call, shared by
+        # every node of the tree
+        self.dirty_nodes: Set["KnowledgeNode"] = (
+            parent.dirty_nodes if parent is not None else set()
+        )
+
+    def mark_dirty(self):
+        """
+        Records that the name, content, children or synthesized output of this node changed.
+        Code changing these attributes directly (rather than through the methods of this class) must call it.
+        """
+        self.dirty_nodes.add(self)
 
     def collect_all_content(self):
         """
@@ -152,6 +165,8 @@ class KnowledgeNode:
                 )
         child_node = KnowledgeNode(name=child_node_name, parent=self)
         self.children.append(child_node)
+        self.mark_dirty()
+        child_node.mark_dirty()
         return child_node
 
     def get_parent(self):
@@ -205,8 +220,19 @@ class KnowledgeNode:
 
     def insert_information(self, information_index: int):
         if information_index not in self.content:
-            self.need_regenerate_synthesize_output = True
             self.content.add(information_index)
+            self.mark_need_regenerate_synthesize_output()
+
+    def mark_need_regenerate_synthesize_output(self):
+        """
+        Marks the synthesized section of this node and all its predecessors as stale, since a section is
+        synthesized from the content of the node and all its descendants.
+        """
+        current_node = self
+        while current_node is not None:
+            current_node.need_regenerate_synthesize_output = True
+            current_node.mark_dirty()
+            current_node = current_node.parent
 
     def get_all_descendents(self) -> List["KnowledgeNode"]:
         """
@@ -311,12 +337,14 @@ class KnowledgeBase:
         knowledge_base_lm: Union[dspy.dsp.LM, dspy.dsp.HFModel],
         node_expansion_trigger_count: int,
         encoder: Encoder,
+        max_thread: int = 5,
     ):
         """
         Initializes a KnowledgeBase instance.
 
         Args:
             topic (str): The topic of the knowledge base
+            max_thread (int): Maximum number of threads used for information placement, node expansion and report generation.
             expand_node_module (dspy.Module): The module that organize knowledge base in place.
                 The module should accept knowledge base as param. E.g. expand_node_module(self)
             article_generation_module (dspy.Module): The module that generate report from knowledge base.
@@ -335,6 +363,7 @@ class KnowledgeBase:
 
         self.topic: str = topic
         self.encoder: Encoder = encoder
+        self.max_thread = max_thread
 
         self.information_insert_module = InsertInformationModule(
             engine=knowledge_base_lm, encoder=self.encoder
@@ -343,9 +372,10 @@ class KnowledgeBase:
             engine=knowledge_base_lm,
             information_insert_module=self.information_insert_module,
             node_expansion_trigger_count=node_expansion_trigger_count,
+            max_thread=max_thread,
         )
         self.article_generation_module = ArticleGenerationModule(
-            engine=knowledge_base_lm
+            engine=knowledge_base_lm, max_thread=max_thread
         )
         self.gen_summary_module = KnowledgeBaseSummaryModule(engine=knowledge_base_lm)
 
@@ -357,7 +387,13 @@ class KnowledgeBase:
         }
         self.info_uuid_to_info_dict: Dict[int, Information] = {}
         self.info_hash_to_uuid_dict: Dict[int, int] = {}
+        # canonical instances of the inserted information, which conversation turns share instead of holding copies
+        self.information_store = InformationStore()
+        # normalized embeddings of cited snippets, extended incrementally as information is inserted
+        self.cited_snippet_embeddings: np.ndarray = np.empty((0, 0))
+        self._info_uuids_pending_embedding: List[int] = []
         self._lock = threading.Lock()
+        self._embedding_lock = threading.Lock()
 
     def to_dict(self):
         info_uuid_to_info_dict = {
@@ -377,12 +413,14 @@ class KnowledgeBase:
         knowledge_base_lm: Union[dspy.dsp.LM, dspy.dsp.HFModel],
         node_expansion_trigger_count: int,
         encoder: Encoder,
+        max_thread: int = 5,
     ):
         knowledge_base = cls(
             topic=data["topic"],
             knowledge_base_lm=knowledge_base_lm,
             node_expansion_trigger_count=node_expansion_trigger_count,
             encoder=encoder,
+            max_thread=max_thread,
         )
         knowledge_base.root = KnowledgeNode.from_dict(data["tree"])
         knowledge_base.info_hash_to_uuid_dict = {
@@ -394,6 +432,9 @@ class KnowledgeBase:
             for key, value in data["info_uuid_to_info_dict"].items()
         }
         knowledge_base.info_uuid_to_info_dict = info_uuid_to_info_dict
+        for information in info_uuid_to_info_dict.values():
+            knowledge_base.information_store.intern(information)
+        knowledge_base._info_uuids_pending_embedding = list(info_uuid_to_info_dict)
         return knowledge_base
 
     def get_knowledge_base_structure_embedding(
@@ -406,20 +447,23 @@ class KnowledgeBase:
             root=root,
         )
         outline_string_hash = hash(outline_string)
-        if outline_string_hash != self.kb_embedding["hash"]:
+        # read the cache once, as concurrent node expansions may replace it for a different root
+        kb_embedding = self.kb_embedding
+        if outline_string_hash != kb_embedding["hash"]:
             outline_strings: List[str] = outline_string.split("\n")
             cleaned_outline_strings = [
                 outline.replace(" -> ", ", ") for outline in outline_strings
             ]
             encoded_outline = self.encoder.encode(cleaned_outline_strings)
-            self.kb_embedding = {
+            kb_embedding = {
                 "hash": outline_string_hash,
                 "encoded_structure": encoded_outline,
                 "structure_string": outline_strings,
             }
+            self.kb_embedding = kb_embedding
         return (
-            self.kb_embedding["encoded_structure"],
-            self.kb_embedding["structure_string"],
+            kb_embedding["encoded_structure"],
+            kb_embedding["structure_string"],
         )
 
     def traverse_down(self, node):
@@ -703,15 +747,65 @@ class KnowledgeBase:
                 info_citation_uuid = self.info_hash_to_uuid_dict.get(
                     information_hash, len(self.info_hash_to_uuid_dict) + 1
                 )
+                if information_hash not in self.info_hash_to_uuid_dict:
+                    self._info_uuids_pending_embedding.append(info_citation_uuid)
                 information.citation_uuid = info_citation_uuid
                 self.info_hash_to_uuid_dict[information_hash] = info_citation_uuid
                 self.info_uuid_to_info_dict[info_citation_uuid] = information
+                self.information_store.intern(information)
             if target_node is not None:
                 self.info_uuid_to_info_dict[information.citation_uuid].meta[
                     "placement"
                 ] = " -> ".join(target_node.get_path_from_root())
                 target_node.insert_information(information.citation_uuid)
 
+    def intern_conv_turn_information(self, conv_turn: ConversationTurn):
+        """
+        Replaces the retrieved information of the conversation turn with the instances of the same content held by
+        the knowledge base, so that the turn does not keep its own copies of cited information.
+        """
+        conv_turn.raw_retrieved_info = [
+            self.information_store.intern(info) for info in conv_turn.raw_retrieved_info
+        ]
+
+    def is_cited_information(self, information: Information) -> bool:
+        """
+        Returns whether the given information has been inserted into the knowledge base.
+        """
+        return hash(information) in self.info_hash_to_uuid_dict
+
+    def get_cited_snippet_embeddings(self) -> np.ndarray:
+        """
+        Returns the L2-normalized embedding matrix of the first snippet of every cited information.
+
+        Only information inserted since the last call is encoded, so the cost of each call is proportional to
+        the newly cited information rather than the whole knowledge base.
+
+        Returns:
+            np.ndarray: A matrix of shape (number of cited snippets, embedding dimension).
+        """
+        with self._embedding_lock:
+            with self._lock:
+                pending_uuids = self._info_uuids_pending_embedding
+                self._info_uuids_pending_embedding = []
+            if pending_uuids:
+                snippets = [
+                    self.info_uuid_to_info_dict[uuid].snippets[0]
+                    for uuid in pending_uuids
+                ]
+                new_embeddings = self.encoder.encode(snippets, max_workers=20)
+                if new_embeddings.size > 0:
+                    new_embeddings = new_embeddings.reshape(len(new_embeddings), -1)
+                    norms = np.linalg.norm(new_embeddings, axis=1, keepdims=True)
+                    new_embeddings = new_embeddings / np.where(norms == 0, 1, norms)
+                    if self.cited_snippet_embeddings.size == 0:
+                        self.cited_snippet_embeddings = new_embeddings
+                    else:
+                        self.cited_snippet_embeddings = np.vstack(
+                            [self.cited_snippet_embeddings, new_embeddings]
+                        )
+            return self.cited_snippet_embeddings
+
     def trim_empty_leaf_nodes(self):
         """
         Trims all leaf nodes that do not have any content. Iteratively does it until all leaf nodes have at least one content.
@@ -720,7 +814,12 @@ class KnowledgeBase:
         def trim_node(node):
             if not node.children and not node.content:
                 return True
-            node.children = [child for child in node.children if not trim_node(child)]
+            remaining_children = [
+                child for child in node.children if not trim_node(child)
+            ]
+            if len(remaining_children) < len(node.children):
+                node.children = remaining_children
+                node.mark_dirty()
             return not node.children and not node.content
 
         # Start the trimming process from the root
@@ -767,6 +866,7 @@ class KnowledgeBase:
                 node.children = single_child.children
                 for grandchild in node.children:
                     grandchild.parent = node
+                node.mark_need_regenerate_synthesize_output()
 
         merge_node(self.root)
 
@@ -799,6 +899,40 @@ class KnowledgeBase:
                 information=info_to_insert,
                 allow_create_new_node=allow_create_new_node,
             )
+        self._update_conv_turn_citation_index(conv_turn)
+        self.intern_conv_turn_information(conv_turn)
+
+    def update_from_conv_turns(
+        self,
+        conv_turns: List[ConversationTurn],
+        executor: Optional[Executor] = None,
+    ):
+        """
+        Inserts the cited information of several conversation turns in one pass, without creating new nodes.
+
+        Equivalent to calling `update_from_conv_turn(conv_turn, allow_create_new_node=False)` for each turn, but the
+        placement of all information is decided concurrently because the mind map structure does not change.
+
+        Args:
+            conv_turns: Conversation turns whose cited information should be inserted.
+            executor: Optional executor to run the placement LM calls in.
+        """
+        conv_turns = [conv_turn for conv_turn in conv_turns if conv_turn is not None]
+        info_to_insert = [
+            info for conv_turn in conv_turns for info in conv_turn.cited_info.values()
+        ]
+        self.information_insert_module(
+            knowledge_base=self,
+            information=info_to_insert,
+            allow_create_new_node=False,
+            max_thread=self.max_thread,
+            executor=executor,
+        )
+        for conv_turn in conv_turns:
+            self._update_conv_turn_citation_index(conv_turn)
+            self.intern_conv_turn_information(conv_turn)
+
+    def _update_conv_turn_citation_index(self, conv_turn: ConversationTurn):
         old_to_new_citation_idx_mapping = {
             old_idx: info.citation_uuid
             for old_idx, info in conv_turn.cited_info.items()
@@ -822,6 +956,15 @@ class KnowledgeBase:
             conv_turn.raw_utterance.replace("[-1]", "")
         conv_turn.cited_info = None
 
+    def collect_and_reset_dirty_nodes(self) -> Set[KnowledgeNode]:
+        """
+        Returns the nodes changed since the last call, including nodes that have since been removed from the tree.
+        Used to persist the tree incrementally, see `CoStormSessionStore`.
+        """
+        dirty_nodes = set(self.root.dirty_nodes)
+        self.root.dirty_nodes.clear()
+        return dirty_nodes
+
     def get_knowledge_base_summary(self):
         return self.gen_summary_module(self)
 
@@ -845,5 +988,13 @@ class KnowledgeBase:
         self.merge_single_child_nodes()
         self.update_all_info_path()
 
-    def to_report(self):
-        return self.article_generation_module(knowledge_base=self)
+    def to_report(
+        self,
+        executor: Optional[Executor] = None,
+        on_section_generated: Optional[Callable[["KnowledgeNode"], None]] = None,
+    ):
+        return self.article_generation_module(
+            knowledge_base=self,
+            executor=executor,
+            on_section_generated=on_section_generated,
+        )
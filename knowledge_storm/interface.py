@@ -1,15 +1,19 @@
 import concurrent.futures
-import dspy
 import functools
 import hashlib
 import json
 import logging
+import math
+import threading
 import time
+import weakref
 from abc import ABC, abstractmethod
 from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Dict, List, Optional, Union, TYPE_CHECKING
 
-from .utils import ArticleTextProcessing
+from .utils import ArticleTextProcessing, WebPageHelper
 
 logging.basicConfig(
     level=logging.INFO, format="%(name)s : %(levelname)-8s : %(message)s"
@@ -17,7 +21,106 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 if TYPE_CHECKING:
+    import dspy
+    from .lm import LMHistorySink
     from .logging_wrapper import LoggingWrapper
+    from .query_cache import SemanticQueryCache
+
+# Deadline of the work running in the current thread, see `Deadline.activate`.
+_active_deadline: ContextVar[Optional["Deadline"]] = ContextVar(
+    "active_deadline", default=None
+)
+
+
+class Deadline:
+    """
+    Wall-clock time budget of a pipeline run, e.g., "produce the best article you can within 90 seconds".
+
+    Stages pass the deadline along and check it before starting optional work, so that they trim what is left (fewer
+    conversation turns, fewer personas, lighter polishing) instead of overrunning the budget. Calls that cannot take
+    the deadline as an argument (LM requests, retries inside retrieval modules) read the deadline activated in the
+    current thread and bound their timeouts by the remaining time.
+
+    A Deadline without a budget never expires, so code can take one unconditionally.
+    """
+
+    # Below this fraction of its budget, a deadline is running low and stages switch to cheaper fallbacks.
+    LOW_FRACTION = 0.25
+
+    def __init__(self, budget: Optional[float] = None):
+        """
+        Args:
+            budget: Seconds from now until the deadline. None means no deadline.
+        """
+        self.budget = budget
+        self.start_time = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def remaining(self) -> float:
+        """Seconds left until the deadline, `math.inf` without a budget."""
+        if self.budget is None:
+            return math.inf
+        return max(0.0, self.budget - self.elapsed())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def fraction_remaining(self) -> float:
+        if self.budget is None:
+            return 1.0
+        if self.budget <= 0:
+            return 0.0
+        return self.remaining() / self.budget
+
+    def running_low(self) -> bool:
+        return self.fraction_remaining() < self.LOW_FRACTION
+
+    def timeout(
+        self, default: Optional[float] = None, minimum: float = 1.0
+    ) -> Optional[float]:
+        """
+        Timeout for a single call: `default` (None meaning no timeout) capped by the remaining time. It never drops
+        below `minimum`, so a call made after the deadline fails fast instead of not being attempted at all.
+        """
+        remaining = self.remaining()
+        if default is None:
+            return None if remaining == math.inf else max(minimum, remaining)
+        return max(minimum, min(default, remaining))
+
+    def share(self, fraction: float) -> "Deadline":
+        """
+        Returns a deadline ending after `fraction` of the remaining time, used to reserve the rest of the budget for
+        later stages. Without a budget, the returned deadline has no budget either.
+        """
+        if self.budget is None:
+            return Deadline()
+        return Deadline(self.remaining() * fraction)
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes this deadline the one returned by `Deadline.current()` in the current thread within the context.
+        Context variables are not inherited by executor threads, so work submitted to a thread pool activates the
+        deadline again.
+        """
+        token = _active_deadline.set(self)
+        try:
+            yield self
+        finally:
+            _active_deadline.reset(token)
+
+    @staticmethod
+    def current() -> "Deadline":
+        """Returns the deadline activated in the current thread, or a deadline without budget."""
+        deadline = _active_deadline.get()
+        return deadline if deadline is not None else Deadline()
+
+    def __repr__(self):
+        if self.budget is None:
+            return "Deadline(budget=None)"
+        return f"Deadline(budget={self.budget:.1f}, remaining={self.remaining():.1f})"
 
 
 class InformationTable(ABC):
@@ -51,6 +154,18 @@ class Information:
         url (str): The unique URL (serving as UUID) of the information.
     """
 
+    __slots__ = (
+        "description",
+        "snippets",
+        "title",
+        "url",
+        "meta",
+        "citation_uuid",
+        "_hash_key",
+        "_hash_value",
+        "__weakref__",
+    )
+
     def __init__(self, url, description, snippets, title, meta=None):
         """Initialize the Information object with detailed attributes.
 
@@ -66,14 +181,8 @@ class Information:
         self.url = url
         self.meta = meta if meta is not None else {}
         self.citation_uuid = -1
-
-    def __hash__(self):
-        return hash(
-            (
-                self.url,
-                tuple(sorted(self.snippets)),
-            )
-        )
+        self._hash_key = None
+        self._hash_value = None
 
     def __eq__(self, other):
         if not isinstance(other, Information):
@@ -85,10 +194,22 @@ class Information:
         )
 
     def __hash__(self):
-        return int(
-            self._md5_hash((self.url, tuple(sorted(self.snippets)), self._meta_str())),
-            16,
+        # snippets and meta are mutable, so the cached digest is only reused while its inputs are unchanged
+        hash_key = (
+            self.url,
+            tuple(self.snippets),
+            self.meta.get("question", ""),
+            self.meta.get("query", ""),
         )
+        if hash_key != self._hash_key:
+            self._hash_value = int(
+                self._md5_hash(
+                    (self.url, tuple(sorted(self.snippets)), self._meta_str())
+                ),
+                16,
+            )
+            self._hash_key = hash_key
+        return self._hash_value
 
     def _meta_str(self):
         """Generate a string representation of relevant meta information."""
@@ -122,6 +243,25 @@ class Information:
         info.citation_uuid = int(info_dict.get("citation_uuid", -1))
         return info
 
+    def copy(self, snippets: Optional[List[str]] = None):
+        """Create a shallow copy of the Information object, optionally replacing its snippets.
+
+        Args:
+            snippets (list, optional): Snippets of the copy. Defaults to a copy of the current snippets.
+
+        Returns:
+            Information: A new Information instance that does not share mutable attributes with this one.
+        """
+        info = Information(
+            url=self.url,
+            description=self.description,
+            snippets=list(self.snippets) if snippets is None else snippets,
+            title=self.title,
+            meta=dict(self.meta),
+        )
+        info.citation_uuid = self.citation_uuid
+        return info
+
     def to_dict(self):
         return {
             "url": self.url,
@@ -133,10 +273,38 @@ class Information:
         }
 
 
+class InformationStore:
+    """Content-addressed pool of Information objects.
+
+    Information with the same content (url, snippets, question and query) is interned to a single instance, so that
+    the knowledge base and the conversation turns citing it do not hold duplicate copies (see
+    `KnowledgeBase.information_store`). Values are held weakly and are released once nothing else refers to them.
+    """
+
+    def __init__(self):
+        self._digest_to_info = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def intern(self, info: Information) -> Information:
+        """Return the canonical instance with the same content as `info`, registering `info` if there is none."""
+        digest = hash(info)
+        with self._lock:
+            existing_info = self._digest_to_info.get(digest)
+            if existing_info is not None:
+                return existing_info
+            self._digest_to_info[digest] = info
+            return info
+
+    def __len__(self):
+        return len(self._digest_to_info)
+
+
 class ArticleSectionNode:
     """
     The ArticleSectionNode is the dataclass for handling the section of the article.
     The content storage, section writing preferences are defined in this node.
+
+    Children should be modified through add_child and remove_child so that the section name indices stay in sync.
     """
 
     def __init__(self, section_name: str, content=None):
@@ -148,15 +316,83 @@ class ArticleSectionNode:
         self.content = content
         self.children = []
         self.preference = None
+        self.parent = None
+        # section name -> direct children with that name, in the order of self.children
+        self._children_by_name: Dict[str, List["ArticleSectionNode"]] = {}
+        # section name -> nodes with that name in the subtree; only maintained on the tree root
+        self._subtree_index: Optional[Dict[str, List["ArticleSectionNode"]]] = None
+
+    def get_root(self) -> "ArticleSectionNode":
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
+    def iter_subtree(self):
+        """Iterate over this node and all its descendants in pre-order."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def get_child(self, section_name: str) -> Optional["ArticleSectionNode"]:
+        """Return the first direct child with the given section name, or None."""
+        children = self._children_by_name.get(section_name)
+        return children[0] if children else None
+
+    def get_subtree_index(self) -> Dict[str, List["ArticleSectionNode"]]:
+        """Return the section name -> nodes index of the tree this node belongs to."""
+        root = self.get_root()
+        if root._subtree_index is None:
+            root._subtree_index = {}
+            for node in root.iter_subtree():
+                root._subtree_index.setdefault(node.section_name, []).append(node)
+        return root._subtree_index
 
     def add_child(self, new_child_node, insert_to_front=False):
         if insert_to_front:
             self.children.insert(0, new_child_node)
         else:
             self.children.append(new_child_node)
+        new_child_node.parent = self
+        new_child_node._subtree_index = None
+        siblings = self._children_by_name.setdefault(new_child_node.section_name, [])
+        if insert_to_front:
+            siblings.insert(0, new_child_node)
+        else:
+            siblings.append(new_child_node)
+        root = self.get_root()
+        if root._subtree_index is not None:
+            for node in new_child_node.iter_subtree():
+                root._subtree_index.setdefault(node.section_name, []).append(node)
 
     def remove_child(self, child):
         self.children.remove(child)
+        siblings = self._children_by_name.get(child.section_name, [])
+        if child in siblings:
+            siblings.remove(child)
+            if not siblings:
+                del self._children_by_name[child.section_name]
+        root = self.get_root()
+        if root._subtree_index is not None:
+            for node in child.iter_subtree():
+                nodes = root._subtree_index.get(node.section_name, [])
+                if node in nodes:
+                    nodes.remove(node)
+                    if not nodes:
+                        del root._subtree_index[node.section_name]
+        child.parent = None
+        child._subtree_index = None
+
+    def _preorder_key(self) -> List[int]:
+        key = []
+        node = self
+        while node.parent is not None:
+            key.append(node.parent.children.index(node))
+            node = node.parent
+        key.reverse()
+        return key
 
 
 class Article(ABC):
@@ -176,13 +412,19 @@ class Article(ABC):
         Return:
             reference of the node or None if section name has no match
         """
-        if node.section_name == name:
-            return node
-        for child in node.children:
-            result = self.find_section(child, name)
-            if result:
-                return result
-        return None
+        candidates = []
+        for candidate in node.get_subtree_index().get(name, []):
+            ancestor = candidate
+            while ancestor is not None and ancestor is not node:
+                ancestor = ancestor.parent
+            if ancestor is node:
+                candidates.append(candidate)
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        # keep the pre-order first match semantics of a depth-first search
+        return min(candidates, key=lambda candidate: candidate._preorder_key())
 
     @abstractmethod
     def to_string(self) -> str:
@@ -247,9 +489,9 @@ class Article(ABC):
         if node is None:
             node = self.root
 
-        node.children[:] = [
-            child for child in node.children if self.prune_empty_nodes(child)
-        ]
+        for child in node.children[:]:
+            if self.prune_empty_nodes(child) is None:
+                node.remove_child(child)
 
         if (node.content is None or node.content == "") and not node.children:
             return None
@@ -266,9 +508,35 @@ class Retriever:
     The retrieval model/search engine used for each part should be declared with a suffix '_rm' in the attribute name.
     """
 
-    def __init__(self, rm: dspy.Retrieve, max_thread: int = 1):
+    def __init__(
+        self,
+        rm: "dspy.Retrieve",
+        max_thread: int = 1,
+        query_cache: Optional["SemanticQueryCache"] = None,
+        max_snippets_per_source: Optional[int] = None,
+        min_snippet_relevance: float = 0.0,
+    ):
+        """
+        Args:
+            rm: The retrieval module. If it has a `forward_batch(queries, exclude_urls)` method returning the results
+                of each query separately (e.g., `VectorRM`), all queries of a `retrieve` call are searched with one
+                call of that method.
+            max_thread: Maximum number of queries searched concurrently by retrieval modules without `forward_batch`.
+            query_cache: If provided, queries that are paraphrases of earlier queries on the same topic are served
+                from this cache instead of calling `rm`. Empty results are not cached. `exclude_urls` is not part of
+                the cache key: cached results are filtered by the `exclude_urls` of the later call, but are not
+                refilled with the results that the call which populated the cache excluded.
+            max_snippets_per_source: If provided, only this many snippets of each search result are kept, chosen by
+                their lexical relevance to the query. Retrievers that fetch whole pages otherwise return every chunk.
+            min_snippet_relevance: Minimum BM25 score for a snippet to be kept when pruning snippets.
+        """
         self.max_thread = max_thread
         self.rm = rm
+        self.query_cache = query_cache
+        self.max_snippets_per_source = max_snippets_per_source
+        self.min_snippet_relevance = min_snippet_relevance
+        self._snippet_pruning_stats = {"kept": 0, "dropped": 0}
+        self._snippet_pruning_lock = threading.Lock()
 
     def collect_and_reset_rm_usage(self):
         combined_usage = []
@@ -285,17 +553,69 @@ class Retriever:
 
         return name_to_usage
 
+    def collect_and_reset_snippet_pruning_stats(self) -> Dict[str, int]:
+        """Returns the number of snippets kept and dropped by snippet pruning since the last call."""
+        with self._snippet_pruning_lock:
+            stats = self._snippet_pruning_stats
+            self._snippet_pruning_stats = {"kept": 0, "dropped": 0}
+        return stats
+
+    def _prune_snippets(self, query: str, data_list: List[Dict]):
+        kept = 0
+        dropped = 0
+        for data in data_list:
+            num_snippets = len(data["snippets"])
+            data["snippets"] = WebPageHelper.prune_snippets(
+                query,
+                data["snippets"],
+                max_snippets=self.max_snippets_per_source,
+                min_relevance=self.min_snippet_relevance,
+            )
+            kept += len(data["snippets"])
+            dropped += num_snippets - len(data["snippets"])
+        with self._snippet_pruning_lock:
+            self._snippet_pruning_stats["kept"] += kept
+            self._snippet_pruning_stats["dropped"] += dropped
+
     def retrieve(
-        self, query: Union[str, List[str]], exclude_urls: List[str] = []
+        self,
+        query: Union[str, List[str]],
+        exclude_urls: List[str] = [],
+        topic: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
     ) -> List[Information]:
+        """
+        Args:
+            query: The query or queries to search for.
+            exclude_urls: A list of urls to exclude from the search results.
+            topic: The topic the queries are about. Scopes the lookups in `query_cache`.
+            deadline: If provided, nothing is searched once it has expired, and it is activated while searching so
+                that `rm` can bound its own timeouts and retries (see `Deadline.current`).
+        """
         queries = query if isinstance(query, list) else [query]
         to_return = []
-
-        def process_query(q):
-            retrieved_data_list = self.rm(
-                query_or_queries=[q], exclude_urls=exclude_urls
+        if deadline is None:
+            deadline = Deadline.current()
+        if deadline.expired():
+            logging.warning(
+                f"Deadline expired, skipping the search of {len(queries)} queries."
             )
-            local_to_return = []
+            return to_return
+        query_vectors = (
+            self.query_cache.embed(queries)
+            if self.query_cache is not None and queries
+            else None
+        )
+
+        def lookup(query_vector):
+            cached_data_list = self.query_cache.lookup(query_vector, topic=topic)
+            if cached_data_list is None:
+                return None
+            return [
+                data for data in cached_data_list if data["url"] not in exclude_urls
+            ]
+
+        def postprocess(q, query_vector, retrieved_data_list):
             for data in retrieved_data_list:
                 for i in range(len(data["snippets"])):
                     # STORM generate the article with citations. We do not consider multi-hop citations.
@@ -303,18 +623,59 @@ class Retriever:
                     data["snippets"][i] = ArticleTextProcessing.remove_citations(
                         data["snippets"][i]
                     )
-                storm_info = Information.from_dict(data)
-                storm_info.meta["query"] = q
-                local_to_return.append(storm_info)
-            return local_to_return
+            if self.max_snippets_per_source is not None:
+                self._prune_snippets(q, retrieved_data_list)
+            # an empty result is usually a transient backend failure and must not hide the query until the TTL ends
+            if self.query_cache is not None and retrieved_data_list:
+                self.query_cache.insert(
+                    q, query_vector, retrieved_data_list, topic=topic
+                )
+            return retrieved_data_list
 
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_thread
-        ) as executor:
-            results = list(executor.map(process_query, queries))
+        def search(q, query_vector):
+            if self.query_cache is not None:
+                cached_data_list = lookup(query_vector)
+                if cached_data_list is not None:
+                    return cached_data_list
+            retrieved_data_list = self.rm(
+                query_or_queries=[q], exclude_urls=exclude_urls
+            )
+            return postprocess(q, query_vector, retrieved_data_list)
+
+        def process_query(q, query_vector=None):
+            with deadline.activate():
+                return search(q, query_vector)
+
+        if query_vectors is None:
+            query_vectors = [None] * len(queries)
+        if hasattr(self.rm, "forward_batch"):
+            # the retrieval module searches several queries in one request, so it gets every query missing from the
+            # cache at once and returns the results of each query separately
+            data_lists = [
+                lookup(query_vector) if self.query_cache is not None else None
+                for query_vector in query_vectors
+            ]
+            misses = [i for i, data_list in enumerate(data_lists) if data_list is None]
+            if misses:
+                with deadline.activate():
+                    batch_data_lists = self.rm.forward_batch(
+                        [queries[i] for i in misses], exclude_urls=exclude_urls
+                    )
+                for i, retrieved_data_list in zip(misses, batch_data_lists):
+                    data_lists[i] = postprocess(
+                        queries[i], query_vectors[i], retrieved_data_list
+                    )
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_thread
+            ) as executor:
+                data_lists = list(executor.map(process_query, queries, query_vectors))
 
-        for result in results:
-            to_return.extend(result)
+        for q, data_list in zip(queries, data_lists):
+            for data in data_list:
+                storm_info = Information.from_dict(data)
+                storm_info.meta["query"] = q
+                to_return.append(storm_info)
 
         return to_return
 
@@ -440,12 +801,66 @@ class LMConfigs(ABC):
                     f"Language model for {attr_name} is not initialized. Please call set_{attr_name}()"
                 )
 
-    def collect_and_reset_lm_history(self):
+    def set_lm_history_policy(
+        self,
+        retention: str = "full",
+        max_entries: Optional[int] = None,
+        sink: Optional["LMHistorySink"] = None,
+    ):
+        """
+        Set what the call history of every language model in this config keeps. Call it after all models are set.
+        Histories are unbounded unless `max_entries` is given.
+
+        Args:
+            retention: "none", "metadata" or "full". See `LMHistory`.
+            max_entries: Maximum number of records kept in memory per model. None means unbounded.
+            sink: If given, every full record is streamed to it as it is produced and
+                `collect_and_reset_lm_history` reads the records back from the sink.
+        """
+        from .lm import LMHistory
+
+        self.lm_history_sink = sink
+        self._lm_history_sink_offset = sink.tell() if sink is not None else 0
+        for attr_name in self.__dict__:
+            if "_lm" in attr_name and hasattr(getattr(self, attr_name), "history"):
+                lm = getattr(self, attr_name)
+                history = LMHistory(max_entries=max_entries, retention=retention)
+                # keep records produced before the policy was set, without sending them to the sink
+                history.extend(
+                    lm.history.collect_and_reset()
+                    if isinstance(lm.history, LMHistory)
+                    else lm.history
+                )
+                history.sink = sink
+                lm.history = history
+
+    def collect_and_reset_lm_history(self, lazy: bool = False):
+        """
+        Collect the LM call history since the last call and reset it.
+
+        Args:
+            lazy: If True and a sink is set, return an `LMHistorySinkSlice` to be read later instead of the records.
+        """
+        from .lm import LMHistory, LMHistorySinkSlice
+
         history = []
         for attr_name in self.__dict__:
             if "_lm" in attr_name and hasattr(getattr(self, attr_name), "history"):
-                history.extend(getattr(self, attr_name).history)
-                getattr(self, attr_name).history = []
+                lm_history = getattr(self, attr_name).history
+                if isinstance(lm_history, LMHistory):
+                    history.extend(lm_history.collect_and_reset())
+                else:
+                    history.extend(lm_history)
+                    getattr(self, attr_name).history = []
+
+        sink = getattr(self, "lm_history_sink", None)
+        if sink is not None:
+            # the sink holds the full records, including the ones dropped from the in-memory buffers
+            sink_slice = LMHistorySinkSlice(
+                sink, self._lm_history_sink_offset, sink.tell()
+            )
+            self._lm_history_sink_offset = sink_slice.end
+            return sink_slice if lazy else sink_slice.read()
 
         return history
 
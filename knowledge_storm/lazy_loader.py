@@ -0,0 +1,55 @@
+import importlib
+import sys
+from typing import Dict, List
+
+
+def attach_lazy_loader(package_name: str, submodule_attrs: Dict[str, List[str]]):
+    """
+    Defers importing the submodules of a package until one of their attributes is accessed.
+
+    Replaces `from .submodule import *` chains in package `__init__` files, which import every heavy dependency
+    (dspy, litellm, sentence_transformers, sklearn, ...) as soon as the package is imported.
+
+    Args:
+        package_name: `__name__` of the package.
+        submodule_attrs: Ordered registry of relative submodule name -> public names it provides. The order follows
+            the original star imports: if several submodules provide the same name, the last one wins.
+            Names missing from the registry are looked up in all submodules, again with the last one winning.
+
+    Returns:
+        `(__getattr__, __dir__, __all__)` to assign in the package namespace.
+    """
+    attr_to_submodule = {}
+    for submodule, attrs in submodule_attrs.items():
+        for attr in attrs:
+            attr_to_submodule[attr] = submodule
+    submodules = list(dict.fromkeys(submodule_attrs))
+    direct_submodules = set(submodule.split(".")[1] for submodule in submodules)
+
+    def __getattr__(name):
+        if name.startswith("_"):
+            raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+        if name in direct_submodules:
+            value = importlib.import_module(f".{name}", package_name)
+        elif name in attr_to_submodule:
+            value = getattr(
+                importlib.import_module(attr_to_submodule[name], package_name), name
+            )
+        else:
+            for submodule in reversed(submodules):
+                module = importlib.import_module(submodule, package_name)
+                if hasattr(module, name):
+                    value = getattr(module, name)
+                    break
+            else:
+                raise AttributeError(
+                    f"module {package_name!r} has no attribute {name!r}"
+                )
+        # cache the attribute so that __getattr__ is only called once per name
+        setattr(sys.modules[package_name], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package_name])) | set(attr_to_submodule))
+
+    return __getattr__, __dir__, list(attr_to_submodule)
@@ -1,12 +1,15 @@
 import backoff
 import dspy
 import functools
+import json
 import logging
 import os
 import random
 import requests
 import threading
-from typing import Optional, Literal, Any
+import time
+from collections import deque
+from typing import Optional, Literal, Any, Dict, List
 import ujson
 from pathlib import Path
 
@@ -17,6 +20,8 @@ from dsp.modules.hf_client import send_hftgi_request_v01_wrapped
 from openai import OpenAI, AzureOpenAI
 from transformers import AutoTokenizer
 
+from .interface import Deadline
+
 try:
     from anthropic import RateLimitError
 except ImportError:
@@ -54,6 +59,150 @@ litellm.cache = Cache(disk_cache_dir=disk_cache_dir, type="disk")
 LM_LRU_CACHE_MAX_SIZE = 3000
 
 
+def _history_default(obj):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return "non-serializable contents"  # mark the non-serializable part
+
+
+class LMHistorySink:
+    """
+    Append-only JSONL file that receives full LM call records as they are produced.
+
+    Readers address records by byte offsets returned from `tell`, so consumers can read back the records written
+    between two points in time without keeping them in memory in between.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+
+    def write(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, default=_history_default).encode("utf-8") + b"\n"
+        with self._lock:
+            self._file.write(line)
+
+    def tell(self) -> int:
+        with self._lock:
+            self._file.flush()
+            return self._file.tell()
+
+    def read_bytes(self, start: int = 0, end: Optional[int] = None) -> bytes:
+        if end is None:
+            end = self.tell()
+        else:
+            with self._lock:
+                self._file.flush()
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return f.read(max(end - start, 0))
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        return [
+            json.loads(line)
+            for line in self.read_bytes(start, end).splitlines()
+            if line.strip()
+        ]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class LMHistorySinkSlice:
+    """Records written to an LMHistorySink between two offsets. Read lazily with `read`."""
+
+    def __init__(self, sink: LMHistorySink, start: int, end: int):
+        self.sink = sink
+        self.start = start
+        self.end = end
+
+    def read(self) -> List[Dict[str, Any]]:
+        return self.sink.read(self.start, self.end)
+
+
+class LMHistory:
+    """
+    Thread-safe replacement for the plain `history` list of LM wrappers.
+
+    Keeps every record by default, as the original history list did. If `max_entries` is set, at most that many
+    records are kept in a ring buffer; older records are dropped (and counted in `num_dropped`).
+    `retention` controls what is kept in memory:
+        - "none": nothing, only the number of calls is counted.
+        - "metadata": kwargs, usage, cost and timestamp of each call, without prompts and responses.
+        - "full": the complete record, as the original history list did.
+    If a `sink` is given, every complete record is also streamed to it as it is produced, regardless of `retention`.
+    """
+
+    RETENTION_OPTIONS = ("none", "metadata", "full")
+    METADATA_KEYS = ("kwargs", "usage", "cost")
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        retention: Literal["none", "metadata", "full"] = "full",
+        sink: Optional[LMHistorySink] = None,
+    ):
+        assert (
+            retention in self.RETENTION_OPTIONS
+        ), f"retention must be one of {self.RETENTION_OPTIONS}"
+        self.max_entries = max_entries
+        self.retention = retention
+        self.sink = sink
+        self.num_calls = 0
+        self.num_dropped = 0
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def append(self, entry: Dict[str, Any]):
+        if self.sink is not None:
+            self.sink.write(entry)
+        with self._lock:
+            self.num_calls += 1
+            if self.retention == "none":
+                return
+            if self.retention == "metadata":
+                entry = {k: entry[k] for k in self.METADATA_KEYS if k in entry}
+                entry["timestamp"] = time.time()
+            if (
+                self._entries.maxlen is not None
+                and len(self._entries) == self._entries.maxlen
+            ):
+                self.num_dropped += 1
+            self._entries.append(entry)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def collect_and_reset(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries)
+            self._entries.clear()
+            if self.num_dropped:
+                logging.warning(
+                    f"{self.num_dropped} LM history entries were dropped because the history is bounded to "
+                    f"{self.max_entries} entries."
+                )
+            self.num_dropped = 0
+        return entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __getitem__(self, index):
+        with self._lock:
+            return list(self._entries)[index]
+
+
 class LM:
     def __init__(
         self,
@@ -68,7 +217,7 @@ class LM:
         self.model_type = model_type
         self.cache = cache
         self.kwargs = dict(temperature=temperature, max_tokens=max_tokens, **kwargs)
-        self.history = []
+        self.history = LMHistory()
 
         if "o1-" in model:
             assert (
@@ -112,13 +261,21 @@ class LM:
         _inspect_history(self, n)
 
 
+def _bound_request_timeout(kwargs):
+    # Applied after the LRU cache lookup, so the timeout never becomes part of the cache key.
+    timeout = Deadline.current().timeout(kwargs.get("timeout"))
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    return kwargs
+
+
 @functools.lru_cache(maxsize=LM_LRU_CACHE_MAX_SIZE)
 def cached_litellm_completion(request):
     return litellm_completion(request, cache={"no-cache": False, "no-store": False})
 
 
 def litellm_completion(request, cache={"no-cache": True, "no-store": True}):
-    kwargs = ujson.loads(request)
+    kwargs = _bound_request_timeout(ujson.loads(request))
     return litellm.completion(cache=cache, **kwargs)
 
 
@@ -130,7 +287,7 @@ def cached_litellm_text_completion(request):
 
 
 def litellm_text_completion(request, cache={"no-cache": True, "no-store": True}):
-    kwargs = ujson.loads(request)
+    kwargs = _bound_request_timeout(ujson.loads(request))
 
     # Extract the provider and model from the model string.
     model = kwargs.pop("model").split("/", 1)
@@ -167,6 +324,9 @@ def _inspect_history(lm, n: int = 1):
     """Prints the last n prompts and their completions."""
 
     for item in lm.history[-n:]:
+        if "outputs" not in item:
+            # history retention does not keep prompts and responses
+            continue
         messages = item["messages"] or [{"role": "user", "content": item["prompt"]}]
         outputs = item["outputs"]
 
@@ -408,7 +568,7 @@ class DeepSeekModel(dspy.OpenAI):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
     )
@@ -503,7 +663,7 @@ class AzureOpenAIModel(dspy.LM):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
     )
@@ -637,7 +797,7 @@ class GroqModel(dspy.OpenAI):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
     )
@@ -738,7 +898,7 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
             **kwargs,
             "model": model,
         }
-        self.history: list[dict[str, Any]] = []
+        self.history = LMHistory()
         self.client = Anthropic(api_key=api_key)
         self.model = model
 
@@ -803,7 +963,7 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
     @backoff.on_exception(
         backoff.expo,
         (RateLimitError,),
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         max_tries=8,
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
@@ -880,7 +1040,7 @@ class VLLMClient(dspy.dsp.LM):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         on_backoff=backoff_hdlr,
     )
     def request(self, prompt: str, **kwargs):
@@ -1088,7 +1248,7 @@ class TogetherClient(dspy.HFModel):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         on_backoff=backoff_hdlr,
     )
     def _generate(self, prompt, **kwargs):
@@ -1201,7 +1361,7 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
             **kwargs,
         }
 
-        self.history: list[dict[str, Any]] = []
+        self.history = LMHistory()
 
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
@@ -1253,7 +1413,7 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
     @backoff.on_exception(
         backoff.expo,
         (Exception,),
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         max_tries=8,
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
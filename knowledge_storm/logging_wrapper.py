@@ -1,4 +1,8 @@
 from contextlib import contextmanager
+from contextvars import ContextVar
+import itertools
+import os
+import threading
 import time
 import pytz
 from datetime import datetime
@@ -6,43 +10,57 @@ from datetime import datetime
 # Define California timezone
 CALIFORNIA_TZ = pytz.timezone("America/Los_Angeles")
 
+# Anchor to convert monotonic timestamps to wall-clock time when the log is dumped.
+_WALL_CLOCK_ANCHOR_NS = time.time_ns() - time.monotonic_ns()
+
+# Stack of open spans in the current thread or task. Contexts are not shared between threads,
+# so concurrent events cannot interleave on the same stack.
+_span_stack: ContextVar[tuple] = ContextVar("logging_wrapper_span_stack", default=())
+_detached: ContextVar[bool] = ContextVar("logging_wrapper_detached", default=False)
+# Query counts and snippet pruning stats added while detached, collected so that they can be added later if the detached work is used.
+_detached_counts: ContextVar[dict] = ContextVar(
+    "logging_wrapper_detached_counts", default=None
+)
+_span_ids = itertools.count(1)
+
 
 class EventLog:
-    def __init__(self, event_name):
+    def __init__(self, event_name, parent_event=None):
         self.event_name = event_name
-        self.start_time = None
-        self.end_time = None
+        self.span_id = next(_span_ids)
+        self.parent_event = parent_event
+        self.thread_id = threading.get_ident()
+        self.start_time_ns = None  # monotonic
+        self.end_time_ns = None  # monotonic
         self.child_events = {}
 
     def record_start_time(self):
-        self.start_time = datetime.now(
-            pytz.utc
-        )  # Store in UTC for consistent timezone conversion
+        self.start_time_ns = time.monotonic_ns()
+        self.end_time_ns = None
 
     def record_end_time(self):
-        self.end_time = datetime.now(
-            pytz.utc
-        )  # Store in UTC for consistent timezone conversion
+        self.end_time_ns = time.monotonic_ns()
 
     def get_total_time(self):
-        if self.start_time and self.end_time:
-            return (self.end_time - self.start_time).total_seconds()
+        if self.start_time_ns is not None and self.end_time_ns is not None:
+            return (self.end_time_ns - self.start_time_ns) / 1e9
         return 0
 
+    @staticmethod
+    def _format_time(monotonic_ns):
+        # Format to milliseconds
+        return datetime.fromtimestamp(
+            (monotonic_ns + _WALL_CLOCK_ANCHOR_NS) / 1e9, CALIFORNIA_TZ
+        ).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
     def get_start_time(self):
-        if self.start_time:
-            # Format to milliseconds
-            return self.start_time.astimezone(CALIFORNIA_TZ).strftime(
-                "%Y-%m-%d %H:%M:%S.%f"
-            )[:-3]
+        if self.start_time_ns is not None:
+            return self._format_time(self.start_time_ns)
         return None
 
     def get_end_time(self):
-        if self.end_time:
-            # Format to milliseconds
-            return self.end_time.astimezone(CALIFORNIA_TZ).strftime(
-                "%Y-%m-%d %H:%M:%S.%f"
-            )[:-3]
+        if self.end_time_ns is not None:
+            return self._format_time(self.end_time_ns)
         return None
 
     def add_child_event(self, child_event):
@@ -51,14 +69,57 @@ class EventLog:
     def get_child_events(self):
         return self.child_events
 
+    def to_trace_event(self):
+        """Chrome trace event (complete event) that flame graph viewers such as Perfetto or speedscope can load."""
+        return {
+            "name": self.event_name,
+            "ph": "X",
+            "ts": self.start_time_ns / 1e3,
+            "dur": (self.end_time_ns - self.start_time_ns) / 1e3,
+            "pid": os.getpid(),
+            "tid": self.thread_id,
+            "args": {
+                "span_id": self.span_id,
+                "parent_span_id": (
+                    self.parent_event.span_id if self.parent_event else None
+                ),
+            },
+        }
+
 
 class LoggingWrapper:
     def __init__(self, lm_config):
         self.logging_dict = {}
         self.lm_config = lm_config
         self.current_pipeline_stage = None
-        self.event_stack = []
         self.pipeline_stage_active = False
+        self._lock = threading.Lock()
+
+    @property
+    def event_stack(self):
+        """Open events of this wrapper in the current thread or task, outermost first."""
+        return [event for wrapper, event in _span_stack.get() if wrapper is self]
+
+    def _is_detached(self):
+        return _detached.get()
+
+    @contextmanager
+    def detach(self):
+        """
+        Disables logging in the current thread within the context.
+        Used for work running outside of any pipeline stage, such as speculative or background computation.
+        Yields a dict whose "query_count" and "snippet_pruning" collect the query counts and snippet pruning stats
+        added within the context, so that they can be added with `add_query_count` and `add_snippet_pruning_stats`
+        once the work is used in a pipeline stage.
+        """
+        counts = {"query_count": 0, "snippet_pruning": {"kept": 0, "dropped": 0}}
+        token = _detached.set(True)
+        counts_token = _detached_counts.set(counts)
+        try:
+            yield counts
+        finally:
+            _detached_counts.reset(counts_token)
+            _detached.reset(token)
 
     def _pipeline_stage_start(self, pipeline_stage: str):
         if self.pipeline_stage_active:
@@ -69,9 +130,11 @@ class LoggingWrapper:
         self.current_pipeline_stage = pipeline_stage
         self.logging_dict[pipeline_stage] = {
             "time_usage": {},
+            "spans": [],
             "lm_usage": {},
             "lm_history": [],
             "query_count": 0,
+            "snippet_pruning": {"kept": 0, "dropped": 0},
         }
         self.pipeline_stage_active = True
 
@@ -79,66 +142,38 @@ class LoggingWrapper:
         if not self.pipeline_stage_active:
             raise RuntimeError("No pipeline stage is currently active.")
 
-        if not self.event_stack and self.current_pipeline_stage:
-            # Top-level event (directly under the pipeline stage)
-            if (
-                event_name
-                not in self.logging_dict[self.current_pipeline_stage]["time_usage"]
-            ):
-                event = EventLog(event_name=event_name)
-                event.record_start_time()
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ] = event
-                self.event_stack.append(event)
-            else:
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ].record_start_time()
-        elif self.event_stack:
-            # Nested event (under another event)
-            parent_event = self.event_stack[-1]
-            if event_name not in parent_event.get_child_events():
-                event = EventLog(event_name=event_name)
-                event.record_start_time()
+        event_stack = self.event_stack
+        parent_event = event_stack[-1] if event_stack else None
+        event = EventLog(event_name=event_name, parent_event=parent_event)
+        with self._lock:
+            stage_log = self.logging_dict[self.current_pipeline_stage]
+            if parent_event is not None:
                 parent_event.add_child_event(event)
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ] = event
-                self.event_stack.append(event)
-            else:
-                parent_event.get_child_events()[event_name].record_start_time()
-        else:
-            raise RuntimeError(
-                "Cannot start an event without an active pipeline stage or parent event."
-            )
+            # time_usage keeps the latest occurrence of each event name
+            stage_log["time_usage"][event_name] = event
+            stage_log["spans"].append(event)
+        event.record_start_time()
+        _span_stack.set(_span_stack.get() + ((self, event),))
+        return event
 
-    def _event_end(self, event_name: str):
+    def _event_end(self, event_name: str, event: EventLog = None):
         if not self.pipeline_stage_active:
             raise RuntimeError("No pipeline stage is currently active.")
 
-        if not self.event_stack:
-            raise RuntimeError("No parent event is currently active.")
-
-        if self.event_stack:
-            current_event_log = self.event_stack[-1]
-            if event_name in current_event_log.get_child_events():
-                current_event_log.get_child_events()[event_name].record_end_time()
-            elif (
-                event_name
-                in self.logging_dict[self.current_pipeline_stage]["time_usage"]
+        stack = _span_stack.get()
+        for index in range(len(stack) - 1, -1, -1):
+            wrapper, open_event = stack[index]
+            if wrapper is self and (
+                open_event is event
+                if event is not None
+                else open_event.event_name == event_name
             ):
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ].record_end_time()
-            else:
-                raise AssertionError(
-                    f"Failure to record end time for event {event_name}. Start time is not recorded."
-                )
-            if current_event_log.event_name == event_name:
-                self.event_stack.pop()
-        else:
-            raise RuntimeError("Cannot end an event without an active parent event.")
+                open_event.record_end_time()
+                _span_stack.set(stack[:index] + stack[index + 1 :])
+                return
+        raise AssertionError(
+            f"Failure to record end time for event {event_name}. Start time is not recorded."
+        )
 
     def _pipeline_stage_end(self):
         if not self.pipeline_stage_active:
@@ -147,27 +182,60 @@ class LoggingWrapper:
         self.logging_dict[self.current_pipeline_stage][
             "lm_usage"
         ] = self.lm_config.collect_and_reset_lm_usage()
-        self.logging_dict[self.current_pipeline_stage][
-            "lm_history"
-        ] = self.lm_config.collect_and_reset_lm_history()
+        # with an LM history sink, keep only offsets into the sink until the log is dumped
+        self.logging_dict[self.current_pipeline_stage]["lm_history"] = (
+            self.lm_config.collect_and_reset_lm_history(lazy=True)
+        )
         self.pipeline_stage_active = False
 
     def add_query_count(self, count):
+        if self._is_detached():
+            counts = _detached_counts.get()
+            if counts is not None:
+                with self._lock:
+                    counts["query_count"] += count
+            return
         if not self.pipeline_stage_active:
             raise RuntimeError(
                 "No pipeline stage is currently active to add query count."
             )
 
-        self.logging_dict[self.current_pipeline_stage]["query_count"] += count
+        with self._lock:
+            self.logging_dict[self.current_pipeline_stage]["query_count"] += count
+
+    def add_snippet_pruning_stats(self, stats):
+        """Adds the number of snippets kept and dropped by snippet pruning (see `Retriever`) to the current stage."""
+        if self._is_detached():
+            counts = _detached_counts.get()
+            if counts is not None:
+                with self._lock:
+                    for key in ("kept", "dropped"):
+                        counts["snippet_pruning"][key] += stats[key]
+            return
+        if not self.pipeline_stage_active:
+            raise RuntimeError(
+                "No pipeline stage is currently active to add snippet pruning stats."
+            )
+
+        with self._lock:
+            for key in ("kept", "dropped"):
+                self.logging_dict[self.current_pipeline_stage]["snippet_pruning"][
+                    key
+                ] += stats[key]
 
     @contextmanager
     def log_event(self, event_name):
+        if self._is_detached():
+            yield
+            return
         if not self.pipeline_stage_active:
             raise RuntimeError("No pipeline stage is currently active.")
 
-        self._event_start(event_name)
-        yield
-        self._event_end(event_name)
+        event = self._event_start(event_name)
+        try:
+            yield
+        finally:
+            self._event_end(event_name, event=event)
 
     @contextmanager
     def log_pipeline_stage(self, pipeline_stage):
@@ -190,6 +258,11 @@ class LoggingWrapper:
             self._pipeline_stage_end()
 
     def dump_logging_and_reset(self, reset_logging=True):
+        """
+        Returns the log of each pipeline stage. Besides the per-event time usage, `trace_events` holds every finished
+        span in the Chrome trace event format, with thread ids and parent span ids, which can be loaded into flame
+        graph viewers (e.g., wrap as {"traceEvents": trace_events} for Perfetto).
+        """
         log_dump = {}
         for pipeline_stage, pipeline_log in self.logging_dict.items():
             time_stamp_log = {
@@ -202,9 +275,19 @@ class LoggingWrapper:
             }
             log_dump[pipeline_stage] = {
                 "time_usage": time_stamp_log,
+                "trace_events": [
+                    event.to_trace_event()
+                    for event in pipeline_log["spans"]
+                    if event.end_time_ns is not None
+                ],
                 "lm_usage": pipeline_log["lm_usage"],
-                "lm_history": pipeline_log["lm_history"],
+                "lm_history": (
+                    pipeline_log["lm_history"].read()
+                    if hasattr(pipeline_log["lm_history"], "read")
+                    else pipeline_log["lm_history"]
+                ),
                 "query_count": pipeline_log["query_count"],
+                "snippet_pruning": dict(pipeline_log["snippet_pruning"]),
                 "total_wall_time": pipeline_log["total_wall_time"],
             }
         if reset_logging:
@@ -0,0 +1,164 @@
+import copy
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticQueryCache:
+    """
+    Cache of search results keyed by query meaning rather than query text, used by `Retriever` in interface.py.
+
+    Every query is embedded and compared with the earlier queries of the same topic. If the most similar earlier
+    query reaches `similarity_threshold`, its results are served instead of calling the search backend, so
+    paraphrases such as "history of X" and "X history timeline" cost a single search.
+
+    Queries are scoped per topic, which keeps each index to at most a few thousand vectors; an index is an
+    append-only matrix of normalized embeddings searched with one matrix-vector product, which at this size is
+    faster than maintaining an approximate index.
+
+    The cache key is the query alone; callers that search with different `exclude_urls` share entries and filter the
+    cached results themselves.
+    """
+
+    def __init__(
+        self,
+        encoder=None,
+        similarity_threshold: float = 0.9,
+        ttl: Optional[float] = 24 * 3600,
+        max_entries_per_topic: int = 10000,
+    ):
+        """
+        Args:
+            encoder: Object with an `encode(List[str])` method returning one embedding per text, e.g.,
+                `knowledge_storm.encoder.Encoder` or a SentenceTransformer. Defaults to the SentenceTransformer
+                "paraphrase-MiniLM-L6-v2", loaded on first use.
+            similarity_threshold (float): Minimum cosine similarity for an earlier query to be reused.
+            ttl (Optional[float]): Seconds after which cached results are no longer served. None disables expiry.
+            max_entries_per_topic (int): The oldest entries of a topic are evicted beyond this size.
+        """
+        self._encoder = encoder
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries_per_topic = max_entries_per_topic
+        self._lock = threading.Lock()
+        # topic -> {"vectors": (capacity, dim) array, "created_at": (capacity,) array, "size": int,
+        #           "entries": [{"query", "results", "created_at"}]}
+        self._topics: Dict[str, Dict] = {}
+        # "expired" counts lookups where an expired entry would have matched
+        self.stats = {"hits": 0, "misses": 0, "expired": 0}
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._encoder = SentenceTransformer("paraphrase-MiniLM-L6-v2")
+        return self._encoder
+
+    def embed(self, queries: List[str]) -> np.ndarray:
+        """Returns the normalized embeddings of the queries, one row per query."""
+        vectors = np.asarray(self.encoder.encode(queries), dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _is_expired(self, entry, now):
+        return self.ttl is not None and now - entry["created_at"] > self.ttl
+
+    def lookup(
+        self, vector: np.ndarray, topic: Optional[str] = None
+    ) -> Optional[List[Dict]]:
+        """
+        Returns a copy of the results cached for the most similar earlier query of `topic`, or None on a miss.
+
+        Args:
+            vector (np.ndarray): Normalized embedding of the query, see `embed`.
+            topic (Optional[str]): Scope of the lookup. Queries of different topics never match.
+        """
+        now = time.time()
+        with self._lock:
+            index = self._topics.get(topic or "")
+            entry = None
+            if index is not None and index["size"] > 0:
+                sims = index["vectors"][: index["size"]] @ vector
+                if self.ttl is not None:
+                    # expired entries never match, so a fresh entry above the threshold is still found
+                    expired = now - index["created_at"][: index["size"]] > self.ttl
+                    if np.any(sims[expired] >= self.similarity_threshold):
+                        self.stats["expired"] += 1
+                    sims = np.where(expired, -np.inf, sims)
+                best = int(np.argmax(sims))
+                if sims[best] >= self.similarity_threshold:
+                    entry = index["entries"][best]
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return copy.deepcopy(entry["results"])
+
+    def insert(
+        self,
+        query: str,
+        vector: np.ndarray,
+        results: List[Dict],
+        topic: Optional[str] = None,
+    ):
+        """Caches the results (a list of dicts returned by a retrieval module) of a query."""
+        now = time.time()
+        with self._lock:
+            index = self._topics.setdefault(
+                topic or "",
+                {
+                    "vectors": np.empty((16, len(vector)), dtype=np.float32),
+                    "created_at": np.empty(16, dtype=np.float64),
+                    "size": 0,
+                    "entries": [],
+                },
+            )
+            if index["size"] >= self.max_entries_per_topic or index["size"] == len(
+                index["vectors"]
+            ):
+                # drop expired entries and, beyond the size limit, the oldest ones
+                keep = [
+                    i
+                    for i, entry in enumerate(index["entries"])
+                    if not self._is_expired(entry, now)
+                ]
+                keep = keep[max(0, len(keep) - self.max_entries_per_topic + 1) :]
+                if len(keep) < index["size"]:
+                    kept_vectors = index["vectors"][keep]
+                    index["vectors"][: len(keep)] = kept_vectors
+                    index["created_at"][: len(keep)] = index["created_at"][keep]
+                    index["entries"] = [index["entries"][i] for i in keep]
+                    index["size"] = len(keep)
+            if index["size"] == len(index["vectors"]):
+                grown = np.empty(
+                    (2 * len(index["vectors"]), index["vectors"].shape[1]),
+                    dtype=np.float32,
+                )
+                grown[: index["size"]] = index["vectors"][: index["size"]]
+                index["vectors"] = grown
+                grown_created_at = np.empty(len(grown), dtype=np.float64)
+                grown_created_at[: index["size"]] = index["created_at"][: index["size"]]
+                index["created_at"] = grown_created_at
+            index["vectors"][index["size"]] = vector
+            index["created_at"][index["size"]] = now
+            index["entries"].append(
+                {"query": query, "results": copy.deepcopy(results), "created_at": now}
+            )
+            index["size"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns the number of hits (each saves a search call), misses, expired matches and cached queries."""
+        with self._lock:
+            return {
+                **self.stats,
+                "cached_queries": sum(index["size"] for index in self._topics.values()),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._topics.clear()
@@ -1,12 +1,17 @@
+import concurrent.futures
 import logging
 import os
-from typing import Callable, Union, List
+import threading
+import time
+from types import MappingProxyType
+from typing import Callable, Dict, Optional, Union, List
 
 import backoff
 import dspy
 import requests
 from dsp import backoff_hdlr, giveup_hdlr
 
+from .interface import Deadline
 from .utils import WebPageHelper
 
 
@@ -177,7 +182,7 @@ class BingSearch(dspy.Retrieve):
 
 
 class VectorRM(dspy.Retrieve):
-    """Retrieve information from custom documents using Qdrant.
+    """Retrieve information from custom documents using Qdrant or a `LocalVectorIndex`.
 
     To be compatible with STORM, the custom documents should have the following fields:
         - content: The main text content of the document.
@@ -224,6 +229,7 @@ class VectorRM(dspy.Retrieve):
         self.collection_name = collection_name
         self.client = None
         self.qdrant = None
+        self.local_index = None
 
     def _check_collection(self):
         from langchain_qdrant import Qdrant
@@ -288,6 +294,25 @@ class VectorRM(dspy.Retrieve):
         except Exception as e:
             raise ValueError(f"Error occurs when loading the vector store: {e}")
 
+    def init_local_vector_index(self, index_dir: str, nprobe: int = 8):
+        """
+        Open a local vector index created by `LocalVectorIndex.create_from_csv` or `LocalVectorIndex.build`.
+        The index is memory-mapped read-only, so several processes can open the same index at once.
+
+        Args:
+            index_dir (str): Directory of the index.
+            nprobe (int): Number of IVF lists to scan per query.
+        """
+        from .vector_index import LocalVectorIndex
+
+        if index_dir is None:
+            raise ValueError("Please provide a folder path.")
+
+        try:
+            self.local_index = LocalVectorIndex(index_dir, nprobe=nprobe)
+        except Exception as e:
+            raise ValueError(f"Error occurs when loading the vector index: {e}")
+
     def get_usage_and_reset(self):
         usage = self.usage
         self.usage = 0
@@ -301,15 +326,169 @@ class VectorRM(dspy.Retrieve):
         Returns:
             int: Number of vectors in the collection.
         """
+        if self.local_index is not None:
+            return len(self.local_index)
         return self.qdrant.client.count(collection_name=self.collection_name)
 
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embeds all queries in one call of the embedding model. Like `embed_query`, it uses the query encode kwargs
+        of the model and, if the model defines a "query" prompt (instruction), prepends it to every query.
+        """
+        client = getattr(self.model, "_client", None) or getattr(
+            self.model, "client", None
+        )
+        if client is None:
+            return [self.model.embed_query(query) for query in queries]
+        encode_kwargs = dict(
+            getattr(self.model, "query_encode_kwargs", None) or self.model.encode_kwargs
+        )
+        if (
+            "prompt" not in encode_kwargs
+            and "prompt_name" not in encode_kwargs
+            and "query" in (getattr(client, "prompts", None) or {})
+        ):
+            encode_kwargs["prompt_name"] = "query"
+        embeddings = client.encode(
+            [query.replace("\n", " ") for query in queries], **encode_kwargs
+        )
+        return embeddings.tolist()
+
+    def _forward_local_index(self, queries: List[str], exclude_urls: List[str]):
+        batch_hits = self.local_index.search(
+            self._embed_queries(queries), k=self.k, exclude_urls=exclude_urls
+        )
+        records = self.local_index.get_records(
+            [vector_id for hits in batch_hits for vector_id, _ in hits]
+        )
+        return [
+            [
+                {
+                    "description": records[vector_id]["description"],
+                    "snippets": [records[vector_id]["content"]],
+                    "title": records[vector_id]["title"],
+                    "url": records[vector_id]["url"],
+                }
+                for vector_id, _ in hits
+            ]
+            for hits in batch_hits
+        ]
+
+    def forward_batch(
+        self, queries: List[str], exclude_urls: List[str]
+    ) -> List[List[Dict]]:
+        """
+        Search in your data for self.k top passages for each query.
+
+        All queries are embedded in one batch and searched with a single batched request. Payloads are fetched
+        afterwards, once per distinct point.
+
+        Args:
+            queries (List[str]): The queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results. Applied as a filter in Qdrant.
+
+        Returns:
+            one list of results per query, each result is a Dict with keys of 'description', 'snippets'
+            (list of strings), 'title', 'url'
+        """
+        self.usage += len(queries)
+        if len(queries) == 0:
+            return []
+
+        if self.local_index is not None:
+            return self._forward_local_index(queries, exclude_urls)
+
+        from qdrant_client import models
+
+        metadata_key = self.qdrant.metadata_payload_key
+        content_key = self.qdrant.content_payload_key
+        vector_name = self.qdrant.vector_name
+        search_filter = None
+        if exclude_urls:
+            search_filter = models.Filter(
+                must_not=[
+                    models.FieldCondition(
+                        key=f"{metadata_key}.url",
+                        match=models.MatchAny(any=list(exclude_urls)),
+                    )
+                ]
+            )
+
+        query_vectors = self._embed_queries(queries)
+        if hasattr(self.client, "query_batch_points"):
+            responses = self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[
+                    models.QueryRequest(
+                        query=vector,
+                        using=vector_name,
+                        filter=search_filter,
+                        limit=self.k,
+                        with_payload=False,
+                    )
+                    for vector in query_vectors
+                ],
+            )
+            batch_points = [response.points for response in responses]
+        else:
+            batch_points = self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=[
+                    models.SearchRequest(
+                        vector=(
+                            models.NamedVector(name=vector_name, vector=vector)
+                            if vector_name
+                            else vector
+                        ),
+                        filter=search_filter,
+                        limit=self.k,
+                        with_payload=False,
+                    )
+                    for vector in query_vectors
+                ],
+            )
+
+        point_ids = list(
+            dict.fromkeys(point.id for points in batch_points for point in points)
+        )
+        id_to_payload = {}
+        if point_ids:
+            id_to_payload = {
+                record.id: record.payload
+                for record in self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=point_ids,
+                    with_payload=True,
+                    with_vectors=False,
+                )
+            }
+
+        batch_results = []
+        for points in batch_points:
+            results = []
+            for point in points:
+                payload = id_to_payload.get(point.id)
+                if payload is None:
+                    continue
+                metadata = payload.get(metadata_key) or {}
+                results.append(
+                    {
+                        "description": metadata["description"],
+                        "snippets": [payload[content_key]],
+                        "title": metadata["title"],
+                        "url": metadata["url"],
+                    }
+                )
+            batch_results.append(results)
+        return batch_results
+
     def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str]):
         """
-        Search in your data for self.k top passages for query or queries.
+        Search in your data for self.k top passages for query or queries, see `forward_batch`.
 
         Args:
             query_or_queries (Union[str, List[str]]): The query or queries to search for.
-            exclude_urls (List[str]): Dummy parameter to match the interface. Does not have any effect.
+            exclude_urls (List[str]): A list of urls to exclude from the search results. Applied as a filter in Qdrant.
 
         Returns:
             a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
@@ -319,22 +498,11 @@ class VectorRM(dspy.Retrieve):
             if isinstance(query_or_queries, str)
             else query_or_queries
         )
-        self.usage += len(queries)
-        collected_results = []
-        for query in queries:
-            related_docs = self.qdrant.similarity_search_with_score(query, k=self.k)
-            for i in range(len(related_docs)):
-                doc = related_docs[i][0]
-                collected_results.append(
-                    {
-                        "description": doc.metadata["description"],
-                        "snippets": [doc.page_content],
-                        "title": doc.metadata["title"],
-                        "url": doc.metadata["url"],
-                    }
-                )
-
-        return collected_results
+        return [
+            result
+            for results in self.forward_batch(queries, exclude_urls)
+            for result in results
+        ]
 
 
 class StanfordOvalArxivRM(dspy.Retrieve):
@@ -406,6 +574,9 @@ class StanfordOvalArxivRM(dspy.Retrieve):
 class SerperRM(dspy.Retrieve):
     """Retrieve information from custom queries using Serper.dev."""
 
+    # Serper accepts a list of at most 100 parameter dicts per request.
+    MAX_QUERIES_PER_REQUEST = 100
+
     def __init__(
         self,
         serper_search_api_key=None,
@@ -415,10 +586,12 @@ class SerperRM(dspy.Retrieve):
         min_char_count: int = 150,
         snippet_chunk_size: int = 1000,
         webpage_helper_max_threads=10,
+        batch_window: float = 0.0,
+        is_valid_source: Callable = None,
     ):
         """Args:
         serper_search_api_key str: API key to run serper, can be found by creating an account on https://serper.dev/
-        query_params (dict or list of dict): parameters in dictionary or list of dictionaries that has a max size of 100 that will be used to query.
+        query_params (dict): parameters in dictionary that will be used for every query. It is copied, not modified.
             Commonly used fields are as follows (see more information in https://serper.dev/playground):
                 q str: query that will be used with google search
                 type str: type that will be used for browsing google. Types are search, images, video, maps, places, etc.
@@ -433,10 +606,13 @@ class SerperRM(dspy.Retrieve):
                 qdr:w str: Date time range for past week.
                 qdr:m str: Date time range for past month.
                 qdr:y str: Date time range for past year.
+        batch_window float: If positive, seconds to wait for queries of concurrent calls (e.g., from the threads of
+            `Retriever`) so that they are sent in one request. 0 sends the queries of each call right away.
+        is_valid_source Callable: A function that takes a URL and returns a boolean indicating if the result
+            should be kept, e.g., a `SourceFilter`.
         """
         super().__init__(k=k)
         self.usage = 0
-        self.query_params = None
         self.ENABLE_EXTRA_SNIPPET_EXTRACTION = ENABLE_EXTRA_SNIPPET_EXTRACTION
         self.webpage_helper = WebPageHelper(
             min_char_count=min_char_count,
@@ -444,11 +620,22 @@ class SerperRM(dspy.Retrieve):
             max_thread_num=webpage_helper_max_threads,
         )
 
+        # read-only: every request builds its own parameter dicts from it, so concurrent calls never share state
         if query_params is None:
-            self.query_params = {"num": k, "autocorrect": True, "page": 1}
+            self.query_params = MappingProxyType(
+                {"num": k, "autocorrect": True, "page": 1}
+            )
         else:
-            self.query_params = query_params
-            self.query_params.update({"num": k})
+            self.query_params = MappingProxyType({**query_params, "num": k})
+        self.batch_window = batch_window
+        # If not None, is_valid_source shall be a function that takes a URL and returns a boolean.
+        if is_valid_source:
+            self.is_valid_source = is_valid_source
+        else:
+            self.is_valid_source = lambda x: True
+        self._batch_lock = threading.Lock()
+        self._pending_queries = []
+        self._batch_scheduled = False
         self.serper_search_api_key = serper_search_api_key
         if not self.serper_search_api_key and not os.environ.get("SERPER_API_KEY"):
             raise RuntimeError(
@@ -462,17 +649,20 @@ class SerperRM(dspy.Retrieve):
             self.serper_search_api_key = os.environ["SERPER_API_KEY"]
 
         self.base_url = "https://google.serper.dev"
-
-    def serper_runner(self, query_params):
         self.search_url = f"{self.base_url}/search"
 
+    def serper_runner(self, query_params):
         headers = {
             "X-API-KEY": self.serper_search_api_key,
             "Content-Type": "application/json",
         }
 
         response = requests.request(
-            "POST", self.search_url, headers=headers, json=query_params
+            "POST",
+            self.search_url,
+            headers=headers,
+            json=query_params,
+            timeout=Deadline.current().timeout(),
         )
 
         if response == None:
@@ -487,67 +677,131 @@ class SerperRM(dspy.Retrieve):
         self.usage = 0
         return {"SerperRM": usage}
 
-    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str]):
+    def _search(self, queries: List[str]) -> List[Dict]:
         """
-        Calls the API and searches for the query passed in.
-
+        Searches the queries with one multi-query request per MAX_QUERIES_PER_REQUEST queries.
 
-        Args:
-            query_or_queries (Union[str, List[str]]): The query or queries to search for.
-            exclude_urls (List[str]): Dummy parameter to match the interface. Does not have any effect.
+        A failed request (e.g., Serper answers with a single error object instead of one result per query) is logged
+        and yields empty results for the queries of that request.
+        """
+        results = []
+        for i in range(0, len(queries), self.MAX_QUERIES_PER_REQUEST):
+            # All available parameters can be found in the playground: https://serper.dev/playground
+            # The type can be search, images, video, places, maps etc that Google provides.
+            query_params = [
+                {**self.query_params, "q": query, "type": "search"}
+                for query in queries[i : i + self.MAX_QUERIES_PER_REQUEST]
+            ]
+            try:
+                response = self.serper_runner(query_params)
+            except Exception as e:
+                logging.error(f"Error occurs when searching with Serper: {e}")
+                response = None
+            if not isinstance(response, list) or len(response) != len(query_params):
+                if response is not None:
+                    logging.error(
+                        f"Serper returned {response} for {len(query_params)} queries."
+                    )
+                response = [{}] * len(query_params)
+            results.extend(response)
+        return results
 
-        Returns:
-            a list of dictionaries, each dictionary has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+    def _search_in_batch_window(self, queries: List[str]) -> List[Dict]:
         """
-        queries = (
-            [query_or_queries]
-            if isinstance(query_or_queries, str)
-            else query_or_queries
-        )
+        Adds the queries to the pending batch. The first caller of a batch waits `batch_window` seconds for other
+        callers, then sends every pending query in one request and hands each caller its results.
+        """
+        futures = []
+        with self._batch_lock:
+            for query in queries:
+                future = concurrent.futures.Future()
+                self._pending_queries.append((query, future))
+                futures.append(future)
+            is_leader = not self._batch_scheduled
+            self._batch_scheduled = True
+
+        if is_leader:
+            time.sleep(self.batch_window)
+            with self._batch_lock:
+                pending_queries = self._pending_queries
+                self._pending_queries = []
+                self._batch_scheduled = False
+            try:
+                results = self._search([query for query, _ in pending_queries])
+                for (_, future), result in zip(pending_queries, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in pending_queries:
+                    future.set_exception(e)
 
-        self.usage += len(queries)
-        self.results = []
-        collected_results = []
-        for query in queries:
-            if query == "Queries:":
-                continue
-            query_params = self.query_params
+        return [future.result() for future in futures]
 
-            # All available parameters can be found in the playground: https://serper.dev/playground
-            # Sets the json value for query to be the query that is being parsed.
-            query_params["q"] = query
+    def forward_batch(
+        self, queries: List[str], exclude_urls: List[str]
+    ) -> List[List[Dict]]:
+        """
+        Calls the API and searches for the queries passed in.
 
-            # Sets the type to be search, can be images, video, places, maps etc that Google provides.
-            query_params["type"] = "search"
+        All queries are sent in a single multi-query request. If `batch_window` is set, queries from concurrent
+        calls arriving within the window share that request.
 
-            self.result = self.serper_runner(query_params)
-            self.results.append(self.result)
+        Args:
+            queries (List[str]): The queries to search for.
+            exclude_urls (List[str]): Dummy parameter to match the interface. Does not have any effect.
 
-        # Array of dictionaries that will be used by Storm to create the jsons
-        collected_results = []
+        Returns:
+            one list of results per query, each result is a dictionary with keys of 'description', 'snippets'
+            (list of strings), 'title', 'url'
+        """
+        self.usage += len(queries)
+        batch_results = [[] for _ in queries]
+        query_indices = [i for i, query in enumerate(queries) if query != "Queries:"]
+        if len(query_indices) == 0:
+            return batch_results
+        searched_queries = [queries[i] for i in query_indices]
+        if self.batch_window > 0:
+            results = self._search_in_batch_window(searched_queries)
+        else:
+            results = self._search(searched_queries)
 
-        if self.ENABLE_EXTRA_SNIPPET_EXTRACTION:
+        # downloading the pages is the slowest part of a search, so it is the first thing dropped under a deadline
+        extract_extra_snippets = (
+            self.ENABLE_EXTRA_SNIPPET_EXTRACTION
+            and not Deadline.current().running_low()
+        )
+        if extract_extra_snippets:
+            # fetch the pages of all queries together so that they share one pool of download threads
             urls = []
-            for result in self.results:
+            for result in results:
                 organic_results = result.get("organic", [])
                 for organic in organic_results:
                     url = organic.get("link")
-                    if url:
+                    if url and self.is_valid_source(url):
                         urls.append(url)
-            valid_url_to_snippets = self.webpage_helper.urls_to_snippets(urls)
+            valid_url_to_snippets = self.webpage_helper.urls_to_snippets(
+                list(dict.fromkeys(urls))
+            )
         else:
             valid_url_to_snippets = {}
 
-        for result in self.results:
+        for query_index, result in zip(query_indices, results):
+            # Array of dictionaries that will be used by Storm to create the jsons
+            collected_results = batch_results[query_index]
             try:
                 # An array of dictionaries that contains the snippets, title of the document and url that will be used.
-                organic_results = result.get("organic")
+                organic_results = [
+                    organic
+                    for organic in result.get("organic", [])
+                    if self.is_valid_source(organic.get("link") or "")
+                ]
                 knowledge_graph = result.get("knowledgeGraph")
                 for organic in organic_results:
                     snippets = [organic.get("snippet")]
-                    if self.ENABLE_EXTRA_SNIPPET_EXTRACTION:
+                    if extract_extra_snippets:
                         snippets.extend(
-                            valid_url_to_snippets.get(url, {}).get("snippets", [])
+                            valid_url_to_snippets.get(organic.get("link"), {}).get(
+                                "snippets", []
+                            )
                         )
                     collected_results.append(
                         {
@@ -564,7 +818,29 @@ class SerperRM(dspy.Retrieve):
             except:
                 continue
 
-        return collected_results
+        return batch_results
+
+    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str]):
+        """
+        Calls the API and searches for the query passed in, see `forward_batch`.
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): Dummy parameter to match the interface. Does not have any effect.
+
+        Returns:
+            a list of dictionaries, each dictionary has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        return [
+            result
+            for results in self.forward_batch(queries, exclude_urls)
+            for result in results
+        ]
 
 
 class BraveRM(dspy.Retrieve):
@@ -788,7 +1064,7 @@ class DuckDuckGoSearchRM(dspy.Retrieve):
     @backoff.on_exception(
         backoff.expo,
         (Exception,),
-        max_time=1000,
+        max_time=lambda: Deadline.current().timeout(1000),
         max_tries=8,
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
@@ -1236,3 +1512,285 @@ class AzureAISearch(dspy.Retrieve):
                 logging.error(f"Error occurs when searching query {query}: {e}")
 
         return collected_results
+
+
+class CompositeRM(dspy.Retrieve):
+    """
+    Queries several retrieval modules concurrently and merges their results.
+
+    Backends with `forward_batch` search all queries in one call, the others are called once per query. The results
+    of each query are deduplicated by normalized URL (snippets of duplicates are merged) and ranked by weighted
+    reciprocal rank fusion, where the weight of a backend decreases with its observed latency and error rate; the
+    top k of each query are returned.
+
+    A search returns once every query has enough distinct results from a quorum of backends, or from any backends
+    after the hedge delay, and at the latest when the deadline has passed. Searches that have not started by then are
+    cancelled; backends that are still running finish in the background and only update their statistics.
+    """
+
+    TRACKING_QUERY_PARAMS = ("utm_", "gclid", "fbclid")
+
+    def __init__(
+        self,
+        rms: List[dspy.Retrieve],
+        k: int = 3,
+        deadline: float = 10.0,
+        min_results: int = None,
+        quorum: int = None,
+        hedge_delay: Optional[float] = 1.0,
+        max_thread_num: int = None,
+        stats_smoothing: float = 0.2,
+    ):
+        """
+        Params:
+            rms: Retrieval modules to query, e.g., [YouRM(...), BingSearch(...)].
+            k: Number of results to return per query.
+            deadline: Seconds to wait for backends before returning with the results received so far.
+            min_results: Number of distinct results each query needs before returning early. Defaults to k.
+            quorum: Number of backends that must have answered a query before returning early.
+                Defaults to a majority of the backends.
+            hedge_delay: Seconds after which returning early no longer waits for the quorum, so one slow backend does
+                not hold up a search that already has enough results. None always waits for the quorum.
+            max_thread_num: Size of the thread pool shared by all searches. Defaults to 4 * len(rms).
+            stats_smoothing: Weight of the latest observation in the moving averages of latency and error rate.
+        """
+        super().__init__(k=k)
+        if not rms:
+            raise ValueError("Please provide at least one retrieval module.")
+        self.rms = rms
+        self.deadline = deadline
+        self.min_results = min_results if min_results is not None else k
+        self.quorum = min(quorum if quorum is not None else len(rms) // 2 + 1, len(rms))
+        self.hedge_delay = hedge_delay
+        self.stats_smoothing = stats_smoothing
+        self.backend_names = []
+        for rm in rms:
+            name = type(rm).__name__
+            if name in self.backend_names:
+                name = f"{name}_{len(self.backend_names)}"
+            self.backend_names.append(name)
+        self.backend_stats = {
+            name: {"latency": None, "error_rate": 0.0, "calls": 0}
+            for name in self.backend_names
+        }
+        self._stats_lock = threading.Lock()
+        # not used as a context manager: a search must be able to return while slow backends are still running
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_thread_num or 4 * len(rms)
+        )
+
+    def get_usage_and_reset(self):
+        usage = {}
+        for rm in self.rms:
+            if hasattr(rm, "get_usage_and_reset"):
+                for model_name, query_cnt in rm.get_usage_and_reset().items():
+                    usage[model_name] = usage.get(model_name, 0) + query_cnt
+        return usage
+
+    def get_backend_stats(self) -> Dict[str, Dict]:
+        """Returns backend name -> {"latency" (seconds), "error_rate", "calls", "weight"}."""
+        with self._stats_lock:
+            return {
+                name: {**stats, "weight": self._weight(name)}
+                for name, stats in self.backend_stats.items()
+            }
+
+    def _weight(self, name: str) -> float:
+        stats = self.backend_stats[name]
+        latency = stats["latency"] if stats["latency"] is not None else 0.0
+        return (1.0 - stats["error_rate"]) / (1.0 + latency)
+
+    def _record(self, name: str, latency: float, failed: bool):
+        alpha = self.stats_smoothing
+        with self._stats_lock:
+            stats = self.backend_stats[name]
+            stats["calls"] += 1
+            stats["latency"] = (
+                latency
+                if stats["latency"] is None
+                else (1 - alpha) * stats["latency"] + alpha * latency
+            )
+            stats["error_rate"] = (1 - alpha) * stats["error_rate"] + alpha * float(
+                failed
+            )
+
+    @classmethod
+    def normalize_url(cls, url: str) -> str:
+        """Lowercases scheme and host, drops "www.", the fragment, tracking parameters and trailing slashes."""
+        from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+        parts = urlsplit(url.strip())
+        netloc = parts.netloc.lower()
+        if netloc.startswith("www."):
+            netloc = netloc[len("www.") :]
+        query = urlencode(
+            [
+                (key, value)
+                for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                if not key.lower().startswith(cls.TRACKING_QUERY_PARAMS)
+            ]
+        )
+        path = parts.path.rstrip("/")
+        return urlunsplit((parts.scheme.lower(), netloc, path, query, ""))
+
+    def _search_backend(self, name, rm, queries, exclude_urls, deadline):
+        """Returns one list of results per query; backends with `forward_batch` search all queries in one call."""
+        start = time.monotonic()
+        try:
+            with deadline.activate():
+                if hasattr(rm, "forward_batch"):
+                    batch_results = rm.forward_batch(queries, exclude_urls=exclude_urls)
+                else:
+                    batch_results = [
+                        rm(query_or_queries=[query], exclude_urls=exclude_urls)
+                        for query in queries
+                    ]
+        except Exception as e:
+            self._record(name, time.monotonic() - start, failed=True)
+            logging.error(f"Error occurs when searching with {name}: {e}")
+            return [[] for _ in queries]
+        self._record(name, time.monotonic() - start, failed=False)
+        return batch_results
+
+    def forward_batch(
+        self, queries: List[str], exclude_urls: List[str] = []
+    ) -> List[List[Dict]]:
+        """Search with all retrieval modules concurrently for self.k top passages for each query.
+
+        Backends with `forward_batch` get all queries in one call; other backends get one call per query, so that the
+        results of each query can be fused separately.
+
+        Args:
+            queries (List[str]): The queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results.
+
+        Returns:
+            one list of results per query, each result is a Dict with keys of 'description', 'snippets'
+            (list of strings), 'title', 'url'. A url is only returned for the first query it is a top result of.
+        """
+        excluded = set(self.normalize_url(url) for url in exclude_urls)
+        # the run deadline of the caller, if any, also bounds the wait and the backends' own timeouts
+        deadline = Deadline.current()
+        timeout = deadline.timeout(self.deadline)
+
+        # future -> (backend name, indices of the queries it searches)
+        future_to_key = {}
+        for name, rm in zip(self.backend_names, self.rms):
+            if hasattr(rm, "forward_batch"):
+                query_groups = [list(range(len(queries)))]
+            else:
+                query_groups = [[i] for i in range(len(queries))]
+            for query_indices in query_groups:
+                future = self._executor.submit(
+                    self._search_backend,
+                    name,
+                    rm,
+                    [queries[i] for i in query_indices],
+                    exclude_urls,
+                    deadline,
+                )
+                future_to_key[future] = (name, query_indices)
+        # query index -> backend name -> results
+        answers = [{} for _ in queries]
+        distinct_urls = [set() for _ in queries]
+        pending = set(future_to_key)
+        start = time.monotonic()
+        while pending:
+            elapsed = time.monotonic() - start
+            if elapsed >= timeout:
+                logging.info(
+                    f"CompositeRM deadline of {timeout:.1f}s reached; not waiting for "
+                    f"{sorted(set(future_to_key[future][0] for future in pending))}."
+                )
+                break
+            wait_time = timeout - elapsed
+            if self.hedge_delay is not None and elapsed < self.hedge_delay:
+                # wake up at the hedge delay to check whether the quorum can be waived
+                wait_time = min(wait_time, self.hedge_delay - elapsed)
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=wait_time,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                name, query_indices = future_to_key[future]
+                for query_index, results in zip(query_indices, future.result()):
+                    answers[query_index][name] = results
+                    distinct_urls[query_index].update(
+                        self.normalize_url(result["url"]) for result in results
+                    )
+            hedged = (
+                self.hedge_delay is not None
+                and time.monotonic() - start >= self.hedge_delay
+            )
+            if all(
+                len(urls - excluded) >= self.min_results
+                and (hedged or len(query_answers) >= self.quorum)
+                for urls, query_answers in zip(distinct_urls, answers)
+            ):
+                break
+        # searches that have not started yet are no longer needed; running ones finish and only update the statistics
+        for future in pending:
+            future.cancel()
+
+        with self._stats_lock:
+            weights = {name: self._weight(name) for name in self.backend_names}
+        batch_results = []
+        returned_urls = set(excluded)
+        for query_answers in answers:
+            url_to_result, url_to_score = self._fuse(query_answers, weights)
+            ranked_urls = [
+                url
+                for url in sorted(url_to_result, key=lambda url: -url_to_score[url])
+                if url not in returned_urls
+            ][: self.k]
+            returned_urls.update(ranked_urls)
+            batch_results.append([url_to_result[url] for url in ranked_urls])
+        return batch_results
+
+    def forward(
+        self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
+    ):
+        """Search with all retrieval modules concurrently for self.k top passages for query or queries.
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results.
+
+        Returns:
+            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        return [
+            result
+            for results in self.forward_batch(queries, exclude_urls)
+            for result in results
+        ]
+
+    def _fuse(self, name_to_results: Dict[str, List[Dict]], weights: Dict[str, float]):
+        """Weighted reciprocal rank fusion of the results of one query. Returns url -> merged result and url -> score."""
+        url_to_result = {}
+        url_to_score = {}
+        for name, results in name_to_results.items():
+            for rank, result in enumerate(results):
+                url = self.normalize_url(result["url"])
+                url_to_score[url] = url_to_score.get(url, 0.0) + weights[name] / (
+                    rank + 1
+                )
+                if url not in url_to_result:
+                    url_to_result[url] = {
+                        **result,
+                        "snippets": list(result.get("snippets", [])),
+                    }
+                else:
+                    snippets = url_to_result[url]["snippets"]
+                    snippets.extend(
+                        snippet
+                        for snippet in result.get("snippets", [])
+                        if snippet not in snippets
+                    )
+        return url_to_result, url_to_score
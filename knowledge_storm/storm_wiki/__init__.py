@@ -1,2 +1,48 @@
-from .engine import *
-from .modules import *
+from ..lazy_loader import attach_lazy_loader
+
+_LAZY_SUBMODULE_ATTRS = {
+    ".artifact_store": [
+        "ArtifactStore",
+        "InMemoryArtifactStore",
+        "LocalFileSystemArtifactStore",
+        "SQLiteArtifactStore",
+        "LocalObjectStoreArtifactStore",
+    ],
+    ".engine": [
+        "STORMWikiLMConfigs",
+        "STORMWikiRunnerArguments",
+        "STORMWikiRunner",
+    ],
+    ".modules.knowledge_curation": [
+        "script_dir",
+        "ConvSimulator",
+        "WikiWriter",
+        "AskQuestion",
+        "AskQuestionWithPersona",
+        "QuestionToQuery",
+        "AnswerQuestion",
+        "TopicExpert",
+        "StormKnowledgeCurationModule",
+    ],
+    ".modules.persona_generator": [
+        "get_wiki_page_title_and_toc",
+        "FindRelatedTopic",
+        "GenPersona",
+        "CreateWriterWithPersona",
+        "StormPersonaGenerator",
+    ],
+    ".modules.retriever": [
+        "GENERALLY_UNRELIABLE",
+        "DEPRECATED",
+        "BLACKLISTED",
+        "WIKIPEDIA_SOURCE_FILTER",
+        "is_valid_wikipedia_source",
+    ],
+    ".modules.storm_dataclass": [
+        "DialogueTurn",
+        "StormInformationTable",
+        "StormArticle",
+    ],
+}
+
+__getattr__, __dir__, __all__ = attach_lazy_loader(__name__, _LAZY_SUBMODULE_ATTRS)
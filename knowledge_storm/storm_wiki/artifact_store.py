@@ -0,0 +1,420 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import traceback
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import quote
+
+from ..utils import FileIOHelper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _dumps_json(obj) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                obj,
+                default=FileIOHelper.handle_non_serializable,
+                option=orjson.OPT_NON_STR_KEYS,
+            )
+        except TypeError:
+            # e.g., integers beyond 64 bits; fall back to the standard encoder
+            pass
+    return json.dumps(obj, default=FileIOHelper.handle_non_serializable).encode("utf-8")
+
+
+def _loads_json(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class ArtifactStore(ABC):
+    """
+    Storage for the artifacts produced by a pipeline run (conversation logs, outlines, articles, references, run
+    configuration, LM call history, etc.).
+
+    Artifacts are addressed by a namespace (e.g., the article directory name) and a name (e.g., "url_to_info.json").
+    Subclasses only implement how raw bytes are written, read and checked for existence under a key.
+
+    Writes are serialized on the calling thread and, if `async_write` is True, handed to a single writer thread so
+    that compression and I/O do not block the pipeline. Reads see pending writes. Call `flush` to wait until every
+    pending write reaches the backend.
+    """
+
+    COMPRESSION_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(
+        self,
+        async_write: bool = True,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+    ):
+        """
+        Args:
+            async_write (bool): If True, write artifacts on a background writer thread.
+            compression (Optional[str]): None, "gzip" or "zstd". Compressed artifacts get a ".gz" or ".zst" suffix.
+                "zstd" requires `pip install zstandard`.
+            compression_level (Optional[int]): Compression level passed to the compressor.
+        """
+        if compression not in self.COMPRESSION_SUFFIX:
+            raise ValueError(
+                f"Unsupported compression {compression}. Choose from {list(self.COMPRESSION_SUFFIX)}."
+            )
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError as err:
+                raise ImportError(
+                    "zstd compression requires `pip install zstandard`."
+                ) from err
+        self.async_write = async_write
+        self.compression = compression
+        self.compression_level = compression_level
+        self._pending: Dict[str, bytes] = {}
+        self._pending_lock = threading.Lock()
+        self._write_queue: Optional[queue.Queue] = None
+        self._writer_thread: Optional[threading.Thread] = None
+        self._write_errors = []
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes):
+        """Write raw bytes under the key, replacing any existing artifact."""
+
+    @abstractmethod
+    def _read(self, key: str) -> Optional[bytes]:
+        """Return raw bytes stored under the key, or None if it does not exist."""
+
+    def _exists(self, key: str) -> bool:
+        return self._read(key) is not None
+
+    def _key(self, namespace: str, name: str, compression: Optional[str]) -> str:
+        return f"{namespace}/{name}{self.COMPRESSION_SUFFIX[compression]}"
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == "gzip":
+            return gzip.compress(
+                data,
+                compresslevel=(
+                    9 if self.compression_level is None else self.compression_level
+                ),
+            )
+        if self.compression == "zstd":
+            import zstandard
+
+            return zstandard.ZstdCompressor(
+                level=3 if self.compression_level is None else self.compression_level
+            ).compress(data)
+        return data
+
+    @staticmethod
+    def _decompress(data: bytes) -> bytes:
+        if data.startswith(_ZSTD_MAGIC):
+            import zstandard
+
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        if data.startswith(_GZIP_MAGIC):
+            return gzip.decompress(data)
+        return data
+
+    def _writer_loop(self):
+        while True:
+            key, data = self._write_queue.get()
+            try:
+                self._write(key, self._compress(data))
+            except Exception as e:
+                logging.error(f"Error occurs when writing artifact {key}: {e}")
+                print(traceback.format_exc())
+                self._write_errors.append(e)
+            finally:
+                with self._pending_lock:
+                    if self._pending.get(key) is data:
+                        del self._pending[key]
+                self._write_queue.task_done()
+
+    def put_bytes(self, namespace: str, name: str, data: bytes):
+        key = self._key(namespace, name, self.compression)
+        if not self.async_write:
+            self._write(key, self._compress(data))
+            return
+        if self._writer_thread is None:
+            self._write_queue = queue.Queue()
+            self._writer_thread = threading.Thread(
+                target=self._writer_loop, name="artifact-store-writer", daemon=True
+            )
+            self._writer_thread.start()
+        with self._pending_lock:
+            self._pending[key] = data
+        self._write_queue.put((key, data))
+
+    def put_json(self, namespace: str, name: str, obj: Any):
+        self.put_bytes(namespace, name, _dumps_json(obj))
+
+    def put_jsonl(self, namespace: str, name: str, records: Iterable[Any]):
+        self.put_bytes(
+            namespace, name, b"".join(_dumps_json(record) + b"\n" for record in records)
+        )
+
+    def put_text(self, namespace: str, name: str, text: str):
+        self.put_bytes(namespace, name, text.encode("utf-8"))
+
+    def get_bytes(self, namespace: str, name: str) -> Optional[bytes]:
+        for compression in [self.compression] + [
+            c for c in self.COMPRESSION_SUFFIX if c != self.compression
+        ]:
+            key = self._key(namespace, name, compression)
+            with self._pending_lock:
+                data = self._pending.get(key)
+            if data is not None:
+                return data
+            data = self._read(key)
+            if data is not None:
+                return self._decompress(data)
+        return None
+
+    def get_json(self, namespace: str, name: str):
+        data = self.get_bytes(namespace, name)
+        return None if data is None else _loads_json(data)
+
+    def get_text(self, namespace: str, name: str) -> Optional[str]:
+        data = self.get_bytes(namespace, name)
+        return None if data is None else data.decode("utf-8")
+
+    def exists(self, namespace: str, name: str) -> bool:
+        for compression in self.COMPRESSION_SUFFIX:
+            key = self._key(namespace, name, compression)
+            with self._pending_lock:
+                if key in self._pending:
+                    return True
+            if self._exists(key):
+                return True
+        return False
+
+    def describe(self, namespace: str, name: str) -> str:
+        """Human-readable location of the artifact, used in error messages."""
+        return self._key(namespace, name, self.compression)
+
+    def flush(self):
+        """Block until all pending writes are done. Raises the first error that occurred in the writer thread."""
+        if self._write_queue is not None:
+            self._write_queue.join()
+        if self._write_errors:
+            error = self._write_errors[0]
+            self._write_errors = []
+            raise error
+
+    def close(self):
+        self.flush()
+
+
+class InMemoryArtifactStore(ArtifactStore):
+    """Keeps artifacts in a dictionary. Useful in service mode where no disk I/O is wanted on the request path."""
+
+    def __init__(
+        self,
+        async_write: bool = False,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+    ):
+        super().__init__(
+            async_write=async_write,
+            compression=compression,
+            compression_level=compression_level,
+        )
+        self.artifacts: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _write(self, key: str, data: bytes):
+        with self._lock:
+            self.artifacts[key] = data
+
+    def _read(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self.artifacts.get(key)
+
+    def _exists(self, key: str) -> bool:
+        with self._lock:
+            return key in self.artifacts
+
+
+class LocalFileSystemArtifactStore(ArtifactStore):
+    """Stores artifacts as files at `root_dir/namespace/name`. This is the layout STORM has always used."""
+
+    def __init__(
+        self,
+        root_dir: str,
+        async_write: bool = True,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+    ):
+        super().__init__(
+            async_write=async_write,
+            compression=compression,
+            compression_level=compression_level,
+        )
+        self.root_dir = root_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_dir, *key.split("/"))
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def describe(self, namespace: str, name: str) -> str:
+        return self._path(self._key(namespace, name, self.compression))
+
+
+class SQLiteArtifactStore(ArtifactStore):
+    """Stores artifacts as blobs in a single sqlite database file."""
+
+    def __init__(
+        self,
+        db_path: str,
+        async_write: bool = True,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+    ):
+        super().__init__(
+            async_write=async_write,
+            compression=compression,
+            compression_level=compression_level,
+        )
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts (key TEXT PRIMARY KEY, data BLOB NOT NULL)"
+            )
+
+    def _write(self, key: str, data: bytes):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts (key, data) VALUES (?, ?)",
+                (key, sqlite3.Binary(data)),
+            )
+
+    def _read(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM artifacts WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def _exists(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM artifacts WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    def describe(self, namespace: str, name: str) -> str:
+        return f"{self.db_path}:{self._key(namespace, name, self.compression)}"
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._conn.close()
+
+
+class LocalObjectStoreArtifactStore(ArtifactStore):
+    """
+    Local stand-in for an object store (e.g., S3, GCS) bucket.
+
+    Objects live in a flat `bucket_dir` with their full key (optionally prefixed) URL-encoded as the file name, plus a
+    JSON metadata sidecar with the size and ETag (MD5 of the stored bytes), mirroring the semantics of a
+    PUT/GET/HEAD object API. To target a real object store, override `_put_object`, `_get_object` and `_head_object`.
+    """
+
+    METADATA_SUFFIX = ".metadata.json"
+
+    def __init__(
+        self,
+        bucket_dir: str,
+        prefix: str = "",
+        async_write: bool = True,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+    ):
+        super().__init__(
+            async_write=async_write,
+            compression=compression,
+            compression_level=compression_level,
+        )
+        self.bucket_dir = bucket_dir
+        self.prefix = prefix
+        os.makedirs(bucket_dir, exist_ok=True)
+
+    def _object_path(self, object_key: str) -> str:
+        return os.path.join(self.bucket_dir, quote(object_key, safe=""))
+
+    def _put_object(self, object_key: str, data: bytes, metadata: Dict[str, Any]):
+        path = self._object_path(object_key)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+        FileIOHelper.dump_json(metadata, f"{path}{self.METADATA_SUFFIX}")
+
+    def _get_object(self, object_key: str) -> Optional[bytes]:
+        path = self._object_path(object_key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _head_object(self, object_key: str) -> Optional[Dict[str, Any]]:
+        path = f"{self._object_path(object_key)}{self.METADATA_SUFFIX}"
+        if not os.path.exists(path):
+            return None
+        return FileIOHelper.load_json(path)
+
+    def _write(self, key: str, data: bytes):
+        self._put_object(
+            self.prefix + key,
+            data,
+            {
+                "key": self.prefix + key,
+                "size": len(data),
+                "etag": hashlib.md5(data).hexdigest(),
+            },
+        )
+
+    def _read(self, key: str) -> Optional[bytes]:
+        return self._get_object(self.prefix + key)
+
+    def _exists(self, key: str) -> bool:
+        return self._head_object(self.prefix + key) is not None
+
+    def describe(self, namespace: str, name: str) -> str:
+        return f"{self.bucket_dir}/{self.prefix}{self._key(namespace, name, self.compression)}"
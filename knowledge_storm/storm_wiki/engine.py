@@ -1,4 +1,3 @@
-import json
 import logging
 import os
 from dataclasses import dataclass, field
@@ -6,6 +5,7 @@ from typing import Union, Literal, Optional
 
 import dspy
 
+from .artifact_store import ArtifactStore, LocalFileSystemArtifactStore
 from .modules.article_generation import StormArticleGenerationModule
 from .modules.article_polish import StormArticlePolishingModule
 from .modules.callback import BaseCallbackHandler
@@ -13,9 +13,10 @@ from .modules.knowledge_curation import StormKnowledgeCurationModule
 from .modules.outline_generation import StormOutlineGenerationModule
 from .modules.persona_generator import StormPersonaGenerator
 from .modules.storm_dataclass import StormInformationTable, StormArticle
-from ..interface import Engine, LMConfigs, Retriever
+from ..interface import Deadline, Engine, LMConfigs, Retriever
 from ..lm import LitellmModel
-from ..utils import FileIOHelper, makeStringRed, truncate_filename
+from ..query_cache import SemanticQueryCache
+from ..utils import makeStringRed, truncate_filename
 
 
 class STORMWikiLMConfigs(LMConfigs):
@@ -155,10 +156,38 @@ class STORMWikiRunnerArguments:
         default=3,
         metadata={"help": "Top k search results to consider for each search query."},
     )
+    max_snippets_per_source: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "If set, keep only the N snippets of each search result most relevant to the search query. "
+            "Retrievers that fetch whole pages otherwise keep every chunk of the page."
+        },
+    )
+    min_snippet_relevance: float = field(
+        default=0.0,
+        metadata={
+            "help": "Minimum BM25 score of a snippet to the search query for it to be kept when max_snippets_per_source "
+            "is set."
+        },
+    )
     retrieve_top_k: int = field(
         default=3,
         metadata={"help": "Top k collected references for each section title."},
     )
+    retrieval_mode: str = field(
+        default="dense",
+        metadata={
+            "help": "How collected references are ranked for each section title: 'dense' (sentence embeddings, "
+            "the original behavior), 'hybrid' (BM25 candidates reranked with sentence embeddings, faster on large "
+            "tables) or 'bm25' (no embedding model)."
+        },
+    )
+    num_retrieval_candidates: int = field(
+        default=100,
+        metadata={
+            "help": "Number of BM25 candidates to rerank in 'hybrid' retrieval mode."
+        },
+    )
     max_thread_num: int = field(
         default=10,
         metadata={
@@ -166,19 +195,65 @@ class STORMWikiRunnerArguments:
             "Consider reducing it if keep getting 'Exceed rate limit' error when calling LM API."
         },
     )
+    time_budget: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "If set, seconds a call to run() may take. Stages trim their remaining work (fewer conversation "
+            "turns and perspectives, fewer sections, lighter polishing) and bound LM and search timeouts to finish "
+            "within it."
+        },
+    )
+    save_llm_call_history: bool = field(
+        default=True,
+        metadata={
+            "help": "If True, save the full LM call history as llm_call_history.jsonl in post_run. "
+            "Disable it to skip the bulkiest artifact of a run."
+        },
+    )
 
 
 class STORMWikiRunner(Engine):
     """STORM Wiki pipeline runner."""
 
+    # Shares of the remaining time budget given to research and article generation; the rest of the budget is
+    # left to the stages after them.
+    RESEARCH_BUDGET_SHARE = 0.5
+    ARTICLE_GENERATION_BUDGET_SHARE = 0.8
+
     def __init__(
-        self, args: STORMWikiRunnerArguments, lm_configs: STORMWikiLMConfigs, rm
+        self,
+        args: STORMWikiRunnerArguments,
+        lm_configs: STORMWikiLMConfigs,
+        rm,
+        artifact_store: Optional[ArtifactStore] = None,
+        query_cache: Optional[SemanticQueryCache] = None,
     ):
+        """
+        Args:
+            args: Arguments for controlling the STORM Wiki pipeline.
+            lm_configs: LLM configurations used in different parts of STORM.
+            rm: Retrieval module.
+            artifact_store: Where run artifacts are written to and loaded from. Defaults to files under
+                `args.output_dir/<topic>/`, written on a background thread.
+            query_cache: Optional cache that serves search queries which paraphrase an earlier query on the same
+                topic without calling `rm`. Can be shared between runners.
+        """
         super().__init__(lm_configs=lm_configs)
         self.args = args
         self.lm_configs = lm_configs
+        self.artifact_store = (
+            artifact_store
+            if artifact_store is not None
+            else LocalFileSystemArtifactStore(root_dir=self.args.output_dir)
+        )
 
-        self.retriever = Retriever(rm=rm, max_thread=self.args.max_thread_num)
+        self.retriever = Retriever(
+            rm=rm,
+            max_thread=self.args.max_thread_num,
+            query_cache=query_cache,
+            max_snippets_per_source=self.args.max_snippets_per_source,
+            min_snippet_relevance=self.args.min_snippet_relevance,
+        )
         storm_persona_generator = StormPersonaGenerator(
             self.lm_configs.question_asker_lm
         )
@@ -199,6 +274,8 @@ class STORMWikiRunner(Engine):
             article_gen_lm=self.lm_configs.article_gen_lm,
             retrieve_top_k=self.args.retrieve_top_k,
             max_thread_num=self.args.max_thread_num,
+            retrieval_mode=self.args.retrieval_mode,
+            num_retrieval_candidates=self.args.num_retrieval_candidates,
         )
         self.storm_article_polishing_module = StormArticlePolishingModule(
             article_gen_lm=self.lm_configs.article_gen_lm,
@@ -212,6 +289,7 @@ class STORMWikiRunner(Engine):
         self,
         ground_truth_url: str = "None",
         callback_handler: BaseCallbackHandler = None,
+        deadline: Optional[Deadline] = None,
     ) -> StormInformationTable:
         (
             information_table,
@@ -223,33 +301,52 @@ class STORMWikiRunner(Engine):
             max_perspective=self.args.max_perspective,
             disable_perspective=False,
             return_conversation_log=True,
+            deadline=deadline,
         )
 
-        FileIOHelper.dump_json(
-            conversation_log,
-            os.path.join(self.article_output_dir, "conversation_log.json"),
+        self.artifact_store.put_json(
+            self.article_dir_name, "conversation_log.json", conversation_log
         )
-        information_table.dump_url_to_info(
-            os.path.join(self.article_output_dir, "raw_search_results.json")
+        self.artifact_store.put_json(
+            self.article_dir_name,
+            "raw_search_results.json",
+            information_table.url_to_info_to_dict(),
         )
+        if self.retriever.query_cache is not None:
+            logging.info(
+                f"Semantic query cache: {self.retriever.query_cache.get_stats()}"
+            )
+        if self.args.max_snippets_per_source is not None:
+            logging.info(
+                f"Snippet pruning: {self.retriever.collect_and_reset_snippet_pruning_stats()}"
+            )
         return information_table
 
     def run_outline_generation_module(
         self,
         information_table: StormInformationTable,
         callback_handler: BaseCallbackHandler = None,
+        deadline: Optional[Deadline] = None,
     ) -> StormArticle:
-        outline, draft_outline = self.storm_outline_generation_module.generate_outline(
-            topic=self.topic,
-            information_table=information_table,
-            return_draft_outline=True,
-            callback_handler=callback_handler,
-        )
-        outline.dump_outline_to_file(
-            os.path.join(self.article_output_dir, "storm_gen_outline.txt")
+        if deadline is None:
+            deadline = Deadline.current()
+        with deadline.activate():
+            (
+                outline,
+                draft_outline,
+            ) = self.storm_outline_generation_module.generate_outline(
+                topic=self.topic,
+                information_table=information_table,
+                return_draft_outline=True,
+                callback_handler=callback_handler,
+            )
+        self.artifact_store.put_text(
+            self.article_dir_name, "storm_gen_outline.txt", outline.get_outline_as_str()
         )
-        draft_outline.dump_outline_to_file(
-            os.path.join(self.article_output_dir, "direct_gen_outline.txt")
+        self.artifact_store.put_text(
+            self.article_dir_name,
+            "direct_gen_outline.txt",
+            draft_outline.get_outline_as_str(),
         )
         return outline
 
@@ -258,32 +355,39 @@ class STORMWikiRunner(Engine):
         outline: StormArticle,
         information_table=StormInformationTable,
         callback_handler: BaseCallbackHandler = None,
+        deadline: Optional[Deadline] = None,
     ) -> StormArticle:
         draft_article = self.storm_article_generation.generate_article(
             topic=self.topic,
             information_table=information_table,
             article_with_outline=outline,
             callback_handler=callback_handler,
+            deadline=deadline,
         )
-        draft_article.dump_article_as_plain_text(
-            os.path.join(self.article_output_dir, "storm_gen_article.txt")
+        self.artifact_store.put_text(
+            self.article_dir_name, "storm_gen_article.txt", draft_article.to_string()
         )
-        draft_article.dump_reference_to_file(
-            os.path.join(self.article_output_dir, "url_to_info.json")
+        self.artifact_store.put_json(
+            self.article_dir_name, "url_to_info.json", draft_article.reference_to_dict()
         )
         return draft_article
 
     def run_article_polishing_module(
-        self, draft_article: StormArticle, remove_duplicate: bool = False
+        self,
+        draft_article: StormArticle,
+        remove_duplicate: bool = False,
+        deadline: Optional[Deadline] = None,
     ) -> StormArticle:
         polished_article = self.storm_article_polishing_module.polish_article(
             topic=self.topic,
             draft_article=draft_article,
             remove_duplicate=remove_duplicate,
+            deadline=deadline,
         )
-        FileIOHelper.write_str(
+        self.artifact_store.put_text(
+            self.article_dir_name,
+            "storm_gen_article_polished.txt",
             polished_article.to_string(),
-            os.path.join(self.article_output_dir, "storm_gen_article_polished.txt"),
         )
         return polished_article
 
@@ -291,49 +395,57 @@ class STORMWikiRunner(Engine):
         """
         Post-run operations, including:
         1. Dumping the run configuration.
-        2. Dumping the LLM call history.
+        2. Dumping the LLM call history (unless `save_llm_call_history` is disabled).
+        3. Waiting for all pending artifact writes.
         """
         config_log = self.lm_configs.log()
-        FileIOHelper.dump_json(
-            config_log, os.path.join(self.article_output_dir, "run_config.json")
+        self.artifact_store.put_json(
+            self.article_dir_name, "run_config.json", config_log
         )
 
         llm_call_history = self.lm_configs.collect_and_reset_lm_history()
-        with open(
-            os.path.join(self.article_output_dir, "llm_call_history.jsonl"), "w"
-        ) as f:
+        if self.args.save_llm_call_history:
             for call in llm_call_history:
                 if "kwargs" in call:
                     call.pop(
                         "kwargs"
                     )  # All kwargs are dumped together to run_config.json.
-                f.write(json.dumps(call) + "\n")
+            self.artifact_store.put_jsonl(
+                self.article_dir_name, "llm_call_history.jsonl", llm_call_history
+            )
+        self.artifact_store.flush()
 
-    def _load_information_table_from_local_fs(self, information_table_local_path):
-        assert os.path.exists(information_table_local_path), makeStringRed(
-            f"{information_table_local_path} not exists. Please set --do-research argument to prepare the conversation_log.json for this topic."
+    def _load_information_table_from_artifact_store(self):
+        conversation_log = self.artifact_store.get_json(
+            self.article_dir_name, "conversation_log.json"
         )
-        return StormInformationTable.from_conversation_log_file(
-            information_table_local_path
+        assert conversation_log is not None, makeStringRed(
+            f"{self.artifact_store.describe(self.article_dir_name, 'conversation_log.json')} not exists. Please set --do-research argument to prepare the conversation_log.json for this topic."
         )
+        return StormInformationTable.from_conversation_log(conversation_log)
 
-    def _load_outline_from_local_fs(self, topic, outline_local_path):
-        assert os.path.exists(outline_local_path), makeStringRed(
-            f"{outline_local_path} not exists. Please set --do-generate-outline argument to prepare the storm_gen_outline.txt for this topic."
+    def _load_outline_from_artifact_store(self, topic):
+        outline_str = self.artifact_store.get_text(
+            self.article_dir_name, "storm_gen_outline.txt"
+        )
+        assert outline_str is not None, makeStringRed(
+            f"{self.artifact_store.describe(self.article_dir_name, 'storm_gen_outline.txt')} not exists. Please set --do-generate-outline argument to prepare the storm_gen_outline.txt for this topic."
         )
-        return StormArticle.from_outline_file(topic=topic, file_path=outline_local_path)
+        return StormArticle.from_outline_str(topic=topic, outline_str=outline_str)
 
-    def _load_draft_article_from_local_fs(
-        self, topic, draft_article_path, url_to_info_path
-    ):
-        assert os.path.exists(draft_article_path), makeStringRed(
-            f"{draft_article_path} not exists. Please set --do-generate-article argument to prepare the storm_gen_article.txt for this topic."
+    def _load_draft_article_from_artifact_store(self, topic):
+        article_text = self.artifact_store.get_text(
+            self.article_dir_name, "storm_gen_article.txt"
+        )
+        assert article_text is not None, makeStringRed(
+            f"{self.artifact_store.describe(self.article_dir_name, 'storm_gen_article.txt')} not exists. Please set --do-generate-article argument to prepare the storm_gen_article.txt for this topic."
         )
-        assert os.path.exists(url_to_info_path), makeStringRed(
-            f"{url_to_info_path} not exists. Please set --do-generate-article argument to prepare the url_to_info.json for this topic."
+        references = self.artifact_store.get_json(
+            self.article_dir_name, "url_to_info.json"
+        )
+        assert references is not None, makeStringRed(
+            f"{self.artifact_store.describe(self.article_dir_name, 'url_to_info.json')} not exists. Please set --do-generate-article argument to prepare the url_to_info.json for this topic."
         )
-        article_text = FileIOHelper.load_str(draft_article_path)
-        references = FileIOHelper.load_json(url_to_info_path)
         return StormArticle.from_string(
             topic_name=topic, article_text=article_text, references=references
         )
@@ -348,6 +460,7 @@ class STORMWikiRunner(Engine):
         do_polish_article: bool = True,
         remove_duplicate: bool = False,
         callback_handler: BaseCallbackHandler = BaseCallbackHandler(),
+        deadline: Optional[Deadline] = None,
     ):
         """
         Run the STORM pipeline.
@@ -365,6 +478,9 @@ class STORMWikiRunner(Engine):
              duplicated content.
             remove_duplicate: If True, remove duplicated content.
             callback_handler: A callback handler to handle the intermediate results.
+            deadline: When the run must end. Defaults to a deadline of `args.time_budget` seconds from now.
+             Research gets RESEARCH_BUDGET_SHARE of the budget and article generation ARTICLE_GENERATION_BUDGET_SHARE
+             of what is left, so that every stage runs; each stage trims its own work to fit its share.
         """
         assert (
             do_research
@@ -382,60 +498,54 @@ class STORMWikiRunner(Engine):
         self.article_output_dir = os.path.join(
             self.args.output_dir, self.article_dir_name
         )
-        os.makedirs(self.article_output_dir, exist_ok=True)
+
+        if deadline is None:
+            deadline = Deadline(self.args.time_budget)
 
         # research module
         information_table: StormInformationTable = None
         if do_research:
             information_table = self.run_knowledge_curation_module(
-                ground_truth_url=ground_truth_url, callback_handler=callback_handler
+                ground_truth_url=ground_truth_url,
+                callback_handler=callback_handler,
+                deadline=deadline.share(self.RESEARCH_BUDGET_SHARE),
             )
         # outline generation module
         outline: StormArticle = None
         if do_generate_outline:
             # load information table if it's not initialized
             if information_table is None:
-                information_table = self._load_information_table_from_local_fs(
-                    os.path.join(self.article_output_dir, "conversation_log.json")
-                )
+                information_table = self._load_information_table_from_artifact_store()
             outline = self.run_outline_generation_module(
-                information_table=information_table, callback_handler=callback_handler
+                information_table=information_table,
+                callback_handler=callback_handler,
+                deadline=deadline,
             )
 
         # article generation module
         draft_article: StormArticle = None
         if do_generate_article:
             if information_table is None:
-                information_table = self._load_information_table_from_local_fs(
-                    os.path.join(self.article_output_dir, "conversation_log.json")
-                )
+                information_table = self._load_information_table_from_artifact_store()
             if outline is None:
-                outline = self._load_outline_from_local_fs(
-                    topic=topic,
-                    outline_local_path=os.path.join(
-                        self.article_output_dir, "storm_gen_outline.txt"
-                    ),
-                )
+                outline = self._load_outline_from_artifact_store(topic=topic)
             draft_article = self.run_article_generation_module(
                 outline=outline,
                 information_table=information_table,
                 callback_handler=callback_handler,
+                deadline=deadline.share(self.ARTICLE_GENERATION_BUDGET_SHARE),
             )
 
         # article polishing module
         if do_polish_article:
             if draft_article is None:
-                draft_article_path = os.path.join(
-                    self.article_output_dir, "storm_gen_article.txt"
-                )
-                url_to_info_path = os.path.join(
-                    self.article_output_dir, "url_to_info.json"
-                )
-                draft_article = self._load_draft_article_from_local_fs(
-                    topic=topic,
-                    draft_article_path=draft_article_path,
-                    url_to_info_path=url_to_info_path,
+                draft_article = self._load_draft_article_from_artifact_store(
+                    topic=topic
                 )
             self.run_article_polishing_module(
-                draft_article=draft_article, remove_duplicate=remove_duplicate
+                draft_article=draft_article,
+                remove_duplicate=remove_duplicate,
+                deadline=deadline,
             )
+
+        self.artifact_store.flush()
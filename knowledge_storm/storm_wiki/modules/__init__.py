@@ -1,4 +1,36 @@
-from .knowledge_curation import *
-from .persona_generator import *
-from .retriever import *
-from .storm_dataclass import *
+from ...lazy_loader import attach_lazy_loader
+
+_LAZY_SUBMODULE_ATTRS = {
+    ".knowledge_curation": [
+        "script_dir",
+        "ConvSimulator",
+        "WikiWriter",
+        "AskQuestion",
+        "AskQuestionWithPersona",
+        "QuestionToQuery",
+        "AnswerQuestion",
+        "TopicExpert",
+        "StormKnowledgeCurationModule",
+    ],
+    ".persona_generator": [
+        "get_wiki_page_title_and_toc",
+        "FindRelatedTopic",
+        "GenPersona",
+        "CreateWriterWithPersona",
+        "StormPersonaGenerator",
+    ],
+    ".retriever": [
+        "GENERALLY_UNRELIABLE",
+        "DEPRECATED",
+        "BLACKLISTED",
+        "WIKIPEDIA_SOURCE_FILTER",
+        "is_valid_wikipedia_source",
+    ],
+    ".storm_dataclass": [
+        "DialogueTurn",
+        "StormInformationTable",
+        "StormArticle",
+    ],
+}
+
+__getattr__, __dir__, __all__ = attach_lazy_loader(__name__, _LAZY_SUBMODULE_ATTRS)
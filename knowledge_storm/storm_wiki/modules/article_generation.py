@@ -2,13 +2,13 @@ import concurrent.futures
 import copy
 import logging
 from concurrent.futures import as_completed
-from typing import List, Union
+from typing import List, Optional, Union
 
 import dspy
 
 from .callback import BaseCallbackHandler
 from .storm_dataclass import StormInformationTable, StormArticle
-from ...interface import ArticleGenerationModule, Information
+from ...interface import ArticleGenerationModule, Information, Deadline
 from ...utils import ArticleTextProcessing
 
 
@@ -23,27 +23,47 @@ class StormArticleGenerationModule(ArticleGenerationModule):
         article_gen_lm=Union[dspy.dsp.LM, dspy.dsp.HFModel],
         retrieve_top_k: int = 5,
         max_thread_num: int = 10,
+        retrieval_mode: str = "dense",
+        num_retrieval_candidates: int = 100,
     ):
         super().__init__()
         self.retrieve_top_k = retrieve_top_k
+        self.retrieval_mode = retrieval_mode
+        self.num_retrieval_candidates = num_retrieval_candidates
         self.article_gen_lm = article_gen_lm
         self.max_thread_num = max_thread_num
         self.section_gen = ConvToSection(engine=self.article_gen_lm)
 
     def generate_section(
-        self, topic, section_name, information_table, section_outline, section_query
+        self,
+        topic,
+        section_name,
+        information_table,
+        section_outline,
+        section_query,
+        deadline: Optional[Deadline] = None,
     ):
+        if deadline is None:
+            deadline = Deadline.current()
+        if deadline.expired():
+            logging.warning(f"Skipping section {section_name} to meet the deadline.")
+            return None
+        retrieve_top_k = self.retrieve_top_k
+        if deadline.running_low():
+            # a shorter prompt is written faster
+            retrieve_top_k = max(1, retrieve_top_k // 2)
         collected_info: List[Information] = []
         if information_table is not None:
             collected_info = information_table.retrieve_information(
-                queries=section_query, search_top_k=self.retrieve_top_k
+                queries=section_query, search_top_k=retrieve_top_k
+            )
+        with deadline.activate():
+            output = self.section_gen(
+                topic=topic,
+                outline=section_outline,
+                section=section_name,
+                collected_info=collected_info,
             )
-        output = self.section_gen(
-            topic=topic,
-            outline=section_outline,
-            section=section_name,
-            collected_info=collected_info,
-        )
         return {
             "section_name": section_name,
             "section_content": output.section,
@@ -56,6 +76,7 @@ class StormArticleGenerationModule(ArticleGenerationModule):
         information_table: StormInformationTable,
         article_with_outline: StormArticle,
         callback_handler: BaseCallbackHandler = None,
+        deadline: Optional[Deadline] = None,
     ) -> StormArticle:
         """
         Generate article for the topic based on the information table and article outline.
@@ -66,8 +87,15 @@ class StormArticleGenerationModule(ArticleGenerationModule):
             article_with_outline (StormArticle): The article with specified outline.
             callback_handler (BaseCallbackHandler): An optional callback handler that can be used to trigger
                 custom callbacks at various stages of the article generation process. Defaults to None.
+            deadline (Deadline): If provided, sections that have not started when it expires are left out, and
+                sections started when it is running low are written from fewer collected references.
         """
-        information_table.prepare_table_for_retrieval()
+        if deadline is None:
+            deadline = Deadline.current()
+        information_table.prepare_table_for_retrieval(
+            retrieval_mode=self.retrieval_mode,
+            num_candidates=self.num_retrieval_candidates,
+        )
 
         if article_with_outline is None:
             article_with_outline = StormArticle(topic_name=topic)
@@ -85,6 +113,7 @@ class StormArticleGenerationModule(ArticleGenerationModule):
                 information_table=information_table,
                 section_outline="",
                 section_query=[topic],
+                deadline=deadline,
             )
             section_output_dict_collection = [section_output_dict]
         else:
@@ -116,6 +145,7 @@ class StormArticleGenerationModule(ArticleGenerationModule):
                             information_table,
                             section_outline,
                             section_query,
+                            deadline,
                         )
                     ] = section_title
 
@@ -124,6 +154,8 @@ class StormArticleGenerationModule(ArticleGenerationModule):
 
         article = copy.deepcopy(article_with_outline)
         for section_output_dict in section_output_dict_collection:
+            if section_output_dict is None:
+                continue
             article.update_section(
                 parent_section_name=topic,
                 current_section_content=section_output_dict["section_content"],
@@ -1,10 +1,11 @@
 import copy
-from typing import Union
+import logging
+from typing import Optional, Union
 
 import dspy
 
 from .storm_dataclass import StormArticle
-from ...interface import ArticlePolishingModule
+from ...interface import ArticlePolishingModule, Deadline
 from ...utils import ArticleTextProcessing
 
 
@@ -27,7 +28,11 @@ class StormArticlePolishingModule(ArticlePolishingModule):
         )
 
     def polish_article(
-        self, topic: str, draft_article: StormArticle, remove_duplicate: bool = False
+        self,
+        topic: str,
+        draft_article: StormArticle,
+        remove_duplicate: bool = False,
+        deadline: Optional[Deadline] = None,
     ) -> StormArticle:
         """
         Polish article.
@@ -36,12 +41,25 @@ class StormArticlePolishingModule(ArticlePolishingModule):
             topic (str): The topic of the article.
             draft_article (StormArticle): The draft article.
             remove_duplicate (bool): Whether to use one additional LM call to remove duplicates from the article.
+            deadline (Deadline): If provided, duplicates are not removed when it is running low, and the draft is
+                returned unchanged when it has expired.
         """
+        if deadline is None:
+            deadline = Deadline.current()
+        if deadline.expired():
+            logging.warning("Deadline expired, returning the draft article unpolished.")
+            return copy.deepcopy(draft_article)
+        if remove_duplicate and deadline.running_low():
+            logging.info("Skipping duplicate removal to meet the deadline.")
+            remove_duplicate = False
 
         article_text = draft_article.to_string()
-        polish_result = self.polish_page(
-            topic=topic, draft_page=article_text, polish_whole_page=remove_duplicate
-        )
+        with deadline.activate():
+            polish_result = self.polish_page(
+                topic=topic,
+                draft_page=article_text,
+                polish_whole_page=remove_duplicate,
+            )
         lead_section = f"# summary\n{polish_result.lead_section}"
         polished_article = "\n\n".join([lead_section, polish_result.page])
         polished_article_dict = ArticleTextProcessing.parse_article_into_dict(
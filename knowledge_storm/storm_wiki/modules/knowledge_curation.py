@@ -1,6 +1,7 @@
 import concurrent.futures
 import logging
 import os
+import time
 from concurrent.futures import as_completed
 from typing import Union, List, Tuple, Optional, Dict
 
@@ -9,7 +10,7 @@ import dspy
 from .callback import BaseCallbackHandler
 from .persona_generator import StormPersonaGenerator
 from .storm_dataclass import DialogueTurn, StormInformationTable
-from ...interface import KnowledgeCurationModule, Retriever, Information
+from ...interface import KnowledgeCurationModule, Retriever, Information, Deadline
 from ...utils import ArticleTextProcessing
 
 try:
@@ -50,24 +51,40 @@ class ConvSimulator(dspy.Module):
         persona: str,
         ground_truth_url: str,
         callback_handler: BaseCallbackHandler,
+        deadline: Optional[Deadline] = None,
     ):
         """
         topic: The topic to research.
         persona: The persona of the Wikipedia writer.
         ground_truth_url: The ground_truth_url will be excluded from search to avoid ground truth leakage in evaluation.
+        deadline: If provided, the conversation ends early when the remaining time is shorter than an average turn.
         """
+        if deadline is None:
+            deadline = Deadline.current()
         dlg_history: List[DialogueTurn] = []
+        start_time = time.monotonic()
         for _ in range(self.max_turn):
-            user_utterance = self.wiki_writer(
-                topic=topic, persona=persona, dialogue_turns=dlg_history
-            ).question
+            if dlg_history and deadline.remaining() < (
+                (time.monotonic() - start_time) / len(dlg_history)
+            ):
+                logging.info(
+                    f"Ending the conversation after {len(dlg_history)} turns to meet the deadline."
+                )
+                break
+            with deadline.activate():
+                user_utterance = self.wiki_writer(
+                    topic=topic, persona=persona, dialogue_turns=dlg_history
+                ).question
             if user_utterance == "":
                 logging.error("Simulated Wikipedia writer utterance is empty.")
                 break
             if user_utterance.startswith("Thank you so much for your help!"):
                 break
             expert_output = self.topic_expert(
-                topic=topic, question=user_utterance, ground_truth_url=ground_truth_url
+                topic=topic,
+                question=user_utterance,
+                ground_truth_url=ground_truth_url,
+                deadline=deadline,
             )
             dlg_turn = DialogueTurn(
                 agent_utterance=expert_output.answer,
@@ -201,8 +218,18 @@ class TopicExpert(dspy.Module):
         self.max_search_queries = max_search_queries
         self.search_top_k = search_top_k
 
-    def forward(self, topic: str, question: str, ground_truth_url: str):
-        with dspy.settings.context(lm=self.engine, show_guidelines=False):
+    def forward(
+        self,
+        topic: str,
+        question: str,
+        ground_truth_url: str,
+        deadline: Optional[Deadline] = None,
+    ):
+        if deadline is None:
+            deadline = Deadline.current()
+        with dspy.settings.context(
+            lm=self.engine, show_guidelines=False
+        ), deadline.activate():
             # Identify: Break down question into queries.
             queries = self.generate_queries(topic=topic, question=question).queries
             queries = [
@@ -212,7 +239,10 @@ class TopicExpert(dspy.Module):
             queries = queries[: self.max_search_queries]
             # Search
             searched_results: List[Information] = self.retriever.retrieve(
-                list(set(queries)), exclude_urls=[ground_truth_url]
+                list(set(queries)),
+                exclude_urls=[ground_truth_url],
+                topic=topic,
+                deadline=deadline,
             )
             if len(searched_results) > 0:
                 # Evaluate: Simplify this part by directly using the top 1 snippet.
@@ -290,6 +320,7 @@ class StormKnowledgeCurationModule(KnowledgeCurationModule):
         ground_truth_url,
         considered_personas,
         callback_handler: BaseCallbackHandler,
+        deadline: Optional[Deadline] = None,
     ) -> List[Tuple[str, List[DialogueTurn]]]:
         """
         Executes multiple conversation simulations concurrently, each with a different persona,
@@ -306,6 +337,9 @@ class StormKnowledgeCurationModule(KnowledgeCurationModule):
                 will be conducted. Each persona is passed to `conv_simulator` individually.
             callback_handler (callable): A callback function that is passed to `conv_simulator`. It
                 should handle any callbacks or events during the simulation.
+            deadline (Deadline, optional): Passed to `conv_simulator`. Conversations that have not started
+                when it expires, or when the remaining time is shorter than the average finished conversation,
+                are skipped.
 
         Returns:
             list of tuples: A list where each tuple contains a persona and its corresponding cleaned
@@ -313,14 +347,30 @@ class StormKnowledgeCurationModule(KnowledgeCurationModule):
         """
 
         conversations = []
+        if deadline is None:
+            deadline = Deadline.current()
+        # durations of the finished conversations, to estimate whether one more conversation fits the deadline
+        conv_durations = []
 
         def run_conv(persona):
-            return conv_simulator(
+            if deadline.expired() or (
+                conv_durations
+                and deadline.remaining() < sum(conv_durations) / len(conv_durations)
+            ):
+                logging.info(
+                    f"Skipping the conversation of persona {persona!r} to meet the deadline."
+                )
+                return dspy.Prediction(dlg_history=[])
+            start_time = time.monotonic()
+            conv = conv_simulator(
                 topic=topic,
                 ground_truth_url=ground_truth_url,
                 persona=persona,
                 callback_handler=callback_handler,
+                deadline=deadline,
             )
+            conv_durations.append(time.monotonic() - start_time)
+            return conv
 
         max_workers = min(self.max_thread_num, len(considered_personas))
 
@@ -352,26 +402,37 @@ class StormKnowledgeCurationModule(KnowledgeCurationModule):
         max_perspective: int = 0,
         disable_perspective: bool = True,
         return_conversation_log=False,
+        deadline: Optional[Deadline] = None,
     ) -> Union[StormInformationTable, Tuple[StormInformationTable, Dict]]:
         """
         Curate information and knowledge for the given topic
 
         Args:
             topic: topic of interest in natural language.
+            deadline: If provided, research is trimmed to end by the deadline: the personas are not generated if it
+                is already running low, only as many personas as can talk concurrently are kept if it runs low
+                after generating them, conversations that would not finish in time are not started, and
+                conversations end early.
 
         Returns:
             collected_information: collected information in InformationTable type.
         """
+        if deadline is None:
+            deadline = Deadline.current()
 
         # identify personas
         callback_handler.on_identify_perspective_start()
         considered_personas = []
-        if disable_perspective:
+        if disable_perspective or deadline.running_low():
             considered_personas = [""]
         else:
-            considered_personas = self._get_considered_personas(
-                topic=topic, max_num_persona=max_perspective
-            )
+            with deadline.activate():
+                considered_personas = self._get_considered_personas(
+                    topic=topic, max_num_persona=max_perspective
+                )
+            if deadline.running_low():
+                # personas beyond the thread pool would only start talking once another conversation ends
+                considered_personas = considered_personas[: max(1, self.max_thread_num)]
         callback_handler.on_identify_perspective_end(perspectives=considered_personas)
 
         # run conversation
@@ -382,6 +443,7 @@ class StormKnowledgeCurationModule(KnowledgeCurationModule):
             ground_truth_url=ground_truth_url,
             considered_personas=considered_personas,
             callback_handler=callback_handler,
+            deadline=deadline,
         )
 
         information_table = StormInformationTable(conversations)
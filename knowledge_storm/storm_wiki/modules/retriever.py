@@ -1,10 +1,9 @@
 from typing import Union, List
-from urllib.parse import urlparse
 
 import dspy
 
 from ...interface import Retriever, Information
-from ...utils import ArticleTextProcessing
+from ...utils import ArticleTextProcessing, SourceFilter
 
 # Internet source restrictions according to Wikipedia standard:
 # https://en.wikipedia.org/wiki/Wikipedia:Reliable_sources/Perennial_sources
@@ -222,12 +221,11 @@ BLACKLISTED = {
 }
 
 
+WIKIPEDIA_SOURCE_FILTER = SourceFilter(
+    deny_patterns=GENERALLY_UNRELIABLE | DEPRECATED | BLACKLISTED
+)
+
+
 def is_valid_wikipedia_source(url):
-    parsed_url = urlparse(url)
     # Check if the URL is from a reliable domain
-    combined_set = GENERALLY_UNRELIABLE | DEPRECATED | BLACKLISTED
-    for domain in combined_set:
-        if domain in parsed_url.netloc:
-            return False
-
-    return True
+    return WIKIPEDIA_SOURCE_FILTER(url)
@@ -1,14 +1,10 @@
-import copy
-import re
 from collections import OrderedDict
 from typing import Union, Optional, Any, List, Tuple, Dict
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 
 from ...interface import Information, InformationTable, Article, ArticleSectionNode
-from ...utils import ArticleTextProcessing, FileIOHelper
+from ...utils import ArticleTextProcessing, BM25Index, FileIOHelper
 
 
 class DialogueTurn:
@@ -55,12 +51,19 @@ class StormInformationTable(InformationTable):
     would be perspective guided dialogue history.
     """
 
+    RETRIEVAL_MODES = ("dense", "hybrid", "bm25")
+
     def __init__(self, conversations=List[Tuple[str, List[DialogueTurn]]]):
         super().__init__()
         self.conversations = conversations
         self.url_to_info: Dict[str, Information] = (
             StormInformationTable.construct_url_to_info(self.conversations)
         )
+        (
+            self.collected_urls,
+            self.collected_snippets,
+            self.snippet_index,
+        ) = StormInformationTable.construct_snippet_index(self.url_to_info)
 
     @staticmethod
     def construct_url_to_info(
@@ -79,6 +82,21 @@ class StormInformationTable(InformationTable):
             url_to_info[url].snippets = list(set(url_to_info[url].snippets))
         return url_to_info
 
+    @staticmethod
+    def construct_snippet_index(
+        url_to_info: Dict[str, Information]
+    ) -> Tuple[List[str], List[str], BM25Index]:
+        """Flattens the snippets of `url_to_info` and indexes them with BM25. Document i of the index is snippet i."""
+        collected_urls = []
+        collected_snippets = []
+        snippet_index = BM25Index()
+        for url, information in url_to_info.items():
+            for snippet in information.snippets:
+                collected_urls.append(url)
+                collected_snippets.append(snippet)
+                snippet_index.add(snippet)
+        return collected_urls, collected_snippets, snippet_index
+
     @staticmethod
     def construct_log_dict(
         conversations: List[Tuple[str, List[DialogueTurn]]]
@@ -90,15 +108,18 @@ class StormInformationTable(InformationTable):
             )
         return conversation_log
 
+    def url_to_info_to_dict(self) -> Dict[str, Dict]:
+        return {url: info.to_dict() for url, info in self.url_to_info.items()}
+
     def dump_url_to_info(self, path):
-        url_to_info = copy.deepcopy(self.url_to_info)
-        for url in url_to_info:
-            url_to_info[url] = url_to_info[url].to_dict()
-        FileIOHelper.dump_json(url_to_info, path)
+        FileIOHelper.dump_json(self.url_to_info_to_dict(), path)
 
     @classmethod
     def from_conversation_log_file(cls, path):
-        conversation_log_data = FileIOHelper.load_json(path)
+        return cls.from_conversation_log(FileIOHelper.load_json(path))
+
+    @classmethod
+    def from_conversation_log(cls, conversation_log_data: List[Dict]):
         conversations = []
         for item in conversation_log_data:
             dialogue_turns = [DialogueTurn(**turn) for turn in item["dlg_turns"]]
@@ -106,15 +127,75 @@ class StormInformationTable(InformationTable):
             conversations.append((persona, dialogue_turns))
         return cls(conversations)
 
-    def prepare_table_for_retrieval(self):
+    def prepare_table_for_retrieval(
+        self, retrieval_mode: str = "dense", num_candidates: int = 100
+    ):
+        """
+        Args:
+            retrieval_mode (str): How snippets are ranked for a query.
+                "dense": cosine similarity of sentence embeddings against every snippet.
+                "hybrid": BM25 selects `num_candidates` snippets, which are reranked with sentence embeddings.
+                    Snippets are only embedded once they become a candidate.
+                "bm25": BM25 only. Does not load the embedding model.
+            num_candidates (int): Number of BM25 candidates to rerank in "hybrid" mode.
+        """
+        if retrieval_mode not in self.RETRIEVAL_MODES:
+            raise ValueError(
+                f"Unsupported retrieval mode {retrieval_mode}. Choose from {list(self.RETRIEVAL_MODES)}."
+            )
+        self.retrieval_mode = retrieval_mode
+        self.num_candidates = num_candidates
+        if retrieval_mode == "bm25":
+            return
+
+        from sentence_transformers import SentenceTransformer
+
         self.encoder = SentenceTransformer("paraphrase-MiniLM-L6-v2")
-        self.collected_urls = []
-        self.collected_snippets = []
-        for url, information in self.url_to_info.items():
-            for snippet in information.snippets:
-                self.collected_urls.append(url)
-                self.collected_snippets.append(snippet)
-        self.encoded_snippets = self.encoder.encode(self.collected_snippets)
+        self.snippet_id_to_embedding = {}
+        if retrieval_mode == "dense":
+            self.encoded_snippets = self.encoder.encode(self.collected_snippets)
+
+    def _rerank_with_embeddings(
+        self, query: str, snippet_ids: List[int], search_top_k: int
+    ) -> List[int]:
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        if self.retrieval_mode == "dense":
+            encoded_snippets = self.encoded_snippets
+        else:
+            missing_ids = [
+                i for i in snippet_ids if i not in self.snippet_id_to_embedding
+            ]
+            if missing_ids:
+                for i, embedding in zip(
+                    missing_ids,
+                    self.encoder.encode(
+                        [self.collected_snippets[i] for i in missing_ids]
+                    ),
+                ):
+                    self.snippet_id_to_embedding[i] = embedding
+            encoded_snippets = [self.snippet_id_to_embedding[i] for i in snippet_ids]
+        encoded_query = self.encoder.encode(query)
+        sim = cosine_similarity([encoded_query], encoded_snippets)[0]
+        sorted_indices = np.argsort(sim)
+        return [snippet_ids[i] for i in sorted_indices[-search_top_k:][::-1]]
+
+    def _rank_snippets(self, query: str, search_top_k: int) -> List[int]:
+        if self.retrieval_mode == "bm25":
+            return [i for i, _ in self.snippet_index.search(query, search_top_k)]
+        if self.retrieval_mode == "hybrid":
+            candidate_ids = [
+                i
+                for i, _ in self.snippet_index.search(
+                    query, max(self.num_candidates, search_top_k)
+                )
+            ]
+            # too little lexical overlap to fill the top k; fall back to scoring every snippet
+            if len(candidate_ids) >= search_top_k:
+                return self._rerank_with_embeddings(query, candidate_ids, search_top_k)
+        return self._rerank_with_embeddings(
+            query, list(range(len(self.collected_snippets))), search_top_k
+        )
 
     def retrieve_information(
         self, queries: Union[List[str], str], search_top_k
@@ -124,10 +205,7 @@ class StormInformationTable(InformationTable):
         if type(queries) is str:
             queries = [queries]
         for query in queries:
-            encoded_query = self.encoder.encode(query)
-            sim = cosine_similarity([encoded_query], self.encoded_snippets)[0]
-            sorted_indices = np.argsort(sim)
-            for i in sorted_indices[-search_top_k:][::-1]:
+            for i in self._rank_snippets(query, search_top_k):
                 selected_urls.append(self.collected_urls[i])
                 selected_snippets.append(self.collected_snippets[i])
 
@@ -139,8 +217,9 @@ class StormInformationTable(InformationTable):
 
         selected_url_to_info = {}
         for url in url_to_snippets:
-            selected_url_to_info[url] = copy.deepcopy(self.url_to_info[url])
-            selected_url_to_info[url].snippets = list(url_to_snippets[url])
+            selected_url_to_info[url] = self.url_to_info[url].copy(
+                snippets=list(url_to_snippets[url])
+            )
 
         return list(selected_url_to_info.values())
 
@@ -150,27 +229,6 @@ class StormArticle(Article):
         super().__init__(topic_name=topic_name)
         self.reference = {"url_to_unified_index": {}, "url_to_info": {}}
 
-    def find_section(
-        self, node: ArticleSectionNode, name: str
-    ) -> Optional[ArticleSectionNode]:
-        """
-        Return the node of the section given the section name.
-
-        Args:
-            node: the node as the root to find.
-            name: the name of node as section name
-
-        Return:
-            reference of the node or None if section name has no match
-        """
-        if node.section_name == name:
-            return node
-        for child in node.children:
-            result = self.find_section(child, name)
-            if result:
-                return result
-        return None
-
     def _merge_new_info_to_references(
         self, new_info_list: List[Information], index_to_keep=None
     ) -> Dict[int, int]:
@@ -225,7 +283,10 @@ class StormArticle(Article):
                     parent_node.remove_child(child)
 
         for section_name, content_dict in article_dict.items():
-            current_section_node = self.find_section(parent_node, section_name)
+            # the section usually is a direct child; otherwise fall back to searching the subtree
+            current_section_node = parent_node.get_child(
+                section_name
+            ) or self.find_section(parent_node, section_name)
             if current_section_node is None:
                 current_section_node = ArticleSectionNode(
                     section_name=section_name, content=content_dict["content"].strip()
@@ -265,26 +326,33 @@ class StormArticle(Article):
         """
 
         if current_section_info_list is not None:
+            # parse citations once; trimming and renumbering below only touch the integer tokens
+            segments = ArticleTextProcessing.parse_citation_segments(
+                current_section_content
+            )
             references = set(
-                [int(x) for x in re.findall(r"\[(\d+)\]", current_section_content)]
+                segment for segment in segments if isinstance(segment, int)
             )
             # for any reference number greater than max number of references, delete the reference
             if len(references) > 0:
                 max_ref_num = max(references)
                 if max_ref_num > len(current_section_info_list):
-                    for i in range(len(current_section_info_list), max_ref_num + 1):
-                        current_section_content = current_section_content.replace(
-                            f"[{i}]", ""
-                        )
-                        if i in references:
-                            references.remove(i)
+                    segments = [
+                        segment
+                        for segment in segments
+                        if not isinstance(segment, int)
+                        or segment < len(current_section_info_list)
+                    ]
+                    references = set(
+                        i for i in references if i < len(current_section_info_list)
+                    )
             # for any reference that is not used, trim it from current_section_info_list
             index_to_keep = [i - 1 for i in references]
             citation_mapping = self._merge_new_info_to_references(
                 current_section_info_list, index_to_keep
             )
-            current_section_content = ArticleTextProcessing.update_citation_index(
-                current_section_content, citation_mapping
+            current_section_content = ArticleTextProcessing.render_citation_segments(
+                segments, citation_mapping
             )
 
         if parent_section_name is None:
@@ -372,36 +440,34 @@ class StormArticle(Article):
         return "\n\n".join(result)
 
     def reorder_reference_index(self):
-        # pre-order traversal to get order of references appear in the article
-        ref_indices = []
+        # pre-order traversal to parse each section once and get order of references appear in the article
+        node_segments = []
 
-        def pre_order_find_index(node):
+        def pre_order_parse_segments(node):
             if node is not None:
                 if node.content is not None and node.content:
-                    ref_indices.extend(
-                        ArticleTextProcessing.parse_citation_indices(node.content)
+                    node_segments.append(
+                        (
+                            node,
+                            ArticleTextProcessing.parse_citation_segments(node.content),
+                        )
                     )
                 for child in node.children:
-                    pre_order_find_index(child)
+                    pre_order_parse_segments(child)
 
-        pre_order_find_index(self.root)
+        pre_order_parse_segments(self.root)
         # constrcut index mapping
         ref_index_mapping = {}
-        for ref_index in ref_indices:
-            if ref_index not in ref_index_mapping:
-                ref_index_mapping[ref_index] = len(ref_index_mapping) + 1
+        for _, segments in node_segments:
+            for segment in segments:
+                if isinstance(segment, int) and segment not in ref_index_mapping:
+                    ref_index_mapping[segment] = len(ref_index_mapping) + 1
 
         # update content
-        def pre_order_update_index(node):
-            if node is not None:
-                if node.content is not None and node.content:
-                    node.content = ArticleTextProcessing.update_citation_index(
-                        node.content, ref_index_mapping
-                    )
-                for child in node.children:
-                    pre_order_update_index(child)
-
-        pre_order_update_index(self.root)
+        for node, segments in node_segments:
+            node.content = ArticleTextProcessing.render_citation_segments(
+                segments, ref_index_mapping
+            )
         # update reference
         for url in list(self.reference["url_to_unified_index"]):
             pre_index = self.reference["url_to_unified_index"][url]
@@ -473,15 +539,25 @@ class StormArticle(Article):
                 node_stack.append((level, new_node))
         return instance
 
+    def get_outline_as_str(self) -> str:
+        return "\n".join(
+            self.get_outline_as_list(add_hashtags=True, include_root=False)
+        )
+
     def dump_outline_to_file(self, file_path):
-        outline = self.get_outline_as_list(add_hashtags=True, include_root=False)
-        FileIOHelper.write_str("\n".join(outline), file_path)
+        FileIOHelper.write_str(self.get_outline_as_str(), file_path)
+
+    def reference_to_dict(self) -> Dict[str, Dict]:
+        return {
+            "url_to_unified_index": self.reference["url_to_unified_index"],
+            "url_to_info": {
+                url: info.to_dict()
+                for url, info in self.reference["url_to_info"].items()
+            },
+        }
 
     def dump_reference_to_file(self, file_path):
-        reference = copy.deepcopy(self.reference)
-        for url in reference["url_to_info"]:
-            reference["url_to_info"][url] = reference["url_to_info"][url].to_dict()
-        FileIOHelper.dump_json(reference, file_path)
+        FileIOHelper.dump_json(self.reference_to_dict(), file_path)
 
     def dump_article_as_plain_text(self, file_path):
         text = self.to_string()
@@ -1,22 +1,22 @@
+import collections
 import concurrent.futures
-import dspy
-import httpx
+import functools
+import hashlib
+import heapq
 import json
 import logging
+import math
 import os
 import pickle
 import re
 import regex
 import sys
 import toml
-from typing import List, Dict
+import uuid
+from typing import Dict, Iterable, List
+from urllib.parse import urlparse
 from tqdm import tqdm
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from trafilatura import extract
-
-from .lm import LitellmModel
-
 logging.getLogger("httpx").setLevel(logging.WARNING)  # Disable INFO logging for httpx.
 
 
@@ -148,6 +148,31 @@ class QdrantVectorStoreManager:
         except Exception as e:
             raise ValueError(f"Error occurs when loading the vector store: {e}")
 
+    @staticmethod
+    def create_text_splitter(chunk_size: int, chunk_overlap: int):
+        """Text splitter used to chunk documents before they are embedded."""
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            add_start_index=True,
+            separators=[
+                "\n\n",
+                "\n",
+                ".",
+                "\uff0e",  # Fullwidth full stop
+                "\u3002",  # Ideographic full stop
+                ",",
+                "\uff0c",  # Fullwidth comma
+                "\u3001",  # Ideographic comma
+                " ",
+                "\u200B",  # Zero-width space
+                "",
+            ],
+        )
+
     @staticmethod
     def create_or_update_vector_store(
         collection_name: str,
@@ -165,15 +190,21 @@ class QdrantVectorStoreManager:
         qdrant_api_key: str = None,
         embedding_model: str = "BAAI/bge-m3",
         device: str = "mps",
+        csv_chunk_rows: int = 10000,
+        num_embed_workers: int = 2,
+        max_pending_batches: int = 8,
     ):
-        from qdrant_client import Document
-
         """
         Takes a CSV file and adds each row in the CSV file to the Qdrant collection.
 
         This function expects each row of the CSV file as a document.
         The CSV file should have columns for "content", "title", "URL", and "description".
 
+        The CSV file is streamed in chunks of `csv_chunk_rows` rows. Every point stores a hash of its row, so rows
+        that are already in the collection with the same content are skipped, changed rows replace their old points,
+        and an interrupted run can simply be restarted. Embedding runs in a pool of `num_embed_workers` threads while
+        the embedded batches are upserted on a separate thread.
+
         Args:
             collection_name: Name of the Qdrant collection.
             vector_store_path (str): Path to the directory where the vector store is stored or will be stored.
@@ -189,6 +220,9 @@ class QdrantVectorStoreManager:
             embedding_model: Name of the Hugging Face embedding model.
             device: Device to run the embeddings model on, can be "mps", "cuda", "cpu".
             qdrant_api_key: API key for the Qdrant server (Only required if the Qdrant server is online).
+            csv_chunk_rows (int): Number of CSV rows read at a time.
+            num_embed_workers (int): Number of threads running the embedding model.
+            max_pending_batches (int): Maximum number of batches being embedded or upserted at a time.
         """
         # check if the collection name is provided
         if collection_name is None:
@@ -236,69 +270,239 @@ class QdrantVectorStoreManager:
         if qdrant is None:
             raise ValueError("Qdrant client is not initialized.")
 
-        # read the csv file
+        # stream the csv file, embed the changed rows in a worker pool and upsert the embeddings on a separate thread
         import pandas as pd
+        from qdrant_client import models
 
-        df = pd.read_csv(file_path)
-        # check that content column exists and url column exists
-        if content_column not in df.columns:
-            raise ValueError(
-                f"Content column {content_column} not found in the csv file."
-            )
-        if url_column not in df.columns:
-            raise ValueError(f"URL column {url_column} not found in the csv file.")
-
-        documents = [
-            Document(
-                page_content=row[content_column],
-                metadata={
-                    "title": row.get(title_column, ""),
-                    "url": row[url_column],
-                    "description": row.get(desc_column, ""),
-                },
+        client = qdrant.client
+        metadata_key = qdrant.metadata_payload_key
+        content_key = qdrant.content_payload_key
+        vector_name = qdrant.vector_name
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=f"{metadata_key}.url",
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
+        text_splitter = QdrantVectorStoreManager.create_text_splitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+
+        def embed(texts):
+            return model.embed_documents(texts)
+
+        def upsert(batch, embeddings):
+            client.upsert(
+                collection_name=collection_name,
+                points=[
+                    models.PointStruct(
+                        id=point_id,
+                        vector={vector_name: vector} if vector_name else vector,
+                        payload={content_key: text, metadata_key: metadata},
+                    )
+                    for (point_id, text, metadata), vector in zip(batch, embeddings)
+                ],
+                wait=True,
             )
-            for row in df.to_dict(orient="records")
-        ]
 
-        # split the documents
-        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        num_skipped_rows = 0
+        num_ingested_rows = 0
+        # urls of the csv chunks read so far
+        seen_urls = set()
+        pending_embeddings = collections.deque()
+        pending_upserts = collections.deque()
+        progress = tqdm(unit="rows")
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_embed_workers
+        ) as embed_executor, concurrent.futures.ThreadPoolExecutor(
+            max_workers=1
+        ) as upsert_executor:
+
+            def drain(max_pending):
+                while len(pending_embeddings) > max_pending:
+                    batch, future = pending_embeddings.popleft()
+                    pending_upserts.append(
+                        upsert_executor.submit(upsert, batch, future.result())
+                    )
+                while pending_upserts and (
+                    pending_upserts[0].done() or len(pending_upserts) > max_pending
+                ):
+                    # surface upsert errors instead of continuing to embed
+                    pending_upserts.popleft().result()
+
+            for df in pd.read_csv(file_path, chunksize=csv_chunk_rows):
+                # check that content column exists and url column exists
+                if content_column not in df.columns:
+                    raise ValueError(
+                        f"Content column {content_column} not found in the csv file."
+                    )
+                if url_column not in df.columns:
+                    raise ValueError(
+                        f"URL column {url_column} not found in the csv file."
+                    )
+                df = df.fillna("")
+                # the url identifies a document; if a url appears several times, the last row wins
+                rows = {row[url_column]: row for row in df.to_dict(orient="records")}
+                if not seen_urls.isdisjoint(rows):
+                    # points of an earlier chunk may still be in flight; they must land before their url's state is
+                    # read and its stale points are deleted
+                    drain(0)
+                seen_urls.update(rows)
+                ingested_state = QdrantVectorStoreManager._fetch_ingested_state(
+                    client=client,
+                    collection_name=collection_name,
+                    metadata_key=metadata_key,
+                    urls=list(rows),
+                )
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            add_start_index=True,
-            separators=[
-                "\n\n",
-                "\n",
-                ".",
-                "\uff0e",  # Fullwidth full stop
-                "\u3002",  # Ideographic full stop
-                ",",
-                "\uff0c",  # Fullwidth comma
-                "\u3001",  # Ideographic comma
-                " ",
-                "\u200B",  # Zero-width space
-                "",
-            ],
+                batch = []
+                stale_urls = []
+                for row_url, row in rows.items():
+                    content_hash = QdrantVectorStoreManager._row_content_hash(
+                        content=row[content_column],
+                        title=row.get(title_column, ""),
+                        url=row_url,
+                        description=row.get(desc_column, ""),
+                        chunk_size=chunk_size,
+                        chunk_overlap=chunk_overlap,
+                        embedding_model=embedding_model,
+                    )
+                    state = ingested_state.get(row_url)
+                    if (
+                        state is not None
+                        and state["complete"]
+                        and state["content_hash"] == content_hash
+                    ):
+                        num_skipped_rows += 1
+                        continue
+                    if state is not None:
+                        stale_urls.append(row_url)
+                    chunks = text_splitter.create_documents(
+                        [row[content_column]],
+                        metadatas=[
+                            {
+                                "title": row.get(title_column, ""),
+                                "url": row_url,
+                                "description": row.get(desc_column, ""),
+                            }
+                        ],
+                    )
+                    for chunk_index, chunk in enumerate(chunks):
+                        chunk.metadata.update(
+                            {
+                                "content_hash": content_hash,
+                                "chunk_index": chunk_index,
+                                "num_chunks": len(chunks),
+                            }
+                        )
+                        point_id = str(
+                            uuid.uuid5(
+                                uuid.NAMESPACE_URL,
+                                f"{row_url}#{content_hash}#{chunk_index}",
+                            )
+                        )
+                        batch.append((point_id, chunk.page_content, chunk.metadata))
+                    num_ingested_rows += 1
+
+                if stale_urls:
+                    # points of the old version of a changed row must be removed before the new ones are written
+                    client.delete(
+                        collection_name=collection_name,
+                        points_selector=models.FilterSelector(
+                            filter=models.Filter(
+                                must=[
+                                    models.FieldCondition(
+                                        key=f"{metadata_key}.url",
+                                        match=models.MatchAny(any=stale_urls),
+                                    )
+                                ]
+                            )
+                        ),
+                        wait=True,
+                    )
+                for i in range(0, len(batch), batch_size):
+                    sub_batch = batch[i : i + batch_size]
+                    pending_embeddings.append(
+                        (
+                            sub_batch,
+                            embed_executor.submit(
+                                embed, [text for _, text, _ in sub_batch]
+                            ),
+                        )
+                    )
+                    drain(max_pending_batches)
+                progress.update(len(df))
+            drain(0)
+        progress.close()
+        print(
+            f"Ingested {num_ingested_rows} new or changed rows, skipped {num_skipped_rows} unchanged rows."
         )
-        split_documents = text_splitter.split_documents(documents)
-
-        # update and save the vector store
-        num_batches = (len(split_documents) + batch_size - 1) // batch_size
-        for i in tqdm(range(num_batches)):
-            start_idx = i * batch_size
-            end_idx = min((i + 1) * batch_size, len(split_documents))
-            qdrant.add_documents(
-                documents=split_documents[start_idx:end_idx],
-                batch_size=batch_size,
-            )
 
         # close the qdrant client
         qdrant.client.close()
 
+    @staticmethod
+    def _row_content_hash(**fields) -> str:
+        """Hash of a CSV row and of the settings that determine its embeddings."""
+        return hashlib.sha256(
+            json.dumps(fields, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def _fetch_ingested_state(
+        client: "QdrantClient",
+        collection_name: str,
+        metadata_key: str,
+        urls: List[str],
+    ) -> Dict[str, Dict]:
+        """
+        Returns url -> {"content_hash", "complete"} for the urls that already have points in the collection.
+        A url is complete if all chunks of one version of the row were upserted. Since every chunk records the hash
+        of its row, the collection itself is the ingestion checkpoint: an interrupted run resumes by skipping the rows
+        that are complete and redoing the others.
+        """
+        from qdrant_client import models
+
+        url_to_chunks = {}
+        for i in range(0, len(urls), 1000):
+            offset = None
+            while True:
+                points, offset = client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=models.Filter(
+                        must=[
+                            models.FieldCondition(
+                                key=f"{metadata_key}.url",
+                                match=models.MatchAny(any=urls[i : i + 1000]),
+                            )
+                        ]
+                    ),
+                    limit=1000,
+                    offset=offset,
+                    with_payload=[metadata_key],
+                    with_vectors=False,
+                )
+                for point in points:
+                    metadata = point.payload.get(metadata_key) or {}
+                    url_to_chunks.setdefault(metadata.get("url"), []).append(metadata)
+                if offset is None:
+                    break
+
+        ingested_state = {}
+        for point_url, chunks in url_to_chunks.items():
+            content_hashes = set(chunk.get("content_hash") for chunk in chunks)
+            content_hash = content_hashes.pop() if len(content_hashes) == 1 else None
+            ingested_state[point_url] = {
+                "content_hash": content_hash,
+                "complete": content_hash is not None
+                and len(set(chunk.get("chunk_index") for chunk in chunks))
+                == chunks[0].get("num_chunks"),
+            }
+        return ingested_state
+
 
 class ArticleTextProcessing:
+    CITATION_PATTERN = re.compile(r"\[(\d+)\]")
+
     @staticmethod
     def limit_word_count_preserve_newline(input_string, max_word_count):
         """
@@ -360,8 +564,56 @@ class ArticleTextProcessing:
         Returns:
             List[int]: A list of unique citation indexes extracted from the content, in the order they appear.
         """
-        matches = re.findall(r"\[\d+\]", s)
-        return [int(index[1:-1]) for index in matches]
+        return [
+            int(index) for index in ArticleTextProcessing.CITATION_PATTERN.findall(s)
+        ]
+
+    @staticmethod
+    def parse_citation_segments(s):
+        """
+        Splits the string into text segments and citation indices, so that citations can be inspected and
+        renumbered without scanning the text again.
+
+        Args:
+            s (str): The string containing citations in the format [number].
+
+        Returns:
+            List[Union[str, int]]: Text segments (str) interleaved with citation indices (int), in order of appearance.
+                                   Joining them with `render_citation_segments` gives back the original string.
+        """
+        segments = []
+        last_end = 0
+        for match in ArticleTextProcessing.CITATION_PATTERN.finditer(s):
+            if match.start() > last_end:
+                segments.append(s[last_end : match.start()])
+            segments.append(int(match.group(1)))
+            last_end = match.end()
+        if last_end < len(s):
+            segments.append(s[last_end:])
+        return segments
+
+    @staticmethod
+    def render_citation_segments(segments, citation_map=None):
+        """
+        Joins segments produced by `parse_citation_segments` back into a string.
+
+        Args:
+            segments (List[Union[str, int]]): Text segments and citation indices.
+            citation_map (Dict[int, int], optional): Maps original citation indices to new ones.
+                                                     Citations not in the map are kept unchanged.
+
+        Returns:
+            str: The rendered string with citations in the format [number].
+        """
+        output = []
+        for segment in segments:
+            if isinstance(segment, int):
+                if citation_map is not None:
+                    segment = citation_map.get(segment, segment)
+                output.append(f"[{segment}]")
+            else:
+                output.append(segment)
+        return "".join(output)
 
     @staticmethod
     def remove_uncompleted_sentences_with_citations(text):
@@ -540,14 +792,16 @@ class ArticleTextProcessing:
     @staticmethod
     def update_citation_index(s, citation_map):
         """Update citation index in the string based on the citation map."""
-        for original_citation in citation_map:
-            s = s.replace(
-                f"[{original_citation}]", f"__PLACEHOLDER_{original_citation}__"
-            )
-        for original_citation, unify_citation in citation_map.items():
-            s = s.replace(f"__PLACEHOLDER_{original_citation}__", f"[{unify_citation}]")
+        citation_map = {int(k): v for k, v in citation_map.items()}
 
-        return s
+        def replace_citation(match):
+            citation = int(match.group(1))
+            if citation in citation_map:
+                return f"[{citation_map[citation]}]"
+            return match.group(0)
+
+        # single pass, so that remapped citations are never remapped again
+        return ArticleTextProcessing.CITATION_PATTERN.sub(replace_citation, s)
 
     @staticmethod
     def parse_article_into_dict(input_string):
@@ -594,6 +848,173 @@ class ArticleTextProcessing:
         return root["subsections"]
 
 
+class BM25Index:
+    """
+    Lexical inverted index scored with Okapi BM25.
+
+    Documents are added incrementally and identified by their insertion order. A search only visits the posting
+    lists of the query terms, so its cost depends on how many documents share a term with the query rather than on
+    the size of the index.
+    """
+
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[tuple]] = {}
+        self.doc_lengths: List[int] = []
+        self.total_length = 0
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return BM25Index.TOKEN_PATTERN.findall(text.lower())
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, text: str) -> int:
+        """Indexes `text` and returns its document id."""
+        doc_id = len(self.doc_lengths)
+        tokens = self.tokenize(text)
+        for term, term_freq in collections.Counter(tokens).items():
+            self.postings.setdefault(term, []).append((doc_id, term_freq))
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        return doc_id
+
+    def search(self, query: str, top_k: int) -> List[tuple]:
+        """Returns up to `top_k` (document id, score) pairs with a positive score, best first."""
+        if len(self.doc_lengths) == 0:
+            return []
+        num_docs = len(self.doc_lengths)
+        avg_doc_length = max(self.total_length / num_docs, 1e-9)
+        scores = collections.defaultdict(float)
+        for term in set(self.tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, term_freq in postings:
+                length_norm = (
+                    1 - self.b + self.b * self.doc_lengths[doc_id] / avg_doc_length
+                )
+                scores[doc_id] += (
+                    idf
+                    * term_freq
+                    * (self.k1 + 1)
+                    / (term_freq + self.k1 * length_norm)
+                )
+        return heapq.nlargest(top_k, scores.items(), key=lambda x: (x[1], -x[0]))
+
+
+class SourceFilter:
+    """
+    Compiled allow/deny rules for search result URLs. An instance is a callable that takes a URL and returns a
+    boolean, so it can be passed as `is_valid_source` to the retrieval modules in rm.py.
+
+    Rules are matched against the network location of the URL:
+        - deny_patterns: case-sensitive substrings of the network location (e.g., site names from a blocklist),
+            matched with an Aho-Corasick automaton so the cost of a check does not grow with the number of patterns.
+        - deny_domains / allow_domains: domains matched on label boundaries, so "example.com" matches
+            "example.com" and "news.example.com" but not "myexample.com".
+    A host matching an allow domain is always valid. Otherwise it is invalid if it matches a deny rule, and valid
+    if `default_allow` is True. Verdicts are cached per host.
+    """
+
+    def __init__(
+        self,
+        deny_patterns: Iterable[str] = (),
+        deny_domains: Iterable[str] = (),
+        allow_domains: Iterable[str] = (),
+        default_allow: bool = True,
+        cache_size: int = 65536,
+    ):
+        self._goto = [{}]
+        self._fail = [0]
+        self._is_match = [False]
+        for pattern in deny_patterns:
+            self._add_pattern(pattern)
+        self._build_failure_links()
+        self._deny_domains = self._build_domain_trie(deny_domains)
+        self._allow_domains = self._build_domain_trie(allow_domains)
+        self.default_allow = default_allow
+        self._host_verdict = functools.lru_cache(maxsize=cache_size)(
+            self._compute_host_verdict
+        )
+
+    def _add_pattern(self, pattern: str):
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._is_match.append(False)
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._is_match[state] = True
+
+    def _build_failure_links(self):
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # a state matches if any pattern ending here, including shorter suffixes, matches
+                self._is_match[next_state] = (
+                    self._is_match[next_state] or self._is_match[self._fail[next_state]]
+                )
+
+    def _contains_deny_pattern(self, text: str) -> bool:
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._is_match[state]:
+                return True
+        return False
+
+    @staticmethod
+    def _build_domain_trie(domains: Iterable[str]) -> Dict:
+        """Trie over reversed domain labels; a node containing the key None ends a domain."""
+        trie = {}
+        for domain in domains:
+            node = trie
+            for label in reversed(domain.lower().strip(".").split(".")):
+                node = node.setdefault(label, {})
+            node[None] = True
+        return trie
+
+    @staticmethod
+    def _matches_domain(trie: Dict, host: str) -> bool:
+        node = trie
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def _compute_host_verdict(self, netloc: str) -> bool:
+        host = netloc.rsplit("@", 1)[-1].split(":", 1)[0].lower().rstrip(".")
+        if self._matches_domain(self._allow_domains, host):
+            return True
+        if self._contains_deny_pattern(netloc) or self._matches_domain(
+            self._deny_domains, host
+        ):
+            return False
+        return self.default_allow
+
+    def __call__(self, url: str) -> bool:
+        return self._host_verdict(urlparse(url).netloc)
+
+
 class FileIOHelper:
     @staticmethod
     def dump_json(obj, file_name, encoding="utf-8"):
@@ -648,6 +1069,9 @@ class WebPageHelper:
             snippet_chunk_size: Maximum character count for each snippet.
             max_thread_num: Maximum number of threads to use for concurrent requests (e.g., downloading webpages).
         """
+        import httpx
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
         self.httpx_client = httpx.Client(verify=False)
         self.min_char_count = min_char_count
         self.max_thread_num = max_thread_num
@@ -672,6 +1096,8 @@ class WebPageHelper:
         )
 
     def download_webpage(self, url: str):
+        import httpx
+
         try:
             res = self.httpx_client.get(url, timeout=4)
             if res.status_code >= 400:
@@ -682,6 +1108,8 @@ class WebPageHelper:
             return None
 
     def urls_to_articles(self, urls: List[str]) -> Dict:
+        from trafilatura import extract
+
         with concurrent.futures.ThreadPoolExecutor(
             max_workers=self.max_thread_num
         ) as executor:
@@ -710,8 +1138,37 @@ class WebPageHelper:
 
         return articles
 
+    @staticmethod
+    def prune_snippets(
+        query: str,
+        snippets: List[str],
+        max_snippets: int,
+        min_relevance: float = 0.0,
+    ) -> List[str]:
+        """
+        Keeps the `max_snippets` snippets of a page that are most relevant to `query` by BM25, in their original
+        order. Snippets scoring below `min_relevance` are dropped as well, but the best snippet is always kept.
+        """
+        if len(snippets) <= 1:
+            return snippets
+        index = BM25Index()
+        for snippet in snippets:
+            index.add(snippet)
+        # the index only returns snippets sharing a term with the query; the others score 0
+        scores = dict(index.search(query, len(snippets)))
+        ranked = sorted(range(len(snippets)), key=lambda i: (-scores.get(i, 0.0), i))
+        keep = set(
+            i for i in ranked[:max_snippets] if scores.get(i, 0.0) >= min_relevance
+        )
+        if not keep:
+            # keep the best snippet, or the first one if no snippet shares a term with the query
+            keep = {ranked[0]}
+        return [snippet for i, snippet in enumerate(snippets) if i in keep]
+
 
 def user_input_appropriateness_check(user_input):
+    from .lm import LitellmModel
+
     my_openai_model = LitellmModel(
         model="azure/gpt-4o-mini",
         max_tokens=10,
@@ -767,6 +1224,8 @@ User input: {user_input}"""
 
 
 def purpose_appropriateness_check(user_input):
+    from .lm import LitellmModel
+
     my_openai_model = LitellmModel(
         model="azure/gpt-4o-mini",
         max_tokens=10,
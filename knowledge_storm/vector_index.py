@@ -0,0 +1,472 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+
+class LocalVectorIndex:
+    """
+    Embedded vector index stored in a directory, can be used with `VectorRM` in rm.py instead of a Qdrant collection.
+
+    The index directory contains:
+        - index.json: manifest (number of vectors, dimension, dtype, number of IVF lists, embedding model).
+        - vectors.npy: (n, dim) float16 or float32 matrix of normalized embeddings, opened with `mmap_mode="r"`.
+        - url_ids.npy: (n,) int32 url id of each vector, used to filter out excluded urls.
+        - centroids.npy, list_offsets.npy: IVF-flat coarse quantizer. Vectors are stored grouped by list so that the
+            vectors of list i are the contiguous rows `list_offsets[i]:list_offsets[i + 1]`.
+        - metadata.sqlite: content, title and description of each vector and the url table.
+
+    An index is never modified in place; `build` writes a new directory and swaps it in. Opening an index maps the
+    files read-only, so any number of processes can share one index through the page cache without loading it into
+    memory or holding a lock.
+    """
+
+    MANIFEST_FILE = "index.json"
+    VECTORS_FILE = "vectors.npy"
+    URL_IDS_FILE = "url_ids.npy"
+    CENTROIDS_FILE = "centroids.npy"
+    LIST_OFFSETS_FILE = "list_offsets.npy"
+    METADATA_FILE = "metadata.sqlite"
+    FORMAT_VERSION = 1
+
+    def __init__(self, index_dir: str, nprobe: int = 8):
+        """
+        Args:
+            index_dir (str): Directory of an index created by `build` or `create_from_csv`.
+            nprobe (int): Number of IVF lists to scan per query. Ignored for flat indexes (`num_lists == 0`).
+        """
+        manifest_path = os.path.join(index_dir, self.MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise ValueError(f"No vector index found in {index_dir}.")
+        with open(manifest_path, "r") as f:
+            self.manifest = json.load(f)
+        if self.manifest["format_version"] != self.FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported vector index format version {self.manifest['format_version']}."
+            )
+
+        self.index_dir = index_dir
+        self.nprobe = nprobe
+        self.vectors = np.load(
+            os.path.join(index_dir, self.VECTORS_FILE), mmap_mode="r"
+        )
+        self.url_ids = np.load(
+            os.path.join(index_dir, self.URL_IDS_FILE), mmap_mode="r"
+        )
+        self.centroids = np.load(os.path.join(index_dir, self.CENTROIDS_FILE))
+        self.list_offsets = np.load(os.path.join(index_dir, self.LIST_OFFSETS_FILE))
+        # immutable=1: the file never changes while it is open, so SQLite skips locking entirely.
+        self._metadata_conn = sqlite3.connect(
+            f"file:{os.path.abspath(os.path.join(index_dir, self.METADATA_FILE))}?mode=ro&immutable=1",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._metadata_lock = threading.Lock()
+
+    @property
+    def dim(self) -> int:
+        return self.manifest["dim"]
+
+    @property
+    def num_lists(self) -> int:
+        return self.manifest["num_lists"]
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    def close(self):
+        self._metadata_conn.close()
+
+    def _url_ids_of(self, urls: Sequence[str]) -> np.ndarray:
+        if not urls:
+            return np.empty(0, dtype=np.int32)
+        urls = list(dict.fromkeys(urls))
+        url_ids = []
+        with self._metadata_lock:
+            # stay below SQLite's limit on the number of host parameters
+            for i in range(0, len(urls), 500):
+                batch = urls[i : i + 500]
+                rows = self._metadata_conn.execute(
+                    f"SELECT id FROM urls WHERE url IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                url_ids.extend(row[0] for row in rows)
+        return np.asarray(url_ids, dtype=np.int32)
+
+    def _candidate_ranges(self, query_vector: np.ndarray) -> List[Tuple[int, int]]:
+        if self.num_lists == 0:
+            return [(0, len(self))]
+        centroid_scores = self.centroids @ query_vector
+        nprobe = min(self.nprobe, self.num_lists)
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return [
+            (int(self.list_offsets[i]), int(self.list_offsets[i + 1]))
+            for i in sorted(probed)
+            if self.list_offsets[i] < self.list_offsets[i + 1]
+        ]
+
+    def _search_one(
+        self,
+        query_vector: np.ndarray,
+        k: int,
+        excluded_url_ids: np.ndarray,
+        block_size: int = 65536,
+    ) -> List[Tuple[int, float]]:
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start, end in self._candidate_ranges(query_vector):
+            for block_start in range(start, end, block_size):
+                block_end = min(block_start + block_size, end)
+                scores = (
+                    self.vectors[block_start:block_end].astype(np.float32)
+                    @ query_vector
+                )
+                if len(excluded_url_ids) > 0:
+                    scores[
+                        np.isin(self.url_ids[block_start:block_end], excluded_url_ids)
+                    ] = -np.inf
+                ids = np.arange(block_start, block_end, dtype=np.int64)
+                best_ids = np.concatenate([best_ids, ids])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_ids) > k:
+                    top = np.argpartition(-best_scores, k - 1)[:k]
+                    best_ids, best_scores = best_ids[top], best_scores[top]
+        order = np.argsort(-best_scores, kind="stable")
+        return [
+            (int(best_ids[i]), float(best_scores[i]))
+            for i in order
+            if np.isfinite(best_scores[i])
+        ]
+
+    def search(
+        self,
+        query_vectors: Sequence[Sequence[float]],
+        k: int,
+        exclude_urls: Optional[Sequence[str]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Find the k nearest vectors (by inner product) of each query vector.
+
+        Args:
+            query_vectors: Normalized query embeddings, one per query.
+            k: Number of results per query.
+            exclude_urls: Vectors whose url is in this list are never returned.
+
+        Returns:
+            For each query, a list of (vector id, score) sorted by decreasing score.
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        if query_vectors.ndim == 1:
+            query_vectors = query_vectors[None, :]
+        # an empty index has nothing to compare with, whatever its recorded dimension
+        if k <= 0 or len(self) == 0:
+            return [[] for _ in range(len(query_vectors))]
+        if query_vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"Query dimension {query_vectors.shape[1]} does not match the index dimension {self.dim}."
+            )
+        excluded_url_ids = self._url_ids_of(exclude_urls or [])
+        return [
+            self._search_one(query_vector, k, excluded_url_ids)
+            for query_vector in query_vectors
+        ]
+
+    def get_records(self, ids: Sequence[int]) -> Dict[int, Dict[str, str]]:
+        """Returns vector id -> {"content", "title", "url", "description"} for the given ids."""
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        records = {}
+        with self._metadata_lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i : i + 500]
+                rows = self._metadata_conn.execute(
+                    "SELECT records.id, records.content, records.title, records.description, urls.url "
+                    "FROM records JOIN urls ON records.url_id = urls.id "
+                    f"WHERE records.id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for record_id, content, title, description, url in rows:
+                    records[record_id] = {
+                        "content": content,
+                        "title": title,
+                        "url": url,
+                        "description": description,
+                    }
+        return records
+
+    @staticmethod
+    def _train_centroids(
+        vectors: np.ndarray,
+        num_lists: int,
+        num_iterations: int = 10,
+        max_training_points: int = 256,
+        seed: int = 0,
+    ) -> np.ndarray:
+        """Spherical k-means on a sample of the vectors."""
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), num_lists * max_training_points)
+        sample = np.sort(rng.choice(len(vectors), size=sample_size, replace=False))
+        sample = np.asarray(vectors[sample], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)]
+        for _ in range(num_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for j in range(num_lists):
+                members = sample[assignment == j]
+                if len(members) > 0:
+                    centroids[j] = members.sum(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids = centroids / np.maximum(norms, 1e-12)
+        return centroids
+
+    @staticmethod
+    def _assign(
+        vectors: np.ndarray, centroids: np.ndarray, block_size: int = 65536
+    ) -> np.ndarray:
+        assignment = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start : start + block_size], dtype=np.float32)
+            assignment[start : start + block_size] = np.argmax(
+                block @ centroids.T, axis=1
+            )
+        return assignment
+
+    @classmethod
+    def build(
+        cls,
+        index_dir: str,
+        vectors: np.ndarray,
+        records: Sequence[Dict[str, str]],
+        dtype: str = "float16",
+        num_lists: Optional[int] = None,
+        embedding_model: Optional[str] = None,
+        block_size: int = 65536,
+    ):
+        """
+        Writes an index for the given vectors to `index_dir`, replacing any index already there. The new index is
+        written next to `index_dir` and swapped in at the end, so processes that have the old index open keep
+        reading a consistent copy.
+
+        Args:
+            index_dir (str): Directory of the index.
+            vectors (np.ndarray): (n, dim) normalized embeddings. Can be a memory-mapped array.
+            records (Sequence[Dict[str, str]]): For each vector, a dict with keys "content", "url", and optionally
+                "title" and "description".
+            dtype (str): "float16" or "float32", the dtype of the stored vectors.
+            num_lists (Optional[int]): Number of IVF lists. 0 builds a flat index that is scanned exhaustively.
+                Default is about sqrt(n) for indexes with at least 10k vectors and 0 otherwise.
+            embedding_model (Optional[str]): Name of the embedding model, recorded in the manifest.
+        """
+        if dtype not in ("float16", "float32"):
+            raise ValueError("dtype must be 'float16' or 'float32'.")
+        if len(vectors) != len(records):
+            raise ValueError("vectors and records must have the same length.")
+        count = len(vectors)
+        dim = int(vectors.shape[1])
+        if num_lists is None:
+            num_lists = int(np.sqrt(count)) if count >= 10000 else 0
+        num_lists = min(num_lists, count)
+
+        if num_lists > 0:
+            centroids = cls._train_centroids(vectors, num_lists)
+            assignment = cls._assign(vectors, centroids, block_size=block_size)
+            order = np.argsort(assignment, kind="stable")
+            list_offsets = np.searchsorted(
+                assignment[order], np.arange(num_lists + 1)
+            ).astype(np.int64)
+        else:
+            centroids = np.empty((0, dim), dtype=np.float32)
+            order = np.arange(count)
+            list_offsets = np.zeros(1, dtype=np.int64)
+
+        parent_dir = os.path.dirname(os.path.abspath(index_dir))
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(
+            prefix=f".{os.path.basename(index_dir)}.", dir=parent_dir
+        )
+        try:
+            stored_vectors = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, cls.VECTORS_FILE),
+                mode="w+",
+                dtype=dtype,
+                shape=(count, dim),
+            )
+            for start in range(0, count, block_size):
+                stored_vectors[start : start + block_size] = vectors[
+                    order[start : start + block_size]
+                ]
+            stored_vectors.flush()
+            del stored_vectors
+
+            url_to_id = {}
+            url_ids = np.empty(count, dtype=np.int32)
+            conn = sqlite3.connect(os.path.join(tmp_dir, cls.METADATA_FILE))
+            conn.execute("CREATE TABLE urls (id INTEGER PRIMARY KEY, url TEXT UNIQUE)")
+            conn.execute(
+                "CREATE TABLE records (id INTEGER PRIMARY KEY, url_id INTEGER, content TEXT, title TEXT, "
+                "description TEXT)"
+            )
+            for new_id, old_id in enumerate(order):
+                record = records[int(old_id)]
+                url = record["url"]
+                if url not in url_to_id:
+                    url_to_id[url] = len(url_to_id)
+                    conn.execute(
+                        "INSERT INTO urls (id, url) VALUES (?, ?)",
+                        (url_to_id[url], url),
+                    )
+                url_ids[new_id] = url_to_id[url]
+                conn.execute(
+                    "INSERT INTO records (id, url_id, content, title, description) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        new_id,
+                        url_to_id[url],
+                        record["content"],
+                        record.get("title", ""),
+                        record.get("description", ""),
+                    ),
+                )
+            conn.commit()
+            conn.close()
+
+            np.save(os.path.join(tmp_dir, cls.URL_IDS_FILE), url_ids)
+            np.save(os.path.join(tmp_dir, cls.CENTROIDS_FILE), centroids)
+            np.save(os.path.join(tmp_dir, cls.LIST_OFFSETS_FILE), list_offsets)
+            with open(os.path.join(tmp_dir, cls.MANIFEST_FILE), "w") as f:
+                json.dump(
+                    {
+                        "format_version": cls.FORMAT_VERSION,
+                        "count": count,
+                        "dim": dim,
+                        "dtype": dtype,
+                        "num_lists": num_lists,
+                        "metric": "inner_product",
+                        "embedding_model": embedding_model,
+                    },
+                    f,
+                    indent=2,
+                )
+
+            # directories cannot be replaced atomically if the target exists; move the old index aside first
+            old_dir = None
+            if os.path.exists(index_dir):
+                old_dir = tempfile.mkdtemp(
+                    prefix=f".{os.path.basename(index_dir)}.old.", dir=parent_dir
+                )
+                os.rmdir(old_dir)
+                os.rename(index_dir, old_dir)
+            os.rename(tmp_dir, index_dir)
+            if old_dir is not None:
+                shutil.rmtree(old_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    @classmethod
+    def create_from_csv(
+        cls,
+        index_dir: str,
+        file_path: str,
+        content_column: str,
+        title_column: str = "title",
+        url_column: str = "url",
+        desc_column: str = "description",
+        batch_size: int = 64,
+        chunk_size: int = 500,
+        chunk_overlap: int = 100,
+        embedding_model: str = "BAAI/bge-m3",
+        device: str = "mps",
+        dtype: str = "float16",
+        num_lists: Optional[int] = None,
+    ):
+        """
+        Takes a CSV file in the format expected by `QdrantVectorStoreManager.create_or_update_vector_store`, splits
+        and embeds each row and builds a local index in `index_dir`.
+
+        Args:
+            index_dir (str): Directory of the index.
+            file_path (str): Path to the CSV file.
+            content_column (str): Name of the column containing the content.
+            title_column (str): Name of the column containing the title. Default is "title".
+            url_column (str): Name of the column containing the URL. Default is "url".
+            desc_column (str): Name of the column containing the description. Default is "description".
+            batch_size (int): Number of chunks embedded at once.
+            chunk_size: Size of each chunk.
+            chunk_overlap: Overlap between chunks.
+            embedding_model: Name of the Hugging Face embedding model.
+            device: Device to run the embeddings model on, can be "mps", "cuda", "cpu".
+            dtype (str): "float16" or "float32", the dtype of the stored vectors.
+            num_lists (Optional[int]): Number of IVF lists, see `build`.
+        """
+        from .utils import QdrantVectorStoreManager
+
+        if file_path is None or not file_path.endswith(".csv"):
+            raise ValueError(f"Not valid file format. Please provide a csv file.")
+
+        import pandas as pd
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        model = HuggingFaceEmbeddings(
+            model_name=embedding_model,
+            model_kwargs={"device": device},
+            encode_kwargs={"normalize_embeddings": True},
+        )
+
+        df = pd.read_csv(file_path)
+        if content_column not in df.columns:
+            raise ValueError(
+                f"Content column {content_column} not found in the csv file."
+            )
+        if url_column not in df.columns:
+            raise ValueError(f"URL column {url_column} not found in the csv file.")
+
+        text_splitter = QdrantVectorStoreManager.create_text_splitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+        records = []
+        for row in df.to_dict(orient="records"):
+            for chunk in text_splitter.split_text(row[content_column]):
+                records.append(
+                    {
+                        "content": chunk,
+                        "title": row.get(title_column, ""),
+                        "url": row[url_column],
+                        "description": row.get(desc_column, ""),
+                    }
+                )
+
+        # embed into a scratch memory map so that the corpus never has to fit in memory as float32
+        os.makedirs(os.path.dirname(os.path.abspath(index_dir)), exist_ok=True)
+        with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(os.path.abspath(index_dir))
+        ) as scratch_dir:
+            vectors = None
+            for start in tqdm(range(0, len(records), batch_size)):
+                batch = records[start : start + batch_size]
+                embeddings = np.asarray(
+                    model.embed_documents([record["content"] for record in batch]),
+                    dtype=np.float32,
+                )
+                if vectors is None:
+                    vectors = np.lib.format.open_memmap(
+                        os.path.join(scratch_dir, "vectors.npy"),
+                        mode="w+",
+                        dtype=dtype,
+                        shape=(len(records), embeddings.shape[1]),
+                    )
+                vectors[start : start + len(batch)] = embeddings
+            if vectors is None:
+                vectors = np.empty((0, 0), dtype=dtype)
+            cls.build(
+                index_dir,
+                vectors,
+                records,
+                dtype=dtype,
+                num_lists=num_lists,
+                embedding_model=embedding_model,
+            )
+            del vectors
@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# without the heavy dependencies installed, their absence from sys.modules proves nothing
+pytest.importorskip("dspy")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["dspy", "litellm", "qdrant_client", "sentence_transformers"]
+
+# seconds; importing dspy alone takes several times longer
+IMPORT_TIME_BUDGET = 0.5
+
+
+def _run(code):
+    """Runs `code` in a fresh interpreter and returns the JSON value it prints last."""
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _modules_loaded_after(code):
+    """Runs `code` in a fresh interpreter and returns which of HEAVY_MODULES it imported."""
+    return _run(
+        "import json, sys\n"
+        f"{code}\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+
+
+def test_import_does_not_load_heavy_dependencies():
+    assert _modules_loaded_after("import knowledge_storm") == []
+
+
+def test_listing_exports_does_not_load_heavy_dependencies():
+    code = (
+        "import knowledge_storm\n"
+        "assert 'STORMWikiRunner' in knowledge_storm.__all__\n"
+        "assert 'CoStormRunner' in dir(knowledge_storm)"
+    )
+    assert _modules_loaded_after(code) == []
+
+
+def test_attribute_access_loads_submodule():
+    code = "import knowledge_storm\nknowledge_storm.STORMWikiRunner"
+    assert "dspy" in _modules_loaded_after(code)
+
+
+def test_import_time_budget():
+    elapsed = _run(
+        "import json, time\n"
+        "start = time.perf_counter()\n"
+        "import knowledge_storm\n"
+        "print(json.dumps(time.perf_counter() - start))"
+    )
+    assert elapsed < IMPORT_TIME_BUDGET
+
+
+def test_every_export_resolves():
+    code = (
+        "import json\n"
+        "import knowledge_storm\n"
+        "import knowledge_storm.storm_wiki\n"
+        "import knowledge_storm.storm_wiki.modules\n"
+        "import knowledge_storm.collaborative_storm\n"
+        "import knowledge_storm.collaborative_storm.modules\n"
+        "packages = [knowledge_storm, knowledge_storm.storm_wiki, knowledge_storm.storm_wiki.modules,\n"
+        "            knowledge_storm.collaborative_storm, knowledge_storm.collaborative_storm.modules]\n"
+        "missing = []\n"
+        "for package in packages:\n"
+        "    for name in package.__all__:\n"
+        "        try:\n"
+        "            getattr(package, name)\n"
+        "        except AttributeError:\n"
+        "            missing.append(f'{package.__name__}.{name}')\n"
+        "print(json.dumps(missing))"
+    )
+    assert _run(code) == []
@@ -0,0 +1,71 @@
+"""
+The `_LAZY_SUBMODULE_ATTRS` registries in the package `__init__` files replace star imports, so each entry must list
+exactly the public names its submodule defines. They are checked against the submodules' source, which works without
+importing any dependency.
+"""
+
+import ast
+import os
+
+import pytest
+
+PACKAGE_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "knowledge_storm"
+)
+
+
+def _read_registry(init_path):
+    for node in ast.parse(open(init_path, encoding="utf-8").read()).body:
+        if (
+            isinstance(node, ast.Assign)
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id == "_LAZY_SUBMODULE_ATTRS"
+        ):
+            return ast.literal_eval(node.value)
+    return None
+
+
+def _public_definitions(module_path):
+    """Public names a star import of the module provides, apart from the names the module imports itself."""
+    names = []
+    for node in ast.parse(open(module_path, encoding="utf-8").read()).body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            names.append(node.name)
+        elif isinstance(node, ast.Assign):
+            names.extend(
+                target.id for target in node.targets if isinstance(target, ast.Name)
+            )
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            names.append(node.target.id)
+    return set(name for name in names if not name.startswith("_"))
+
+
+def _registry_entries():
+    entries = []
+    for dir_path, _, file_names in os.walk(PACKAGE_ROOT):
+        if "__init__.py" not in file_names:
+            continue
+        registry = _read_registry(os.path.join(dir_path, "__init__.py"))
+        for submodule, names in (registry or {}).items():
+            module_path = (
+                os.path.join(dir_path, *submodule.lstrip(".").split(".")) + ".py"
+            )
+            entries.append(
+                pytest.param(
+                    module_path,
+                    names,
+                    id=f"{os.path.relpath(dir_path, PACKAGE_ROOT)}:{submodule}",
+                )
+            )
+    return entries
+
+
+def test_registries_are_found():
+    assert len(_registry_entries()) > 0
+
+
+@pytest.mark.parametrize("module_path,names", _registry_entries())
+def test_registry_matches_submodule(module_path, names):
+    assert os.path.exists(module_path)
+    assert len(names) == len(set(names))
+    assert set(names) == _public_definitions(module_path)